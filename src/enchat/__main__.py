@@ -1,5 +1,13 @@
-from enchat.app import main
+import sys
+import time
 
 if __name__ == "__main__":
-    main().main_loop()
+    started = time.perf_counter()
 
+    if "--batch" in sys.argv[1:]:
+        # The batch mode runs without the UI, so the app (and its GUI backend) is never imported
+        from enchat.batch import main
+        sys.exit(main())
+
+    from enchat.app import main
+    main(started).main_loop()
@@ -1,51 +1,184 @@
+import asyncio
 import logging
+import os
+import time
 import toga
 from toga.style.pack import COLUMN, ROW, Pack
-from enchat.message_box import MessageBox
-from enchat.chat_configuration_box import ChatConfigurationBox
-from enchat.system_configuration_box import SystemConfigurationBox
-
-logging.basicConfig(level=logging.DEBUG)
+from enchat.conversation_store import ConversationStore
+from enchat.chat_history_view import ChatHistoryView
+from enchat.chat_manager import ChatManager
+from enchat.chat_parameters import DEFAULT_PARAMETERS, parse_candidates
+from enchat.completion_backend import CompletionBackend
+from enchat.completion_client import CompletionClient
+from enchat.diagnostics import Diagnostics
+from enchat.endpoint_pool import EndpointPool
+from enchat.request_metrics import MetricsExporter
+from enchat.response_cache import ResponseCache
+from enchat.search_index import SearchIndex
+from enchat.speculative_prefill import SpeculativePrefill
+from enchat.startup_timer import StartupTimer
+from enchat.update_scheduler import UpdateScheduler
 
 class EnChat(toga.App):
     """The main application class
 
     This class manages all UI elements at the top level. The GUI has the following main elements:
 
-    * The main chat screen content
-    * The Chat Configuration UI for manipipulating the parameters of the chat
+    * The main chat screen content, showing the active chat, with a selection of the chats
+    * The Chat Configuration UI for manipipulating the parameters of the active chat
     * The System Configuration UI for manipulating the system parameters
+    * The Search UI for finding messages in every chat
+    * The Diagnostics UI, reporting where the memory of the application goes (its command is in the menu, not the toolbar)
+
+    Only the main chat screen is built at startup, so the chat is interactive as soon as possible. The configuration and search
+    UIs (and their modules) are built the first time they are displayed, and the self.main_window.content attribute is switched
+    between them. Until then, the configuration is held in the `_chat_manager` and the `_endpoint_pool`.
+
+    There may be several chats, each with its own history and configuration, managed by the `_chat_manager`; any of them can be
+    generating a reply at the same time. Only the active chat is displayed: the one `ChatHistoryView` is switched between chats,
+    so the number of widgets does not grow with the number of chats.
+
+    Several candidate replies to a message can be generated at once (with the same parameters, or a sweep of parameter values),
+    and displayed side by side in a `CandidatesBox` above the next user message, until one of them is added to the chat.
+
+    While the next user message is being typed, the prompt it will be sent with is evaluated by the server ahead of time (see
+    `SpeculativePrefill`), so when it is sent, only the last few words are left to evaluate before the reply starts.
+
+    Changes to the displayed messages (e.g. each piece of a streamed reply) are merged and displayed at most once per frame, by
+    the `_update_scheduler`, so the cost of the UI does not grow with the rate at which replies are generated.
 
-    These UIs are all instantiated 'up front', and the self.main_window.content attribute is switched between them.
+    Replies are generated by a `CompletionBackend`, chosen in the System Configuration UI: llama.cpp-style servers over HTTP (the
+    default), a model run in a worker process of the application (`LocalBackend`), or deterministic stub replies for testing.
+
+    The memory of the application is measured periodically by the `_diagnostics`, which offload old history from memory when the
+    memory budget (set in the System Configuration UI) is exceeded.
+
+    Messages are indexed for searching as they are added to a chat. Messages saved before the application started are indexed in
+    a background thread once the main window is shown.
     
     Attributes:
+        self.startup_timer (StartupTimer): Measures the time taken for the main window to become interactive
         self._configure_chat_cmd (toga.Command): User command for configurating the current chat
         self._configure_system_cmd (toga.Command): User command for configuring the chat system
+        self._show_statistics_cmd (toga.Command): User command for displaying the latency and throughput statistics of the chat
+        self._search_cmd (toga.Command): User command for searching the messages of the chats
+        self._diagnostics_cmd (toga.Command): User command for displaying the memory diagnostics, next to the system configuration
         self._main_content_box (toga.Box): The box containing the main chat content
-        self._chat_configuration_box (toga.Box): The box containing the chat configuration UI
-        self._system_configuration_box (toga.Box): The box containing the system configuration UI
+        self._chat_sel (toga.Selection): Selection of the active chat
+        self._new_chat_btn (toga.Button): Button for starting a new chat
+        self._updating_chats (bool): Whether the chat selection is being changed by the application (so its changes should be
+            ignored)
+        self._chat_history_view (ChatHistoryView): The scrolling view over a window of the history of the active chat
+        self._chat_configuration_box (toga.Box): The box containing the chat configuration UI, or None until it is first displayed
+        self._system_configuration_box (toga.Box): The box containing the system configuration UI, or None until it is first
+            displayed
+        self._search_box (toga.Box): The box containing the search UI, or None until it is first displayed
+        self._diagnostics_box (toga.Box): The box containing the diagnostics UI, or None until it is first displayed
         self._next_user_message_mti (toga.MulilineTextInput) Text input control for the next user message
-        self._next_user_message_btn (toga.Button) Button for sending the next user message
+        self._next_user_message_btn (toga.Button) Button for sending the next user message (or queueing it, while a reply is
+            being generated)
+        self._stop_reply_btn (toga.Button) Button for stopping the reply being generated
+        self._candidates_txi (toga.TextInput) Text input for the candidates to generate for the next user message: a number, or a
+            sweep of parameter values (see `parse_candidates`)
+        self._compare_btn (toga.Button) Button for sending the next user message, and generating candidate replies to it
+        self._candidates_box (CandidatesBox): The box displaying the candidate replies of the active chat, or None until candidates
+            are first generated
+        self._endpoint_pool (EndpointPool): The pool of servers and their connections, shared by all requests
+        self._completion_client (CompletionClient): Client for requesting completions from the servers
+        self._backend (CompletionBackend): The backend generating the replies of every chat; the `_completion_client`, unless
+            another backend is chosen in the System Configuration UI
+        self._model_path (str): The model file run by the local backend, as last confirmed in the System Configuration UI
+        self._response_cache (ResponseCache): Cache of the replies to deterministic requests
+        self._search_index (SearchIndex): The index of the messages of every chat
+        self._chat_manager (ChatManager): The chats, each with its configuration as last confirmed in the Chat Configuration UI,
+            and the request path that turns each user message into a reply
+        self._update_scheduler (UpdateScheduler): Displays changes to messages at most once per frame
+        self._speculative_prefill (SpeculativePrefill): Warms the server's prompt cache with the next user message as it is typed
+        self._metrics_exporter (MetricsExporter): Exports the metrics of each reply, and of each chat, to files
+        self._diagnostics (Diagnostics): Takes periodic snapshots of the memory of the application, and keeps it within budget
+        DEFAULT_CHAT (str): The name of the chat displayed at startup
+        GREETING (str): The first message of each new chat
+        DEFAULT_SYSTEM_CONTENT (str): The system content of a new chat
+        DEFAULT_ENDPOINTS (list[tuple[str, float]]): The (address, weight) pairs of the servers used until the system is configured
+        MEGABYTE (int): The number of bytes in a megabyte, the unit of the memory cap in the System Configuration UI
+        SUMMARY_THRESHOLD (int): The most tokens of history sent with a prompt, before older messages are summarised, until the
+            system is configured
     """
 
+    DEFAULT_CHAT = "default"
+
+    GREETING = "Hello, there. What can I do for you today?"
+
+    DEFAULT_SYSTEM_CONTENT = "This is where the system content goes"
+
+    DEFAULT_ENDPOINTS = [("http://localhost:1234", 1.0)]
+
+    MEGABYTE = 1024 * 1024
+
+    SUMMARY_THRESHOLD = 2048
+
+    def __init__(self, *args, startup_timer : StartupTimer = None, **kwargs):
+        """Set up the application
+
+        Args:
+            startup_timer (StartupTimer): The timer measuring the application's start, if it was started earlier (e.g. before
+                importing this module); otherwise timing starts now
+            args, kwargs: Passed to `toga.App`
+        """
+        self.startup_timer = startup_timer if startup_timer is not None else StartupTimer()
+        super(EnChat, self).__init__(*args, **kwargs)
+
     def startup(self):
         """Build the GUI elements of the application, including the main window
 
-        This method is called to start the application.
+        This method is called to start the application. The start-up time is reported once the event loop is free to handle
+        input, i.e. when the main window is interactive.
         """
 
+        self.startup_timer.mark("app")
+        self.on_exit = self.on_app_exit
         self.build_main_window()
+        self._endpoint_pool.start_probes(self.loop)
+        self._diagnostics.start(self.loop)
+        self.startup_timer.mark("build")
         self.main_window.show()
+        self.startup_timer.mark("show")
+        self.loop.call_soon(self.on_interactive)
+        self.loop.run_in_executor(None, self.index_saved_chats)
+
+    def on_interactive(self):
+        """Report the start-up time, at the first turn of the event loop after the main window was shown"""
+        self.startup_timer.mark("first event")
+        self.startup_timer.log()
     
     def build_main_window(self):
         """Build the main window of the application
 
+        The configuration boxes are not built here; see `build_chat_configuration_box` and `build_system_configuration_box`.
+
         This method initialises the following attributes:        
         * self._configure_chat_cmd
         * self._configure_system_cmd
+        * self._show_statistics_cmd
+        * self._search_cmd
+        * self._diagnostics_cmd
         * self._main_content_box
-        * self._chat_configuration_box
-        * self._system_configuration_box
+        * self._chat_configuration_box (to None)
+        * self._system_configuration_box (to None)
+        * self._search_box (to None)
+        * self._diagnostics_box (to None)
+        * self._candidates_box (to None)
+        * self._endpoint_pool
+        * self._completion_client
+        * self._backend
+        * self._model_path
+        * self._response_cache
+        * self._search_index
+        * self._chat_manager
+        * self._update_scheduler
+        * self._speculative_prefill
+        * self._metrics_exporter
+        * self._diagnostics
         """
 
         self._configure_chat_cmd = toga.Command(
@@ -62,130 +195,744 @@ class EnChat(toga.App):
             order=2
         )
 
+        self._show_statistics_cmd = toga.Command(
+            self.show_statistics,
+            text="Statistics",
+            tooltip="Latency and throughput of the replies in this chat",
+            order=4
+        )
+
+        self._search_cmd = toga.Command(
+            self.search,
+            text="Search",
+            tooltip="Find messages in this chat and saved chats",
+            order=5
+        )
+
+        self._diagnostics_cmd = toga.Command(
+            self.show_diagnostics,
+            text="Diagnostics",
+            tooltip="Memory used by the chats, widgets and caches, and snapshots of it over time",
+            order=3
+        )
+
+        self._chat_configuration_box = None
+        self._system_configuration_box = None
+        self._search_box = None
+        self._diagnostics_box = None
+        self._candidates_box = None
+        self._endpoint_pool = EndpointPool(EnChat.DEFAULT_ENDPOINTS)
+        self._completion_client = CompletionClient(self._endpoint_pool)
+        self._backend = self._completion_client
+        self._model_path = ""
+        self._response_cache = ResponseCache(self.paths.cache / "responses")
+        self._search_index = SearchIndex(open_history=lambda name: self._chat_manager.history(name))
+        self._chat_manager = ChatManager(self.paths.data / "chats", self._backend, EnChat.DEFAULT_SYSTEM_CONTENT,
+                                         DEFAULT_PARAMETERS, response_cache=self._response_cache,
+                                         search_index=self._search_index, greeting=EnChat.GREETING,
+                                         summary_threshold=EnChat.SUMMARY_THRESHOLD)
+        self._chat_manager.activate(EnChat.DEFAULT_CHAT)
+        self._speculative_prefill = SpeculativePrefill()
+        self._update_scheduler = UpdateScheduler()
+        self._metrics_exporter = MetricsExporter(self.paths.data / "metrics")
+        self._diagnostics = Diagnostics(self._chat_manager, response_cache=self._response_cache, search_index=self._search_index)
         self.build_main_content_box()
-        self._chat_configuration_box = ChatConfigurationBox(
-                system_content="This is where the system content goes",
-                on_ok=self.on_chat_configuration_ok,
-                on_cancel=self.on_chat_configuration_cancel)
-        self._system_configuration_box = SystemConfigurationBox("http://localhost:1234", on_ok=self.on_system_configuration_ok, 
-                                                               on_cancel=self.on_system_configuration_cancel)
 
         # Set up the main window, initially containing the main content box        
         self.main_window = toga.MainWindow()
         self.main_window.toolbar.add(self._configure_chat_cmd)
         self.main_window.toolbar.add(self._configure_system_cmd)
+        self.main_window.toolbar.add(self._diagnostics_cmd)
+        self.main_window.toolbar.add(self._show_statistics_cmd)
+        self.main_window.toolbar.add(self._search_cmd)
         self.main_window.content = self._main_content_box
 
 
     def build_main_content_box(self) -> toga.Box:
         """Build the main content box for the application
 
-        This method initialises the self._main_content_box and self.chat_box attributes.
+        This method initialises the self._main_content_box and self._chat_history_view attributes.
         """
 
-        # Create a Box for the chat message history, inside a scroll container
-        self._chat_box = toga.Box(style=Pack(direction=COLUMN))
-        self._chat_box.add(MessageBox("assistant", "Hello, there. What can I do for you today?"))
+        # Create a scrolling view that only displays the messages near the visible part of the active chat's history (which is
+        # saved in, and paged in from, the chat's conversation store)
+        self._chat_history_view = ChatHistoryView(self._chat_manager.active.history, scheduler=self._update_scheduler)
+        self._chat_history_view.style.flex = 1
 
-        chat_scr = toga.ScrollContainer(horizontal=False)
-        chat_scr.style.flex = 1
-        chat_scr.content = self._chat_box
+        # Create the main box with the chat selection, the scroll container and a box for the next user message
+        self._main_content_box = toga.Box(style=Pack(direction=COLUMN),
+                                          children=[self.create_chat_selection_box(), self._chat_history_view,
+                                                    self.create_next_user_message_box()])
+
+    def create_chat_selection_box(self) -> toga.Box:
+        """Create the box for choosing the active chat, and starting new chats
+
+        This method builds the `_chat_sel` and `_new_chat_btn` attributes, and returns the box containing them, which is inserted
+        into a parent without being retained as an object attribute.
+
+        Returns:
+            toga.Box: The box containing the user controls for choosing the chat
+        """
+        self._updating_chats = False
+        self._chat_sel = toga.Selection(items=list(self._chat_manager.chats), value=self._chat_manager.active.name,
+                                        on_change=self.on_chat_selected)
+        self._chat_sel.style.flex = 1
+        self._new_chat_btn = toga.Button(text="New chat", on_press=self.new_chat)
+
+        return toga.Box(style=Pack(direction=ROW), children=[self._chat_sel, self._new_chat_btn])
 
-        # Create the main box with the scroll container and a box for the next user message
-        self._main_content_box = toga.Box(style=Pack(direction=COLUMN), children=[chat_scr, self.create_next_user_message_box()])
-    
     def create_next_user_message_box(self) -> toga.Box:
         """Create the box for the user to enter the next new message
 
-        This method builds the `_next_user_message_mti` and `_next_user_message_btn` attributes, and returns the box containing them, which
-        is inserted into a parent without being retained as an object attribute.
+        This method builds the `_next_user_message_mti`, `_next_user_message_btn`, `_stop_reply_btn`, `_candidates_txi` and
+        `_compare_btn` attributes, and returns the box containing them, which is inserted into a parent without being retained as
+        an object attribute.
 
         Returns:
             toga.Box: The box containing the user controls for entering a new message
         """
-        self._next_user_message_mti = toga.MultilineTextInput()
+        self._next_user_message_mti = toga.MultilineTextInput(on_change=self.on_draft_changed)
         self._next_user_message_mti.style.flex = 1
         self._next_user_message_btn = toga.Button(text=">", on_press=self.send_next_user_message)
+        self._stop_reply_btn = toga.Button(text="Stop", on_press=self.stop_reply, enabled=False)
+        self._candidates_txi = toga.TextInput(placeholder="3, or temperature=0.2,0.5,0.8", style=Pack(width=200))
+        self._compare_btn = toga.Button(text="Compare", on_press=self.compare_replies)
 
-        return toga.Box(style=Pack(direction=ROW), children=[self._next_user_message_mti, self._next_user_message_btn])
+        return toga.Box(style=Pack(direction=ROW),
+                        children=[self._next_user_message_mti, self._next_user_message_btn, self._stop_reply_btn,
+                                  self._candidates_txi, self._compare_btn])
 
-    def send_next_user_message(self, widget):
-        """Send the next user message
+    def build_chat_configuration_box(self):
+        """Build the Chat Configuration UI
 
-        TODO This is just a placeholder right now - it needs to be implemented
+        This method initialises the self._chat_configuration_box attribute. It is called the first time the UI is displayed, so
+        the UI (and its module) are not loaded at startup. The configuration of the active chat is shown in the UI each time it
+        is displayed.
+        """
+        from enchat.chat_configuration_box import ChatConfigurationBox
+
+        self._chat_configuration_box = ChatConfigurationBox(
+                system_content=self._chat_manager.active.session.system_content,
+                on_ok=self.on_chat_configuration_ok,
+                on_cancel=self.on_chat_configuration_cancel)
+
+    def build_system_configuration_box(self):
+        """Build the System Configuration UI, showing the current configuration of the endpoint pool
+
+        This method initialises the self._system_configuration_box attribute. It is called the first time the UI is displayed, so
+        the UI (and its module) are not loaded at startup.
+        """
+        from enchat.system_configuration_box import SystemConfigurationBox
+
+        self._system_configuration_box = SystemConfigurationBox(
+                [(endpoint.address, endpoint.weight) for endpoint in self._endpoint_pool.endpoints],
+                on_ok=self.on_system_configuration_ok,
+                on_cancel=self.on_system_configuration_cancel,
+                pool_size=self._endpoint_pool.pool_size,
+                connect_timeout=self._endpoint_pool.connect_timeout,
+                read_timeout=self._endpoint_pool.read_timeout,
+                memory_cap=self._chat_manager.memory_cap / EnChat.MEGABYTE,
+                frame_rate=self._update_scheduler.rate,
+                backend=self._backend.name,
+                model_path=self._model_path,
+                memory_budget=self._diagnostics.budget / EnChat.MEGABYTE,
+                summary_threshold=self._chat_manager.summary_threshold)
+
+    def build_search_box(self):
+        """Build the Search UI
+
+        This method initialises the self._search_box attribute. It is called the first time the UI is displayed, so the UI (and
+        its module) are not loaded at startup.
+        """
+        from enchat.search_box import SearchBox
+
+        self._search_box = SearchBox(on_change=self.on_search_changed, on_select=self.on_search_hit_selected,
+                                     on_close=self.on_search_close)
+
+    def build_diagnostics_box(self):
+        """Build the Diagnostics UI
+
+        This method initialises the self._diagnostics_box attribute. It is called the first time the UI is displayed, so the UI
+        (and its module) are not loaded at startup.
+        """
+        from enchat.diagnostics_box import DiagnosticsBox
+
+        self._diagnostics_box = DiagnosticsBox(on_refresh=self.on_diagnostics_refresh, on_trace=self.on_diagnostics_trace,
+                                               on_export=self.on_diagnostics_export, on_close=self.on_diagnostics_close)
+
+    def build_candidates_box(self):
+        """Build the box displaying candidate replies, and insert it above the next user message
+
+        This method initialises the self._candidates_box attribute. It is called the first time candidates are generated, so the
+        box (and its module) are not loaded at startup.
+        """
+        from enchat.candidates_box import CandidatesBox
+
+        self._candidates_box = CandidatesBox(on_promote=self.promote_candidate, scheduler=self._update_scheduler)
+        self._candidates_box.style.flex = 1
+        self._main_content_box.insert(2, self._candidates_box)
+
+    def create_backend(self, name : str) -> CompletionBackend:
+        """Create the backend with the given name, using the current configuration
+
+        The modules of the local and stub backends are only loaded if they are chosen.
+
+        Args:
+            name (str): The name of the backend (see `SystemConfigurationBox.BACKENDS`)
+
+        Returns:
+            CompletionBackend: The backend
+        """
+        if name == "local":
+            from enchat.local_backend import LocalBackend
+            return LocalBackend(self._model_path)
+        if name == "stub":
+            from enchat.stub_backend import StubBackend
+            return StubBackend()
+        return self._completion_client
+
+    def index_saved_chats(self):
+        """Index the messages saved before the application started, in every chat
+
+        This method runs in a background thread. The stores of chats that are not open are opened just long enough to index them.
+        """
+        count = 0
+        chats = list(self._chat_manager.chats.values())
+        for chat in chats:
+            store = chat.store
+            try:
+                if store is not None:
+                    count += self._search_index.index_store(chat.name, store)
+                else:
+                    store = ConversationStore(chat.directory)
+                    try:
+                        count += self._search_index.index_store(chat.name, store)
+                    finally:
+                        store.close()
+            except (OSError, ValueError) as e:
+                logging.warning(f"could not index the messages of chat {chat.name}: {e!r}")
+
+        logging.info(f"indexed {count} saved messages in {len(chats)} chats")
+
+    def on_chat_selected(self, widget):
+        """Display the chat chosen in the chat selection
+
+        Args:
+            widget (toga.Widget): The widget that invoked the method
+        """
+        if not self._updating_chats and widget.value != self._chat_manager.active.name:
+            self.switch_chat(widget.value)
+
+    def new_chat(self, widget):
+        """Start a new chat, with the default configuration, and display it
+
+        Args:
+            widget (toga.Widget): The widget that invoked the method
+        """
+        self.switch_chat(self._chat_manager.create().name)
+
+    def on_draft_changed(self, widget):
+        """Schedule a prefill of the next user message, as it is typed, unless the active chat is generating a reply
+
+        Args:
+            widget (toga.Widget): The widget that invoked the method
+        """
+        chat = self._chat_manager.active
+        if chat.reply_task is None:
+            self._speculative_prefill.draft_changed(chat.session, widget.value)
+
+    def switch_chat(self, name : str):
+        """Make a chat the active one, and display it
+
+        The history view is switched to the chat (recycling its widgets), and the unsent text of the next user message is kept
+        with the chat it was typed in. A reply being generated for the previous chat carries on in the background.
+
+        Args:
+            name (str): The name of the chat
+        """
+        self._chat_manager.active.draft = self._next_user_message_mti.value
+        chat = self._chat_manager.activate(name)
+        self._chat_history_view.history = chat.history
+        self._next_user_message_mti.value = chat.draft
+        if self._candidates_box is not None:
+            self._candidates_box.show(chat.candidates)
+
+        self._updating_chats = True
+        try:
+            # Chats are only ever added, so a change in the number of chats means the items are out of date
+            if len(self._chat_sel.items) != len(self._chat_manager.chats):
+                self._chat_sel.items = list(self._chat_manager.chats)
+            self._chat_sel.value = chat.name
+        finally:
+            self._updating_chats = False
+        self.update_reply_state()
+
+    async def send_next_user_message(self, widget):
+        """Send the next user message of the active chat, and stream the reply from the assistant into a new message box
+
+        The reply is requested through the chat's `ChatSession`, and displayed incrementally (through the chat history) as the
+        server generates it; the event loop is never blocked while waiting for the network. Once it is finished, its metrics are
+        exported.
+
+        Only one reply (or set of candidate replies) is generated at a time in each chat. Messages sent while a reply is being
+        generated are queued, and sent together as a single message when it finishes, rather than starting overlapping requests.
+        Other chats may generate their replies at the same time. Sending a message discards any candidate replies that were not
+        used.
 
         Args:
             widget: The widget object that invoked the action.
         """
-        self._chat_box.add(MessageBox("user", self._next_user_message_mti.value))
-        logging.debug("TODO Implement send next user message")
+        chat = self._chat_manager.active
+        user_message = self._next_user_message_mti.value
+        if not user_message.strip():
+            return
+
+        self._speculative_prefill.cancel()
+        self._next_user_message_mti.value = ""
+        chat.queued_messages.append(user_message)
+        if chat.reply_task is not None:
+            self.update_reply_state()
+            return
+
+        await self.send_queued_messages(chat)
+
+    async def send_queued_messages(self, chat):
+        """Send the queued messages of a chat, together, and any messages queued while the reply is generated
+
+        Args:
+            chat (Chat): The chat
+        """
+        self.show_candidates(chat, [])
+        while chat.queued_messages:
+            message = "\n\n".join(chat.queued_messages)
+            chat.queued_messages.clear()
+
+            chat.reply_task = asyncio.ensure_future(chat.session.send(message))
+            self.update_reply_state()
+            try:
+                await chat.reply_task
+            except asyncio.CancelledError:
+                # Only a stopped reply is expected here; cancellation of this handler itself is passed on
+                if not chat.reply_task.cancelled():
+                    raise
+            finally:
+                chat.reply_task = None
+
+            chat.last_used = time.monotonic()
+            if chat.session.last_metrics is not None:
+                self._metrics_exporter.record(chat.session.last_metrics, chat.session.stats, session=chat.name)
+
+        self.update_reply_state()
+        self._chat_manager.enforce_memory_cap()
+
+    async def compare_replies(self, widget):
+        """Send the next user message of the active chat, and generate several candidate replies to it at once
+
+        The candidates to generate are read from the candidates input: a number of candidates with the chat's parameters, or a
+        sweep of parameter values. The candidates are streamed side by side, and any of them can then be added to the history
+        with `promote_candidate`. Stopping the reply stops every candidate.
+
+        Args:
+            widget (toga.Widget): The widget that invoked the method
+        """
+        chat = self._chat_manager.active
+        user_message = self._next_user_message_mti.value
+        if not user_message.strip() or chat.reply_task is not None:
+            return
+        try:
+            variants = parse_candidates(self._candidates_txi.value, chat.session.parameters)
+        except ValueError as e:
+            await self.main_window.error_dialog("Compare replies", str(e))
+            return
+
+        def on_update(candidate):
+            if candidate.number >= len(chat.candidates):
+                chat.candidates.append(candidate)
+            if chat is self._chat_manager.active:
+                self._candidates_box.update(candidate)
+
+        if self._candidates_box is None:
+            self.build_candidates_box()
+        self.show_candidates(chat, [])
+        self._speculative_prefill.cancel()
+        self._next_user_message_mti.value = ""
+        chat.reply_task = asyncio.ensure_future(chat.session.generate_candidates(user_message, variants, on_update=on_update))
+        self.update_reply_state()
+        try:
+            await chat.reply_task
+        except asyncio.CancelledError:
+            # Only stopped candidates are expected here; cancellation of this handler itself is passed on
+            if not chat.reply_task.cancelled():
+                raise
+        finally:
+            chat.reply_task = None
+
+        chat.last_used = time.monotonic()
+        for candidate in chat.candidates:
+            self._metrics_exporter.record(candidate.metrics, chat.session.stats, session=chat.name)
+
+        self.update_reply_state()
+        if chat.queued_messages:
+            await self.send_queued_messages(chat)
+
+    def promote_candidate(self, candidate):
+        """Add a candidate reply of the active chat to its history, discarding the other candidates
+
+        Args:
+            candidate (Candidate): The candidate
+        """
+        chat = self._chat_manager.active
+        if candidate not in chat.candidates:
+            return
+        if chat.reply_task is not None:
+            chat.reply_task.cancel()
+        chat.session.promote(candidate)
+        self.show_candidates(chat, [])
+        self._chat_manager.enforce_memory_cap()
+
+    def show_candidates(self, chat, candidates : list):
+        """Set the candidate replies of a chat, and display them if it is the active chat
+
+        Args:
+            chat (Chat): The chat
+            candidates (list[Candidate]): The candidates; an empty list discards the candidates of the chat
+        """
+        chat.candidates = candidates
+        if self._candidates_box is not None and chat is self._chat_manager.active:
+            self._candidates_box.show(candidates)
+
+    def stop_reply(self, widget):
+        """Stop generating the current reply of the active chat
+
+        The stream is closed, which closes its connection to the server, so the server stops generating. The partial reply is
+        kept. Any queued messages are then sent.
+
+        Args:
+            widget (toga.Widget): The widget that invoked the method
+        """
+        chat = self._chat_manager.active
+        if chat.reply_task is not None:
+            chat.reply_task.cancel()
+
+    def update_reply_state(self):
+        """Update the buttons and commands to reflect whether the active chat is generating a reply, and how many messages are
+        queued
+
+        While a reply is being generated, it can be stopped, further messages are queued, and the configuration cannot be
+        changed. The configuration commands are left as they are while a configuration screen is shown, as that screen sets them.
+        """
+        chat = self._chat_manager.active
+        generating = chat.reply_task is not None
+        self._stop_reply_btn.enabled = generating
+        self._compare_btn.enabled = not generating
+        if self.main_window.content not in (self._chat_configuration_box, self._system_configuration_box):
+            self._configure_chat_cmd.enabled = not generating
+            self._configure_system_cmd.enabled = not generating
+
+        if not generating:
+            self._next_user_message_btn.text = ">"
+        elif chat.queued_messages:
+            self._next_user_message_btn.text = f"Queue ({len(chat.queued_messages)})"
+        else:
+            self._next_user_message_btn.text = "Queue"
+
+    async def show_statistics(self, widget):
+        """Display the aggregated latency and throughput statistics of the replies in the active chat
+
+        Args:
+            widget (toga.Widget): The widget that invoked the method
+        """
+        chat = self._chat_manager.active
+        await self.main_window.info_dialog(f"Statistics of {chat.name}", chat.session.stats.describe())
+
+    def show_diagnostics(self, widget):
+        """Display the Diagnostics UI, with a report of the memory of the application now
+
+        Args:
+            widget (toga.Widget): The widget that invoked the method
+        """
+        self.switch_to_diagnostics()
+
+    def on_diagnostics_refresh(self, widget):
+        """Display a new report of the memory of the application
+
+        Args:
+            widget (toga.Widget): The widget that invoked the method
+        """
+        self._diagnostics_box.report = self._diagnostics.describe()
+
+    def on_diagnostics_trace(self, widget):
+        """Start or stop tracing memory allocations, as set by the switch of the Diagnostics UI, and refresh the report
+
+        Args:
+            widget (toga.Widget): The widget that invoked the method
+        """
+        if self._diagnostics_box.tracing:
+            self._diagnostics.start_tracing()
+        else:
+            self._diagnostics.stop_tracing()
+        self.on_diagnostics_refresh(widget)
+
+    def on_diagnostics_export(self, widget):
+        """Export the memory snapshots to a file in the `diagnostics` directory of the application's data
+
+        Args:
+            widget (toga.Widget): The widget that invoked the method
+        """
+        try:
+            path = self._diagnostics.export(self.paths.data / "diagnostics")
+            self._diagnostics_box.status = f"Exported to {path}"
+        except OSError as e:
+            logging.error(f"could not export the memory snapshots: {e!r}")
+            self._diagnostics_box.status = f"Could not export: {e}"
+
+    def on_diagnostics_close(self, widget):
+        """Hide the Diagnostics UI
+
+        Args:
+            widget (toga.Widget): The widget that invoked the method
+        """
+        self.switch_to_main_content()
+
+    def search(self, widget):
+        """Display the Search UI, for finding messages in every chat
+
+        Args:
+            widget (toga.Widget): The widget that invoked the method
+        """
+        self.switch_to_search()
+
+    def on_search_changed(self, widget):
+        """Search the chats again, as the query or role in the Search UI changes
+
+        Args:
+            widget (toga.Widget): The widget that invoked the method
+        """
+        self._search_box.hits = self._search_index.search(self._search_box.query, role=self._search_box.role)
+
+        # Reading the hits may have opened closed chats
+        self._chat_manager.enforce_memory_cap()
+
+    def on_search_hit_selected(self, widget):
+        """Show the message selected in the search results
+
+        The message is shown by returning to the main chat screen, making its chat the active one, and moving the history view
+        to the message.
+
+        Args:
+            widget (toga.Widget): The widget that invoked the method
+        """
+        hit = self._search_box.selected_hit
+        if hit is None:
+            return
+
+        if hit.chat != self._chat_manager.active.name:
+            self.switch_chat(hit.chat)
+        self.switch_to_main_content()
+        self._chat_history_view.scroll_to_message(hit.index)
+
+    def on_search_close(self, widget):
+        """Hide the Search UI
+
+        Args:
+            widget (toga.Widget): The widget that invoked the method
+        """
+        self.switch_to_main_content()
 
     def configure_chat(self, widget):
         """Display the Chat Configuration window for displaying the chat parameters.
 
-        TODO Implement chat configuration initialisation
-
         Args:
             widget (toga.Widget): The widget that invoked the method
         """
         self.switch_to_chat_configuration()
-        logging.debug("TODO Implement chat configuration initialisation")
 
-    def on_chat_configuration_ok(self, widget):
+    async def on_chat_configuration_ok(self, widget):
         """Update the configuration for the chat and hide the Chat Configuration window.
 
-        This method is called when the User presses the OK button to confirm the data in the Chat Configuration window.
-
-        TODO Implement chat configuration confirmation
+        This method is called when the User presses the OK button to confirm the data in the Chat Configuration window. Changes that
+        invalidate the prompt cached by the server (i.e. changes to the system content) are handled by the `ChatSession`. The
+        configuration is saved with the chat. If a parameter is not valid, an error is displayed, and the window stays open with
+        nothing changed.
 
         Args:
             widget (Widget): The widget that invoked this method
         """
+        try:
+            parameters = self._chat_configuration_box.parameters
+        except ValueError as e:
+            await self.main_window.error_dialog("Configure chat", str(e))
+            return
+
+        self._chat_manager.configure(self._chat_manager.active, self._chat_configuration_box.system_content, parameters)
         self.switch_to_main_content()
-        logging.debug("TODO Implement chat configuration")
 
     def on_chat_configuration_cancel(self, widget):
         """Close the Chat Configuration window without updating any chat parameters.
 
-        TODO implement chat config cancellation
+        The controls of the window are restored to the current configuration the next time it is displayed.
 
         Args:
             widget (Widget): The widget that invoked this method
         """
-        self.switch_to_main_content()        
-        logging.debug("TODO implement chat config cancel")
+        self.switch_to_main_content()
 
     def configure_system(self, widget):
         self.switch_to_system_configuration()
-        logging.debug("TODO implement system config initialisation")
 
-    def on_system_configuration_ok(self, widget):
+    async def on_system_configuration_ok(self, widget):
+        """Apply the system configuration, and hide the System Configuration window.
+
+        If the backend (or the model file of the local backend) has changed, every chat uses the new backend from its next request,
+        and the previous backend is closed (a local model stops any replies it is generating). Connections are only rebuilt for
+        servers whose address is new; the weights, pool size and timeouts are applied to the existing connections. Idle chats are
+        closed if they exceed the new memory cap, messages are displayed at the new frame rate, the memory of the application is
+        checked against the new budget from the next snapshot, and chats summarise their old messages from the new threshold.
+
+        Every field is read (and the local backend's llama-cpp-python and model file checked) before anything is applied; if any is
+        not valid, an error is displayed, and the window stays open with nothing changed.
+
+        Args:
+            widget (Widget): The widget that invoked this method
+        """
+        configuration = self._system_configuration_box
+        if configuration.backend == "local":
+            from enchat.local_backend import LlamaEngine
+            if not LlamaEngine.is_installed():
+                await self.main_window.error_dialog("Configure system", "the local backend needs llama-cpp-python to run; "
+                                                                        "install it with `pip install llama-cpp-python`")
+                return
+            if not os.path.isfile(configuration.model_path):
+                await self.main_window.error_dialog("Configure system", "the local backend needs the model file to run")
+                return
+
+        try:
+            endpoints = configuration.endpoints
+            pool_size, connect_timeout = configuration.pool_size, configuration.connect_timeout
+            read_timeout, memory_cap = configuration.read_timeout, configuration.memory_cap
+            frame_rate, memory_budget = configuration.frame_rate, configuration.memory_budget
+            summary_threshold = configuration.summary_threshold
+        except ValueError as e:
+            await self.main_window.error_dialog("Configure system", str(e))
+            return
+
+        changed = configuration.backend != self._backend.name or (configuration.backend == "local" and
+                                                                  configuration.model_path != self._model_path)
+        self._model_path = configuration.model_path
+        if changed:
+            await self._backend.close()
+            self._backend = self.create_backend(configuration.backend)
+            self._chat_manager.set_client(self._backend)
+            logging.info(f"replies are generated by the {self._backend.name} backend")
+
+        addresses = [endpoint.address for endpoint in self._endpoint_pool.endpoints]
+
+        self._endpoint_pool.configure(endpoints, pool_size, connect_timeout, read_timeout)
+        if addresses != [endpoint.address for endpoint in self._endpoint_pool.endpoints]:
+            for chat in self._chat_manager.chats.values():
+                if chat.is_open:
+                    chat.session.context_budget.reset_context_size()
+
+        self._chat_manager.memory_cap = int(memory_cap * EnChat.MEGABYTE)
+        self._chat_manager.enforce_memory_cap()
+        self._update_scheduler.rate = frame_rate
+        self._diagnostics.budget = int(memory_budget * EnChat.MEGABYTE)
+        self._chat_manager.set_summary_threshold(summary_threshold)
         self.switch_to_main_content()
-        logging.debug("TODO implement system config confirmation")
 
     def on_system_configuration_cancel(self, widget):
+        """Restore the controls of the System Configuration window to the current configuration, and hide it.
+
+        Args:
+            widget (Widget): The widget that invoked this method
+        """
+        self._system_configuration_box.endpoints = [(endpoint.address, endpoint.weight) for endpoint in self._endpoint_pool.endpoints]
+        self._system_configuration_box.pool_size = self._endpoint_pool.pool_size
+        self._system_configuration_box.connect_timeout = self._endpoint_pool.connect_timeout
+        self._system_configuration_box.read_timeout = self._endpoint_pool.read_timeout
+        self._system_configuration_box.memory_cap = self._chat_manager.memory_cap / EnChat.MEGABYTE
+        self._system_configuration_box.frame_rate = self._update_scheduler.rate
+        self._system_configuration_box.backend = self._backend.name
+        self._system_configuration_box.model_path = self._model_path
+        self._system_configuration_box.memory_budget = self._diagnostics.budget / EnChat.MEGABYTE
+        self._system_configuration_box.summary_threshold = self._chat_manager.summary_threshold
         self.switch_to_main_content()
-        logging.debug("TODO implement system config cancellation")
+
+    async def on_app_exit(self, app, **kwargs) -> bool:
+        """Stop any replies being generated, and save any pending messages of every chat (including the part of each reply
+        generated so far) before the application exits; then stop the backend, and close the connections to the servers
+
+        Args:
+            app (toga.App): The application that is exiting
+
+        Returns:
+            bool: True, to allow the application to exit
+        """
+        self._speculative_prefill.cancel()
+        self._update_scheduler.cancel()
+        self._diagnostics.stop()
+        await self._chat_manager.stop_replies()
+        self._chat_manager.close()
+        self._response_cache.close()
+        await self._backend.close()
+        # The pool belongs to the application, and probes its servers whichever backend is used
+        await self._endpoint_pool.close()
+        return True
 
     def switch_to_main_content(self):
         self.main_window.content = self._main_content_box
-        self._configure_chat_cmd.enabled = True
-        self._configure_system_cmd.enabled = True
+        self._search_cmd.enabled = True
+        self._diagnostics_cmd.enabled = True
+        self.update_reply_state()
 
     def switch_to_chat_configuration(self):
+        if self._chat_configuration_box is None:
+            self.build_chat_configuration_box()
+        session = self._chat_manager.active.session
+        self._chat_configuration_box.system_content = session.system_content
+        self._chat_configuration_box.parameters = session.parameters
         self.main_window.content = self._chat_configuration_box
         self._configure_chat_cmd.enabled = False
         self._configure_system_cmd.enabled = False
 
     def switch_to_system_configuration(self):
+        if self._system_configuration_box is None:
+            self.build_system_configuration_box()
         self.main_window.content = self._system_configuration_box
         self._configure_chat_cmd.enabled = True
         self._configure_system_cmd.enabled = False
 
-def main():
-    """_summary_
+    def switch_to_search(self):
+        if self._search_box is None:
+            self.build_search_box()
+        self.main_window.content = self._search_box
+        self._search_cmd.enabled = False
+        self._search_box.focus()
+
+    def switch_to_diagnostics(self):
+        if self._diagnostics_box is None:
+            self.build_diagnostics_box()
+        self._diagnostics_box.tracing = self._diagnostics.is_tracing
+        self._diagnostics_box.report = self._diagnostics.describe()
+        self.main_window.content = self._diagnostics_box
+        self._diagnostics_cmd.enabled = False
+
+def main(started : float = None):
+    """Create the application, and set up logging
+
+    Logging is configured here rather than when the module is imported, at the level given by the `ENCHAT_LOG_LEVEL` environment
+    variable (default INFO).
+
+    Args:
+        started (float): The `time.perf_counter` value at which the process started, if known, so the start-up time includes
+            importing the application
 
     Returns:
-        _type_: _description_
+        EnChat: The application
     """
-    return EnChat("enChat", "com.technopraxia.enchat", description="Interaction with OpenAI LLMs")
+    logging.basicConfig(level=os.environ.get("ENCHAT_LOG_LEVEL", "INFO").upper())
+    startup_timer = StartupTimer(started)
+    if started is not None:
+        startup_timer.mark("import")
+
+    return EnChat("enChat", "com.technopraxia.enchat", description="Interaction with OpenAI LLMs", startup_timer=startup_timer)
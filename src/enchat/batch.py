@@ -0,0 +1,210 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+
+from enchat.chat_parameters import DEFAULT_PARAMETERS, parse_parameter
+from enchat.completion_client import CompletionClient, CompletionError
+from enchat.endpoint_pool import EndpointPool, parse_endpoints
+from enchat.prompt_format import format_prompt
+
+
+class BatchRunner:
+    """Runs a batch of independent chats through the completion client, without any UI
+
+    The input is a JSON Lines file, with one job per line. Each job is an object with:
+
+    * `id` (optional) - an identifier copied to the result; defaults to the line number
+    * `prompt` - a single user message, or `messages` - a list of `{"role": ..., "content": ...}` objects
+    * `system` (optional) - the system content, overriding the default for the batch
+    * `parameters` (optional) - sampling parameters overriding the defaults for the batch, checked with the same rules as the Chat
+      Configuration UI
+
+    At most `concurrency` requests are in flight at once. Jobs are read from the input only as workers become free (through a
+    bounded queue), and each result is written to the output as soon as it is finished, so neither the input nor the results are
+    ever held in memory as a whole. Results are therefore written in the order they finish, not the order of the input; the `id` and
+    `line` of each result identify its job.
+
+    A job that fails (e.g. because its line is invalid, or the server rejected the request) gives a result with an `error`, and does
+    not stop the rest of the batch.
+
+    Attributes:
+        client (CompletionClient): The client used to send the requests
+        system_content (str): The default system content for each chat
+        parameters (dict): The default sampling parameters for each request
+        concurrency (int): The maximum number of requests in flight at once
+        succeeded (int): The number of jobs that have succeeded so far
+        failed (int): The number of jobs that have failed so far
+    """
+
+    def __init__(self, client : CompletionClient, system_content : str, parameters : dict, concurrency : int):
+        assert(concurrency > 0)
+
+        self.client = client
+        self.system_content = system_content
+        self.parameters = parameters
+        self.concurrency = concurrency
+        self.succeeded = 0
+        self.failed = 0
+
+    async def run(self, input_file, output_file):
+        """Run every job in the input, writing their results to the output
+
+        Args:
+            input_file (TextIO): The input, with one JSON job per line
+            output_file (TextIO): The output, to which one JSON result per line is written
+        """
+        jobs = asyncio.Queue(maxsize=2 * self.concurrency)
+        workers = [asyncio.create_task(self._work(jobs, output_file)) for _ in range(self.concurrency)]
+
+        try:
+            for number, line in enumerate(input_file, start=1):
+                if line.strip():
+                    # Waits while the queue is full, so the input is read no faster than the server can handle it
+                    await jobs.put((number, line))
+
+            for _ in workers:
+                await jobs.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def _work(self, jobs : asyncio.Queue, output_file):
+        while (job := await jobs.get()) is not None:
+            result = await self._run_job(*job)
+            output_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output_file.flush()
+
+    async def _run_job(self, number : int, line : str) -> dict:
+        result = {'id': number, 'line': number}
+        started = time.monotonic()
+
+        try:
+            job = json.loads(line)
+            if not isinstance(job, dict):
+                raise ValueError("job must be a JSON object")
+            result['id'] = job.get('id', number)
+
+            prompt, parameters = self._prepare(job)
+            stream = self.client.stream_completion(prompt, parameters)
+            reply = "".join([text async for text in stream])
+
+            result.update(reply=reply, endpoint=stream.result.get('endpoint'),
+                          tokens_predicted=stream.result.get('tokens_predicted'))
+            self.succeeded += 1
+        except (ValueError, KeyError, TypeError, CompletionError, OSError, asyncio.TimeoutError) as e:
+            logging.warning(f"job on line {number} failed: {e!r}")
+            result['error'] = str(e) or repr(e)
+            self.failed += 1
+
+        result['seconds'] = round(time.monotonic() - started, 3)
+        return result
+
+    def _prepare(self, job : dict) -> tuple:
+        if 'messages' in job:
+            if not isinstance(job['messages'], list) or not all(isinstance(message, dict) for message in job['messages']):
+                raise ValueError("messages must be a list of JSON objects")
+            messages = [(message['role'], message['content']) for message in job['messages']]
+        else:
+            messages = [("user", job['prompt'])]
+        if not all(isinstance(role, str) and isinstance(content, str) for role, content in messages):
+            raise ValueError("the role and content of each message must be strings")
+
+        system_content = job.get('system', self.system_content)
+        if not isinstance(system_content, str):
+            raise ValueError("system must be a string")
+
+        job_parameters = job.get('parameters', {})
+        if not isinstance(job_parameters, dict):
+            raise ValueError("parameters must be a JSON object")
+        parameters = dict(self.parameters)
+        for name, value in job_parameters.items():
+            if name not in parameters:
+                raise ValueError(f"unknown parameter {name!r}")
+            parameters[name] = parse_parameter(name, value)
+
+        return format_prompt(system_content, messages), parameters
+
+
+def parse_arguments(argv : list) -> argparse.Namespace:
+    """Parse the command line of the batch mode
+
+    Args:
+        argv (list[str]): The command line arguments, without the program name
+
+    Returns:
+        argparse.Namespace: The parsed arguments, with the sampling parameters converted and validated
+    """
+    parser = argparse.ArgumentParser(prog="python -m enchat", description="Run a batch of chats without the UI")
+    parser.add_argument("--batch", required=True, metavar="FILE", help="input file, with one JSON job per line ('-' for stdin)")
+    parser.add_argument("--out", default="-", metavar="FILE", help="output file for the JSON results ('-' for stdout)")
+    parser.add_argument("--concurrency", type=int, default=4, help="maximum number of requests in flight at once")
+    parser.add_argument("--servers", default="http://localhost:1234",
+                        help="server endpoints, e.g. \"http://gpu1:8080 2, http://gpu2:8080\"")
+    parser.add_argument("--system", default="", help="default system content for each chat")
+    parser.add_argument("--read-timeout", type=float, default=60.0, help="seconds to wait for any single read from a server")
+    parser.add_argument("--verbose", action="store_true", help="log progress to stderr")
+
+    for name, default in DEFAULT_PARAMETERS.items():
+        parser.add_argument("--" + name.replace('_', '-'), dest=name, default=str(default), help=f"default {default}")
+
+    arguments = parser.parse_args(argv)
+
+    if arguments.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    try:
+        arguments.servers = parse_endpoints(arguments.servers)
+        arguments.parameters = {name: parse_parameter(name, getattr(arguments, name)) for name in DEFAULT_PARAMETERS}
+    except ValueError as e:
+        parser.error(str(e))
+
+    return arguments
+
+
+async def run_batch(arguments : argparse.Namespace, input_file, output_file) -> BatchRunner:
+    """Run a batch with the given (parsed) arguments
+
+    Args:
+        arguments (argparse.Namespace): The arguments, as returned by `parse_arguments`
+        input_file (TextIO): The input, with one JSON job per line
+        output_file (TextIO): The output, to which one JSON result per line is written
+
+    Returns:
+        BatchRunner: The finished runner, holding the numbers of jobs that succeeded and failed
+    """
+    pool = EndpointPool(arguments.servers, pool_size=arguments.concurrency, read_timeout=arguments.read_timeout)
+    runner = BatchRunner(CompletionClient(pool), arguments.system, arguments.parameters, arguments.concurrency)
+    try:
+        await runner.run(input_file, output_file)
+    finally:
+        await pool.close()
+    return runner
+
+
+def main(argv : list = None) -> int:
+    """Entry point of the batch mode, e.g. `python -m enchat --batch prompts.jsonl --out results.jsonl --concurrency 8`
+
+    Args:
+        argv (list[str]): The command line arguments, without the program name; defaults to `sys.argv[1:]`
+
+    Returns:
+        int: The exit status; 0 if every job succeeded
+    """
+    arguments = parse_arguments(sys.argv[1:] if argv is None else argv)
+    logging.basicConfig(level=logging.INFO if arguments.verbose else logging.WARNING)
+
+    input_file = sys.stdin if arguments.batch == "-" else open(arguments.batch, encoding='utf-8')
+    output_file = sys.stdout if arguments.out == "-" else open(arguments.out, "w", encoding='utf-8')
+    try:
+        started = time.monotonic()
+        runner = asyncio.run(run_batch(arguments, input_file, output_file))
+    finally:
+        for file in (input_file, output_file):
+            if file not in (sys.stdin, sys.stdout):
+                file.close()
+
+    print(f"{runner.succeeded} succeeded, {runner.failed} failed in {time.monotonic() - started:.1f}s", file=sys.stderr)
+    return 0 if runner.failed == 0 else 1
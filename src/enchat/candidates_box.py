@@ -0,0 +1,81 @@
+from toga import Box, Button, Label, Widget
+from toga.style.pack import BOLD, COLUMN, NONE, PACK, ROW, Pack
+from enchat.message_box import MessageBox
+from enchat.update_scheduler import UpdateScheduler
+
+class CandidatesBox(Box):
+    """A box displaying several candidate replies to the same user message side by side, as they are generated
+
+    Each candidate is displayed in a column, headed by the parameters it was generated with, with a button for promoting it into
+    the chat history. The box is hidden while it has no candidates. With an `UpdateScheduler`, the text of each candidate is
+    displayed at most once per frame.
+
+    Attributes:
+        _on_promote: Handler called with the candidate whose button was pressed
+        _scheduler (UpdateScheduler | None): The scheduler that changes are displayed through, if any
+        _shown (int): Counts the sets of candidates shown, so updates scheduled for an earlier set are ignored
+        _columns (dict[int, tuple]): The (message box, button) of each candidate displayed, by the number of the candidate
+        HEADER_FONT_SIZE (int): The font size of the header of each column
+    """
+
+    HEADER_FONT_SIZE = 10
+
+    def __init__(self, on_promote : (Widget), scheduler : UpdateScheduler = None):
+        """Set up the box, initially hidden
+
+        Args:
+            on_promote: Handler called with the `Candidate` to add to the history, when its button is pressed
+            scheduler (UpdateScheduler): The scheduler to display changes through, once per frame; by default, changes are
+                displayed as they happen
+        """
+        self._on_promote = on_promote
+        self._scheduler = scheduler
+        self._shown = 0
+        self._columns = {}
+        super(CandidatesBox, self).__init__(style=Pack(direction=ROW, display=NONE))
+
+    def show(self, candidates : list):
+        """Display a set of candidates, replacing those displayed; the box is hidden if there are none
+
+        Args:
+            candidates (list[Candidate]): The candidates
+        """
+        self.clear()
+        self._columns = {}
+        self._shown += 1
+        for candidate in candidates:
+            self._update(candidate)
+        self.style.display = PACK if candidates else NONE
+
+    def update(self, candidate):
+        """Display the latest text of a candidate, adding a column for it if it is not displayed yet
+
+        Args:
+            candidate (Candidate): The candidate
+        """
+        if self._scheduler is None:
+            self._update(candidate)
+        else:
+            shown = self._shown
+
+            def update():
+                # Ignore updates to candidates that have since been replaced
+                if shown == self._shown:
+                    self._update(candidate)
+
+            self._scheduler.schedule((self, candidate.number), update)
+
+    def _update(self, candidate):
+        if candidate.number not in self._columns:
+            header_lbl = Label(candidate.description, style=Pack(font_weight=BOLD, font_size=CandidatesBox.HEADER_FONT_SIZE))
+            message_box = MessageBox("assistant", "")
+            promote_btn = Button(text="Use this", on_press=lambda widget: self._on_promote(candidate), enabled=False)
+            self.add(Box(style=Pack(direction=COLUMN, flex=1), children=[header_lbl, message_box, promote_btn]))
+            self._columns[candidate.number] = (message_box, promote_btn)
+            self.style.display = PACK
+
+        message_box, promote_btn = self._columns[candidate.number]
+        message_box.message = candidate.text
+        if candidate.finished:
+            message_box.footer = candidate.metrics.footer()
+        promote_btn.enabled = candidate.finished and bool(candidate.text)
@@ -1,7 +1,6 @@
 from toga import Box, Label, MultilineTextInput, TextInput, Widget, Button
 from toga.style.pack import COLUMN, ROW
-from toga.validators import Number
-from enchat.validators import FloatRange, IntegerRange
+from enchat.chat_parameters import PARAMETER_VALIDATORS, parse_parameter
 
 class ChatConfigurationBox(Box):
     """A box containing controls for configuring the current chat
@@ -16,13 +15,15 @@ class ChatConfigurationBox(Box):
         _repeat_penalty_txi (TextInput): Input for the repeat penality model parameter
         _min_p_txi (TextInput): Input for the min_p parameter for the model
         _top_p_txi (TextInput): Inpyt for the top_p parameter for the model
+        _seed_txi (TextInput): Input for the random seed for the model
         LABEL_WIDTH (int): Consistent width for all labels in a column of parameters
     """
 
     LABEL_WIDTH = 100
 
     def __init__(self, system_content : str, on_ok : (Widget), on_cancel : (Widget), temp : float = 0.8, n_predict : int = -1,
-                 top_k : int = 40, repeat_penalty : float = 1.1, min_p : float = 0.95, top_p : float = 0.95):        
+                 top_k : int = 40, repeat_penalty : float = 1.1, min_p : float = 0.95, top_p : float = 0.95,
+                 seed : int = -1):        
         
         # System content
         system_content_lbl = Label("System content")
@@ -39,8 +40,7 @@ class ChatConfigurationBox(Box):
 
         self._temp_txi = TextInput(
             value=temp, 
-            validators=[Number(error_message="must be a number", allow_empty=False),
-                        FloatRange("must be in the range [0,1]", allow_empty=False, min=0.0, max=1.0)])
+            validators=PARAMETER_VALIDATORS['temperature'])
         temp_box = Box(children=[temp_lbl, self._temp_txi])
         temp_box.style.direction=ROW
 
@@ -50,8 +50,7 @@ class ChatConfigurationBox(Box):
 
         self._n_predict_txi = TextInput(
             value=n_predict,
-            validators=[Number(error_message="must be a number", allow_empty=False),
-                        IntegerRange(error_message="must be an integer greater than -1", allow_empty=False, min=-1)])
+            validators=PARAMETER_VALIDATORS['n_predict'])
         n_predict_box = Box(children=[n_predict_lbl, self._n_predict_txi])
         n_predict_box.style.direction=ROW
 
@@ -61,8 +60,7 @@ class ChatConfigurationBox(Box):
 
         self._top_k_txi = TextInput(
             value=top_k,
-            validators=[Number(error_message="must be a number", allow_empty=False),
-                        IntegerRange(error_message="must be an integer greater than 0", allow_empty=False, min=0)])
+            validators=PARAMETER_VALIDATORS['top_k'])
         top_k_box = Box(children=[top_k_lbl, self._top_k_txi])
         top_k_box.style.direction=ROW
 
@@ -72,8 +70,7 @@ class ChatConfigurationBox(Box):
 
         self._repeat_penalty_txi = TextInput(
             value = repeat_penalty,
-            validators=[Number(error_message="must be a number", allow_empty=False),
-                        FloatRange(error_message="must be greater than or equal to 0", allow_empty=False, min=0.0)])
+            validators=PARAMETER_VALIDATORS['repeat_penalty'])
         
         repeat_penalty_box = Box(children=[repeat_penalty_lbl, self._repeat_penalty_txi])
         repeat_penalty_box.style.direction = ROW
@@ -84,8 +81,7 @@ class ChatConfigurationBox(Box):
 
         self._min_p_txi = TextInput(
             value = min_p,
-            validators=[Number(error_message="must be a number", allow_empty=False),
-                        FloatRange(error_message="must be in the range [0,1]", allow_empty=False, min=0, max=1)])
+            validators=PARAMETER_VALIDATORS['min_p'])
         
         min_p_bx = Box(children=[min_p_lbl, self._min_p_txi])
         min_p_bx.style.direction=ROW
@@ -96,12 +92,22 @@ class ChatConfigurationBox(Box):
 
         self._top_p_txi = TextInput(
             value = top_p,
-            validators=[Number(error_message="must be a number", allow_empty=False),
-                        FloatRange(error_message="must be in the range [0,1]", allow_empty=False, min=0, max=1)])
+            validators=PARAMETER_VALIDATORS['top_p'])
         
         top_p_box = Box(children=[top_p_lbl, self._top_p_txi])
         top_p_box.style.direction = ROW
 
+        # seed
+        seed_lbl = Label("Seed")
+        seed_lbl.style.width = ChatConfigurationBox.LABEL_WIDTH
+
+        self._seed_txi = TextInput(
+            value = seed,
+            validators=PARAMETER_VALIDATORS['seed'])
+
+        seed_box = Box(children=[seed_lbl, self._seed_txi])
+        seed_box.style.direction = ROW
+
         # OK and cancel buttons
         ok_btn = Button(text="OK", on_press=on_ok)
         cancel_btn = Button(text="Cancel", on_press=on_cancel)
@@ -109,7 +115,7 @@ class ChatConfigurationBox(Box):
         button_box.style.direction=(ROW)
 
         super(ChatConfigurationBox, self).__init__(
-            children=[system_content_bx, temp_box, n_predict_box, top_k_box, repeat_penalty_box, min_p_bx, top_p_box, button_box])
+            children=[system_content_bx, temp_box, n_predict_box, top_k_box, repeat_penalty_box, min_p_bx, top_p_box, seed_box, button_box])
         self.style.direction=COLUMN
 
     @property
@@ -204,3 +210,47 @@ class ChatConfigurationBox(Box):
     @top_p.setter
     def top_p(self, value : float):
         self._top_p_txi.value = value
+
+    @property
+    def seed(self) -> int:
+        """Random seed for sampling; set to -1 (default) for a random seed, or fix it to make replies repeatable
+
+        Returns:
+            int [-1,]: The seed parameter for the model
+        """
+        return int(float(self._seed_txi.value))
+
+    @seed.setter
+    def seed(self, value : int):
+        self._seed_txi.value = value
+
+    @property
+    def parameters(self) -> dict:
+        """The sampling parameters for the chat, keyed by their names in the server's completion API
+
+        Returns:
+            dict: The parameters to send with each completion request
+
+        Raises:
+            ValueError: A parameter fails its validators (see `PARAMETER_VALIDATORS`)
+        """
+        inputs = {
+            'temperature': self._temp_txi,
+            'n_predict': self._n_predict_txi,
+            'top_k': self._top_k_txi,
+            'repeat_penalty': self._repeat_penalty_txi,
+            'min_p': self._min_p_txi,
+            'top_p': self._top_p_txi,
+            'seed': self._seed_txi
+        }
+        return {name: parse_parameter(name, text_input.value) for name, text_input in inputs.items()}
+
+    @parameters.setter
+    def parameters(self, value : dict):
+        self.temp = value['temperature']
+        self.n_predict = value['n_predict']
+        self.top_k = value['top_k']
+        self.repeat_penalty = value['repeat_penalty']
+        self.min_p = value['min_p']
+        self.top_p = value['top_p']
+        self.seed = value['seed']
@@ -0,0 +1,276 @@
+import sys
+import zlib
+from collections import OrderedDict
+from enchat.conversation_store import ConversationStore
+
+class ChatMessage:
+    """A single message of the chat, independent of any widget that displays it
+
+    A chat may hold a very large number of messages (e.g. a log of an agent's work), so messages are compact records: they have
+    `__slots__` rather than a `__dict__`, and their roles are interned, so every message of a role shares one string. The text of
+    an old message may be compressed (see `compress`), in which case it is decompressed each time it is read.
+
+    Attributes:
+        role (str): The sender role for the message, usually "user" or "assistant"
+        text (str): The text of the message
+        metrics (RequestMetrics | None): The latency and throughput of a reply generated in this session, if any; metrics are not
+            saved in the store
+        SIZE (int): The approximate memory used by a message, excluding its text, in bytes
+        COMPRESS_MIN_LENGTH (int): The length of the shortest text that is compressed
+    """
+
+    __slots__ = ('role', '_text', 'metrics')
+
+    SIZE = 56
+
+    COMPRESS_MIN_LENGTH = 256
+
+    def __init__(self, role : str, text : str):
+        self.role = sys.intern(role)
+        self._text = text
+        self.metrics = None
+
+    @property
+    def text(self) -> str:
+        text = self._text
+        return text if isinstance(text, str) else zlib.decompress(text).decode('utf-8')
+
+    @text.setter
+    def text(self, value : str):
+        self._text = value
+
+    @property
+    def is_compressed(self) -> bool:
+        """Whether the text of the message is held compressed
+
+        Returns:
+            bool: True if the text is compressed
+        """
+        return not isinstance(self._text, str)
+
+    def compress(self) -> bool:
+        """Hold the text of the message compressed, if it is long enough (and compresses well enough) to save memory
+
+        Returns:
+            bool: True if the text is now compressed
+        """
+        if isinstance(self._text, str) and len(self._text) >= ChatMessage.COMPRESS_MIN_LENGTH:
+            compressed = zlib.compress(self._text.encode('utf-8'))
+            if sys.getsizeof(compressed) < sys.getsizeof(self._text):
+                self._text = compressed
+        return self.is_compressed
+
+    def memory_size(self) -> int:
+        """An estimate of the memory used by the message, including its text (as it is held)
+
+        Returns:
+            int: The estimated size, in bytes
+        """
+        return ChatMessage.SIZE + sys.getsizeof(self._text)
+
+
+class ChatHistory:
+    """The full history of a chat, as a sequence of messages
+
+    The history is the authoritative record of the conversation; widgets only ever display a part of it. Objects that need to know
+    when the history changes (such as the `ChatHistoryView`) register themselves as listeners, and are notified through their
+    `message_added(index)` and `message_changed(index)` methods.
+
+    If the history is backed by a `ConversationStore`, every message is saved as it is added, and only a bounded number of pages of
+    messages are held in memory; other pages are read from the store when they are needed (e.g. as the user scrolls back through
+    the chat), and the least recently used pages are dropped. Without a store, every message is held in memory.
+
+    The text of messages held in memory is compressed once they are more than `compress_after` messages from the end of the
+    history, as old messages are rarely read (and then only to be displayed, or searched) but may make up most of a long chat.
+
+    Attributes:
+        PAGE_SIZE (int): The number of messages in each page read from the store
+        MAX_PAGES (int): The maximum number of pages held in memory
+        COMPRESS_AFTER (int): The default age (in messages from the end of the history) after which messages are compressed
+    """
+
+    PAGE_SIZE = 100
+
+    MAX_PAGES = 8
+
+    COMPRESS_AFTER = 100
+
+    def __init__(self, store : ConversationStore = None, page_size : int = PAGE_SIZE, max_pages : int = MAX_PAGES,
+                 compress_after : int = COMPRESS_AFTER):
+        """Set up the history, initially holding the messages already in the store (if any)
+
+        Args:
+            store (ConversationStore): The store backing the history, if any
+            page_size (int): The number of messages in each page read from the store
+            max_pages (int): The maximum number of pages held in memory
+            compress_after (int | None): The age (in messages from the end of the history) after which messages are compressed,
+                or None to never compress messages
+        """
+        assert(max_pages > 1)
+
+        self._store = store
+        self._page_size = page_size
+        self._max_pages = max_pages
+        self._compress_after = compress_after
+        self._pages = OrderedDict()
+        self._messages = []
+        self._listeners = []
+
+    def __len__(self) -> int:
+        return len(self._store) if self._store is not None else len(self._messages)
+
+    def __getitem__(self, index : int) -> ChatMessage:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("chat history index out of range")
+
+        if self._store is None:
+            return self._messages[index]
+
+        page = self._page(index // self._page_size)
+        return page[index % self._page_size]
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+    def add_listener(self, listener):
+        """Register an object to be notified of changes to the history
+
+        Args:
+            listener: An object with `message_added(index)` and `message_changed(index)` methods
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """Stop notifying an object of changes to the history
+
+        Args:
+            listener: An object registered with `add_listener`
+        """
+        self._listeners.remove(listener)
+
+    def append(self, role : str, text : str) -> int:
+        """Add a new message to the end of the history, saving it to the store
+
+        Args:
+            role (str): The sender role for the message
+            text (str): The text of the message
+
+        Returns:
+            int: The index of the new message
+        """
+        message = ChatMessage(role, text)
+
+        if self._store is None:
+            self._messages.append(message)
+            index = len(self._messages) - 1
+        else:
+            index = len(self._store)
+            page = self._page(index // self._page_size) if index % self._page_size else self._new_page(index // self._page_size)
+            self._store.append(role, text)
+            page.append(message)
+
+        if self._compress_after is not None and index >= self._compress_after:
+            old = self._in_memory(index - self._compress_after)
+            if old is not None:
+                old.compress()
+
+        for listener in self._listeners:
+            listener.message_added(index)
+        return index
+
+    def update(self, index : int, text : str, save : bool = True):
+        """Replace the text of an existing message, e.g. as a reply is streamed from the server
+
+        Args:
+            index (int): The index of the message
+            text (str): The new text of the message
+            save (bool): Whether to save the new text to the store; intermediate versions of a streamed message need not be saved
+        """
+        message = self[index]
+        message.text = text
+        if save and self._store is not None:
+            self._store.update(index, message.role, text)
+
+        for listener in self._listeners:
+            listener.message_changed(index)
+
+    def set_metrics(self, index : int, metrics):
+        """Attach the metrics of a reply to its message, for display
+
+        Args:
+            index (int): The index of the message
+            metrics (RequestMetrics): The metrics of the reply
+        """
+        self[index].metrics = metrics
+
+        for listener in self._listeners:
+            listener.message_changed(index)
+
+    def as_pairs(self, indexes = None) -> list:
+        """Messages of the history as a list of (role, text) pairs, suitable for formatting as a prompt
+
+        Args:
+            indexes (Iterable[int]): The indexes of the messages to include, in order; defaults to every message
+
+        Returns:
+            list[tuple[str, str]]: The (role, text) pairs of the messages
+        """
+        messages = self if indexes is None else (self[index] for index in indexes)
+        return [(message.role, message.text) for message in messages]
+
+    def memory_size(self) -> int:
+        """An estimate of the memory used by the messages held in memory
+
+        Returns:
+            int: The estimated size, in bytes
+        """
+        messages = self._messages if self._store is None else [message for page in self._pages.values() for message in page]
+        return sum(message.memory_size() for message in messages)
+
+    def compact(self):
+        """Drop every page held in memory except the one holding the last message (which may hold a reply being streamed)
+
+        The dropped pages are read from the store again if they are needed. Without a store, every message stays in memory.
+        """
+        if self._store is None:
+            return
+
+        last = (len(self) - 1) // self._page_size
+        for number in list(self._pages):
+            if number != last:
+                del self._pages[number]
+
+    def _page(self, number : int) -> list:
+        page = self._pages.get(number)
+        if page is None:
+            start = number * self._page_size
+            page = self._new_page(number)
+            page.extend(ChatMessage(role, text) for role, text in self._store.read(start, start + self._page_size))
+            if self._compress_after is not None:
+                for message in page[:max(0, len(self) - self._compress_after - start)]:
+                    message.compress()
+        else:
+            self._pages.move_to_end(number)
+        return page
+
+    def _in_memory(self, index : int) -> ChatMessage:
+        if self._store is None:
+            return self._messages[index]
+        page = self._pages.get(index // self._page_size)
+        return page[index % self._page_size] if page is not None and index % self._page_size < len(page) else None
+
+    def _new_page(self, number : int) -> list:
+        page = []
+        self._pages[number] = page
+
+        # The page holding the last message is never dropped, as it may hold a reply that is still being streamed (and not saved)
+        last = (len(self) - 1) // self._page_size
+        for old in list(self._pages):
+            if len(self._pages) <= self._max_pages:
+                break
+            if old not in (number, last):
+                del self._pages[old]
+
+        return page
@@ -0,0 +1,212 @@
+from toga import Box, ScrollContainer
+from toga.style.pack import COLUMN, Pack
+from enchat.chat_history import ChatHistory
+from enchat.message_box import MessageBox
+from enchat.update_scheduler import UpdateScheduler
+
+class ChatHistoryView(ScrollContainer):
+    """A scrolling view over a window of the chat history
+
+    Only a fixed-size window of the history is ever displayed, so the number of native widgets - and the cost of laying them out -
+    is the same for a conversation of 50 messages or 50,000. The `MessageBox` widgets of the window are recycled: when the window
+    moves, boxes that leave it are re-bound to the messages that enter it, rather than being destroyed and created again.
+
+    The window follows the end of the history while the user is looking at the latest messages. Scrolling to the top (or bottom) of
+    the container moves the window back (or forward) by a page. While the user is at the bottom of the view, it scrolls to follow
+    messages as they are added or grow.
+
+    With an `UpdateScheduler`, changes to messages (e.g. each piece of a streamed reply) are merged, and displayed at most once per
+    frame, with a single scroll per frame; otherwise each change is displayed as it happens.
+
+    Attributes:
+        _history (ChatHistory): The history being displayed
+        _box (toga.Box): The box containing the message boxes of the window
+        _start (int): The index in the history of the first message in the window
+        _updating (bool): Whether the view is moving its own scroll position (so scroll events should be ignored)
+        _scheduler (UpdateScheduler | None): The scheduler that changes are displayed through, if any
+        WINDOW_SIZE (int): The maximum number of messages displayed at once
+        PAGE_SIZE (int): The number of messages the window moves by when the user scrolls to either end
+        EDGE_DISTANCE (int): How close (in pixels) the scroll position must be to either end to move the window
+    """
+
+    WINDOW_SIZE = 40
+
+    PAGE_SIZE = 20
+
+    EDGE_DISTANCE = 8
+
+    def __init__(self, history : ChatHistory, window_size : int = WINDOW_SIZE, page_size : int = PAGE_SIZE,
+                 scheduler : UpdateScheduler = None):
+        """Set up the view, initially showing the end of the history
+
+        Args:
+            history (ChatHistory): The history to display
+            window_size (int): The maximum number of messages displayed at once
+            page_size (int): The number of messages the window moves by when the user scrolls to either end
+            scheduler (UpdateScheduler): The scheduler to display changes through, once per frame; by default, changes are
+                displayed as they happen
+        """
+        assert(0 < page_size <= window_size)
+
+        self._history = history
+        self._window_size = window_size
+        self._page_size = page_size
+        self._start = max(0, len(history) - window_size)
+        self._updating = False
+        self._scheduler = scheduler
+        self._box = Box(style=Pack(direction=COLUMN))
+
+        super(ChatHistoryView, self).__init__(horizontal=False, content=self._box, on_scroll=self.on_scroll_changed)
+
+        self._rebind()
+        history.add_listener(self)
+
+    @property
+    def history(self) -> ChatHistory:
+        """The history being displayed; setting it displays the end of another history, recycling the message boxes
+
+        Returns:
+            ChatHistory: The history
+        """
+        return self._history
+
+    @history.setter
+    def history(self, value : ChatHistory):
+        self._history.remove_listener(self)
+        self._history = value
+        self._start = max(0, len(value) - self._window_size)
+        self._rebind()
+        value.add_listener(self)
+        self.scroll_to_bottom()
+
+    @property
+    def displayed_range(self) -> range:
+        """The indexes in the history of the messages currently displayed
+
+        Returns:
+            range: The range of displayed indexes
+        """
+        return range(self._start, self._start + len(self._box.children))
+
+    @property
+    def at_end(self) -> bool:
+        """Whether the window includes the last message of the history
+
+        Returns:
+            bool: True if the last message is displayed
+        """
+        return self._start + len(self._box.children) >= len(self._history)
+
+    def message_added(self, index : int):
+        """Display a new message, if the window is following the end of the history
+
+        Args:
+            index (int): The index of the new message in the history
+        """
+        if index != self._start + len(self._box.children):
+            return
+
+        if len(self._box.children) < self._window_size:
+            message = self._history[index]
+            self._box.add(MessageBox(message.role, message.text))
+        else:
+            # Recycle the oldest box in the window as the newest one
+            message_box = self._box.children[0]
+            self._box.remove(message_box)
+            self._bind(message_box, index)
+            self._box.add(message_box)
+            self._start += 1
+
+        self._follow_end()
+
+    def message_changed(self, index : int):
+        """Update the display of a message, if it is in the window
+
+        Args:
+            index (int): The index of the changed message in the history
+        """
+        if self._scheduler is None:
+            self._show(index)
+        else:
+            self._scheduler.schedule((self, index), lambda: self._show(index))
+        if index == len(self._history) - 1 and self._at_bottom():
+            self._follow_end()
+
+    def scroll_to_bottom(self):
+        """Scroll to the end of the window"""
+        self._updating = True
+        try:
+            self.vertical_position = self.max_vertical_position
+        finally:
+            self._updating = False
+
+    def scroll_to_message(self, index : int):
+        """Move the window so that it contains the given message, and scroll so the message is approximately in view
+
+        Args:
+            index (int): The index of the message in the history
+        """
+        self._start = min(max(0, index - self._window_size // 2), max(0, len(self._history) - self._window_size))
+        self._rebind()
+        self._scroll_to_fraction((index - self._start) / max(1, len(self._box.children)))
+
+    def on_scroll_changed(self, widget, **kwargs):
+        """Move the window when the user scrolls to either end of the displayed messages
+
+        Args:
+            widget (toga.Widget): The widget that invoked this method
+        """
+        if self._updating:
+            return
+
+        if self.vertical_position <= ChatHistoryView.EDGE_DISTANCE and self._start > 0:
+            shift = min(self._page_size, self._start)
+            self._start -= shift
+            self._rebind()
+            self._scroll_to_fraction(shift / len(self._box.children))
+
+        elif self.vertical_position >= self.max_vertical_position - ChatHistoryView.EDGE_DISTANCE and not self.at_end:
+            shift = min(self._page_size, len(self._history) - self._start - len(self._box.children))
+            self._start += shift
+            self._rebind()
+            self._scroll_to_fraction(1 - shift / len(self._box.children))
+
+    def _show(self, index : int):
+        if index in self.displayed_range:
+            self._bind(self._box.children[index - self._start], index)
+
+    def _at_bottom(self) -> bool:
+        return self.at_end and self.vertical_position >= self.max_vertical_position - ChatHistoryView.EDGE_DISTANCE
+
+    def _follow_end(self):
+        if self._scheduler is None:
+            self.scroll_to_bottom()
+        else:
+            self._scheduler.schedule((self, "scroll"), self._scroll_to_end, final=True)
+
+    def _scroll_to_end(self):
+        # The window may have moved away from the end since the scroll was scheduled
+        if self.at_end:
+            self.scroll_to_bottom()
+
+    def _scroll_to_fraction(self, fraction : float):
+        # Message heights are unknown, so positions within the window can only be estimated from message counts
+        self._updating = True
+        try:
+            self.vertical_position = int(self.max_vertical_position * fraction)
+        finally:
+            self._updating = False
+
+    def _bind(self, message_box : MessageBox, index : int):
+        message_box.show(self._history[index])
+
+    def _rebind(self):
+        count = min(self._window_size, len(self._history) - self._start)
+
+        while len(self._box.children) > count:
+            self._box.remove(self._box.children[-1])
+        while len(self._box.children) < count:
+            self._box.add(MessageBox("user", ""))
+
+        for offset, message_box in enumerate(self._box.children):
+            self._bind(message_box, self._start + offset)
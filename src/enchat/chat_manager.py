@@ -0,0 +1,376 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from enchat.chat_history import ChatHistory
+from enchat.chat_session import ChatSession
+from enchat.completion_backend import CompletionBackend
+from enchat.conversation_store import ConversationStore
+from enchat.long_term_memory import LongTermMemory
+from enchat.response_cache import ResponseCache
+from enchat.rolling_summary import RollingSummary
+from enchat.search_index import SearchIndex
+
+
+class Chat:
+    """One of the chats of the application, which may be open (with its store, history and session in memory) or closed
+
+    Attributes:
+        name (str): The name of the chat, which is also the name of the directory holding it
+        directory (Path): The directory holding the store and configuration of the chat
+        store (ConversationStore | None): The store of the chat, while it is open
+        history (ChatHistory | None): The history of the chat, while it is open
+        session (ChatSession | None): The session of the chat, while it is open
+        reply_task (asyncio.Task | None): The task generating the current reply of the chat, if there is one
+        queued_messages (list[str]): Messages sent while a reply was being generated, to be sent together when it finishes
+        draft (str): The unsent text of the next user message, kept while another chat is displayed
+        candidates (list[Candidate]): Candidate replies to the last user message, generated at once, of which one may be added to
+            the history
+        last_used (float): The `time.monotonic` value at which the chat was last displayed or replied to
+    """
+
+    def __init__(self, name : str, directory : Path):
+        self.name = name
+        self.directory = directory
+        self.store = None
+        self.history = None
+        self.session = None
+        self.reply_task = None
+        self.queued_messages = []
+        self.draft = ""
+        self.candidates = []
+        self.last_used = time.monotonic()
+
+    @property
+    def is_open(self) -> bool:
+        """Whether the chat is open, i.e. its history and session are in memory
+
+        Returns:
+            bool: True if the chat is open
+        """
+        return self.session is not None
+
+    @property
+    def is_busy(self) -> bool:
+        """Whether the chat is generating a reply, has messages waiting to be sent, or has candidate replies to choose from
+
+        Returns:
+            bool: True if the chat is busy
+        """
+        return self.reply_task is not None or bool(self.queued_messages) or bool(self.candidates)
+
+
+class ChatManager:
+    """The chats of the application, each with its own history and configuration, sharing one completion backend
+
+    Every chat is a directory under the chats directory, holding its `ConversationStore`, its configuration (the system content
+    and sampling parameters, in `chat.json`), the oldest message sent with its prompt (in `budget.json`; see `ContextBudget`)
+    and, if `long_term_memory` is enabled, the embeddings of its messages (in `embeddings.f32`; see `LongTermMemory`). If
+    `summary_threshold` is set, each chat sends at most that many tokens of history, and a summary of the older messages (kept in
+    `summary.json`; see `RollingSummary`). Any number of chats can generate replies at once; their requests share the backend
+    (e.g. the client's pool of connections).
+
+    The memory used by the chats is bounded, however many there are, and however long they get:
+
+    * Only the active chat is displayed, so only it has widgets (see `ChatHistoryView.history`)
+    * When a chat stops being the active one, its history is compacted to the page holding its last message
+    * When the estimated memory of the open chats exceeds `memory_cap`, the least recently used chats that are idle (neither
+      active nor busy) are closed: their stores are closed, and their history and session are dropped. Their messages stay on
+      disk, and a closed chat is opened again when it is next needed
+
+    Attributes:
+        directory (Path): The directory holding a subdirectory for each chat
+        client (CompletionBackend): The backend shared by every chat
+        system_content (str): The system content of a new chat
+        parameters (dict): The sampling parameters of a new chat
+        response_cache (ResponseCache | None): Cache of the replies to deterministic requests, shared by every chat
+        search_index (SearchIndex | None): The index the messages of open chats are added to as they arrive
+        greeting (str | None): The first message of each new chat, from the assistant
+        memory_cap (int): The memory (in bytes) above which idle chats are closed
+        long_term_memory (bool): Whether chats recall relevant messages that no longer fit in the context window
+        summary_threshold (int): The most tokens of history sent with a prompt, before older messages are summarised, or 0 for no
+            summaries
+        chats (dict[str, Chat]): The chats, by name, in the order they were found or created
+        active (Chat | None): The chat being displayed
+        CONFIGURATION_FILE (str): The name of the file holding the configuration of each chat
+        EMBEDDINGS_FILE (str): The name of the file holding the embeddings of the messages of each chat
+        SUMMARY_FILE (str): The name of the file holding the summary of the old messages of each chat
+        BUDGET_FILE (str): The name of the file holding the oldest message sent with the prompt of each chat
+        DEFAULT_MEMORY_CAP (int): The default memory cap, in bytes
+    """
+
+    CONFIGURATION_FILE = "chat.json"
+
+    EMBEDDINGS_FILE = "embeddings.f32"
+
+    SUMMARY_FILE = "summary.json"
+
+    BUDGET_FILE = "budget.json"
+
+    DEFAULT_MEMORY_CAP = 64 * 1024 * 1024
+
+    def __init__(self, directory, client : CompletionBackend, system_content : str, parameters : dict,
+                 response_cache : ResponseCache = None, search_index : SearchIndex = None, greeting : str = None,
+                 memory_cap : int = DEFAULT_MEMORY_CAP, long_term_memory : bool = True, summary_threshold : int = 0):
+        """Set up the manager, finding the chats saved in the directory; no chat is opened until it is needed
+
+        Args:
+            directory (str | Path): The directory holding a subdirectory for each chat, created if it does not exist
+            client (CompletionBackend): The backend shared by every chat
+            system_content (str): The system content of a new chat
+            parameters (dict): The sampling parameters of a new chat
+            response_cache (ResponseCache): Cache of the replies to deterministic requests, shared by every chat
+            search_index (SearchIndex): The index the messages of open chats are added to as they arrive
+            greeting (str): The first message of each new chat, from the assistant
+            memory_cap (int): The memory (in bytes) above which idle chats are closed
+            long_term_memory (bool): Whether chats recall relevant messages that no longer fit in the context window
+            summary_threshold (int): The most tokens of history sent with a prompt, before older messages are summarised, or 0
+                for no summaries
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.client = client
+        self.system_content = system_content
+        self.parameters = dict(parameters)
+        self.response_cache = response_cache
+        self.search_index = search_index
+        self.greeting = greeting
+        self.memory_cap = memory_cap
+        self.long_term_memory = long_term_memory
+        self.summary_threshold = summary_threshold
+        self.active = None
+
+        self.chats = {}
+        for path in sorted(self.directory.iterdir()):
+            if (path / ConversationStore.INDEX_FILE).is_file():
+                self.chats[path.name] = Chat(path.name, path)
+
+    def create(self, name : str = None) -> Chat:
+        """Create a new, empty chat (holding only the greeting, if there is one), and open it
+
+        Args:
+            name (str): The name of the chat; by default, the first unused name of the form "chat-N"
+
+        Returns:
+            Chat: The new chat
+        """
+        if name is None:
+            number = len(self.chats) + 1
+            while f"chat-{number}" in self.chats:
+                number += 1
+            name = f"chat-{number}"
+        assert(name not in self.chats)
+
+        chat = self.chats[name] = Chat(name, self.directory / name)
+        self.open(chat)
+        return chat
+
+    def open(self, chat : Chat) -> Chat:
+        """Open a chat, if it is not already open
+
+        Args:
+            chat (Chat): The chat
+
+        Returns:
+            Chat: The chat
+        """
+        if chat.is_open:
+            return chat
+
+        system_content, parameters = self._read_configuration(chat)
+        chat.store = ConversationStore(chat.directory)
+        chat.history = ChatHistory(chat.store)
+        if len(chat.history) == 0 and self.greeting is not None:
+            chat.history.append("assistant", self.greeting)
+        memory = None
+        if self.long_term_memory:
+            memory = LongTermMemory(self.client, chat.history, chat.directory / ChatManager.EMBEDDINGS_FILE)
+        chat.session = ChatSession(chat.history, self.client, system_content, parameters, response_cache=self.response_cache,
+                                   memory=memory, summary=self._create_summary(chat),
+                                   budget_path=chat.directory / ChatManager.BUDGET_FILE)
+        if self.search_index is not None:
+            self.search_index.add_chat(chat.name, chat.history, follow=True)
+
+        logging.debug(f"opened chat {chat.name} with {len(chat.history)} messages")
+        return chat
+
+    def activate(self, name : str) -> Chat:
+        """Make a chat the active one, opening (or creating) it if necessary
+
+        The previously active chat is compacted, and idle chats are closed if the memory cap has been exceeded.
+
+        Args:
+            name (str): The name of the chat
+
+        Returns:
+            Chat: The chat
+        """
+        chat = self.chats.get(name)
+        chat = self.open(chat) if chat is not None else self.create(name)
+
+        previous, self.active = self.active, chat
+        chat.last_used = time.monotonic()
+        if previous is not None and previous is not chat and previous.is_open:
+            previous.history.compact()
+        self.enforce_memory_cap()
+        return chat
+
+    def configure(self, chat : Chat, system_content : str, parameters : dict):
+        """Change the configuration of an open chat, and save it with the chat
+
+        Args:
+            chat (Chat): The chat
+            system_content (str): The new system content
+            parameters (dict): The new sampling parameters
+        """
+        chat.session.configure(system_content, parameters)
+
+        path = chat.directory / ChatManager.CONFIGURATION_FILE
+        temporary = path.with_suffix(".tmp")
+        try:
+            temporary.write_text(json.dumps({'system_content': system_content, 'parameters': parameters}), encoding='utf-8')
+            os.replace(temporary, path)
+        except OSError as e:
+            logging.error(f"could not save the configuration of chat {chat.name}: {e!r}")
+
+    def set_client(self, client : CompletionBackend):
+        """Change the backend shared by every chat; open chats use it from their next request, and closed chats when they are
+        opened
+
+        Args:
+            client (CompletionBackend): The backend
+        """
+        self.client = client
+        for chat in self.chats.values():
+            if chat.is_open:
+                chat.session.set_client(client)
+
+    def set_summary_threshold(self, summary_threshold : int):
+        """Change the most tokens of history sent with a prompt, before older messages are summarised; open chats use it from
+        their next request
+
+        Args:
+            summary_threshold (int): The threshold, in tokens, or 0 for no summaries
+        """
+        self.summary_threshold = summary_threshold
+        for chat in self.chats.values():
+            if not chat.is_open:
+                continue
+            if chat.session.summary is not None and summary_threshold > 0:
+                chat.session.summary.threshold = summary_threshold
+            elif chat.session.summary is not None:
+                chat.session.summary.close()
+                chat.session.summary = None
+            else:
+                chat.session.summary = self._create_summary(chat)
+
+    def history(self, name : str) -> ChatHistory:
+        """The history of a chat, opening the chat if it is closed
+
+        Args:
+            name (str): The name of the chat
+
+        Returns:
+            ChatHistory | None: The history, or None if there is no such chat
+        """
+        chat = self.chats.get(name)
+        return self.open(chat).history if chat is not None else None
+
+    def memory_size(self) -> int:
+        """An estimate of the memory used by the open chats
+
+        Returns:
+            int: The estimated size, in bytes
+        """
+        return sum(chat.session.memory_size() for chat in self.chats.values() if chat.is_open)
+
+    def enforce_memory_cap(self):
+        """Compact every open chat except the active one, then close the least recently used idle chats until the estimated memory
+        of the open chats is within the cap"""
+        for chat in self.chats.values():
+            if chat.is_open and chat is not self.active:
+                chat.history.compact()
+
+        size = self.memory_size()
+        idle = sorted((chat for chat in self.chats.values() if chat.is_open and chat is not self.active and not chat.is_busy),
+                      key=lambda chat: chat.last_used)
+        for chat in idle:
+            if size <= self.memory_cap:
+                break
+            size -= chat.session.memory_size()
+            self.close_chat(chat)
+            logging.info(f"closed idle chat {chat.name} to keep the open chats within {self.memory_cap // 1024} KiB")
+
+    def offload(self) -> int:
+        """Drop from memory as much of the chats as can be read back from disk: close every idle chat, and compact the others,
+        including the active chat
+
+        Returns:
+            int: The estimated number of bytes dropped
+        """
+        size = self.memory_size()
+        for chat in self.chats.values():
+            if chat.is_open and chat is not self.active and not chat.is_busy:
+                self.close_chat(chat)
+        for chat in self.chats.values():
+            if chat.is_open:
+                chat.history.compact()
+        return size - self.memory_size()
+
+    def close_chat(self, chat : Chat):
+        """Close a chat, saving any pending messages, and dropping its history and session from memory
+
+        Args:
+            chat (Chat): The chat
+        """
+        if not chat.is_open:
+            return
+        if self.search_index is not None:
+            self.search_index.remove_chat(chat.name)
+        if chat.session.memory is not None:
+            chat.session.memory.close()
+        if chat.session.summary is not None:
+            chat.session.summary.close()
+        chat.store.close()
+        chat.store = None
+        chat.history = None
+        chat.session = None
+
+    async def stop_replies(self):
+        """Stop every reply being generated, and wait for each to save the part of the reply generated so far; messages waiting to
+        be sent are discarded"""
+        tasks = []
+        for chat in self.chats.values():
+            chat.queued_messages.clear()
+            if chat.reply_task is not None:
+                chat.reply_task.cancel()
+                tasks.append(chat.reply_task)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        """Stop every reply being generated, and close every chat
+
+        A stopped reply only saves what it has generated once its task has handled the cancellation, which it cannot do after its
+        chat is closed; to keep partial replies, stop the replies first, with `stop_replies`.
+        """
+        for chat in self.chats.values():
+            if chat.reply_task is not None:
+                chat.reply_task.cancel()
+            self.close_chat(chat)
+
+    def _create_summary(self, chat : Chat) -> RollingSummary:
+        if self.summary_threshold <= 0:
+            return None
+        return RollingSummary(self.client, chat.history, chat.directory / ChatManager.SUMMARY_FILE, threshold=self.summary_threshold)
+
+    def _read_configuration(self, chat : Chat) -> tuple:
+        try:
+            configuration = json.loads((chat.directory / ChatManager.CONFIGURATION_FILE).read_text(encoding='utf-8'))
+            return configuration['system_content'], dict(self.parameters, **configuration['parameters'])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f"could not read the configuration of chat {chat.name} ({e!r}); using the defaults")
+        return self.system_content, self.parameters
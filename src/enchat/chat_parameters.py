@@ -0,0 +1,112 @@
+from itertools import product
+from toga.validators import Number
+from enchat.validators import FloatRange, IntegerRange
+
+DEFAULT_PARAMETERS = {
+    'temperature': 0.8,
+    'n_predict': -1,
+    'top_k': 40,
+    'repeat_penalty': 1.1,
+    'min_p': 0.95,
+    'top_p': 0.95,
+    'seed': -1
+}
+
+PARAMETER_VALIDATORS = {
+    'temperature': [Number(error_message="must be a number", allow_empty=False),
+                    FloatRange("must be in the range [0,1]", allow_empty=False, min=0.0, max=1.0)],
+    'n_predict': [Number(error_message="must be a number", allow_empty=False),
+                  IntegerRange(error_message="must be an integer greater than -1", allow_empty=False, min=-1)],
+    'top_k': [Number(error_message="must be a number", allow_empty=False),
+              IntegerRange(error_message="must be an integer greater than 0", allow_empty=False, min=0)],
+    'repeat_penalty': [Number(error_message="must be a number", allow_empty=False),
+                       FloatRange(error_message="must be greater than or equal to 0", allow_empty=False, min=0.0)],
+    'min_p': [Number(error_message="must be a number", allow_empty=False),
+              FloatRange(error_message="must be in the range [0,1]", allow_empty=False, min=0, max=1)],
+    'top_p': [Number(error_message="must be a number", allow_empty=False),
+              FloatRange(error_message="must be in the range [0,1]", allow_empty=False, min=0, max=1)],
+    'seed': [Number(error_message="must be a number", allow_empty=False),
+             IntegerRange(error_message="must be an integer greater than or equal to -1", allow_empty=False, min=-1)]
+}
+
+DEFAULT_CANDIDATES = 3
+
+MAX_CANDIDATES = 8
+
+PARAMETER_TYPES = {
+    'temperature': float,
+    'n_predict': int,
+    'top_k': int,
+    'repeat_penalty': float,
+    'min_p': float,
+    'top_p': float,
+    'seed': int
+}
+
+
+def parse_parameter(name : str, value : str):
+    """Validate and convert a sampling parameter given as a string, with the same rules as the Chat Configuration UI
+
+    Args:
+        name (str): The name of the parameter in the server's completion API, e.g. "temperature"
+        value (str): The value of the parameter
+
+    Returns:
+        float | int: The converted value
+
+    Raises:
+        ValueError: The value is not valid for the parameter
+    """
+    for validator in PARAMETER_VALIDATORS[name]:
+        error_message = validator(str(value))
+        if error_message is not None:
+            raise ValueError(f"{name} {error_message}")
+
+    return PARAMETER_TYPES[name](float(value))
+
+
+def parse_candidates(spec : str, parameters : dict) -> list:
+    """Parse a description of the candidate replies to generate at once for a message
+
+    The description is either a number of candidates to generate with the same parameters (an n-best list), or a sweep of one or
+    more parameters, each with a comma-separated list of values, separated by semicolons, e.g. `temperature=0.2,0.5,0.8` or
+    `temperature=0.2,0.8; top_k=20,40`; a sweep of several parameters generates a candidate for every combination of their
+    values. An empty description means `DEFAULT_CANDIDATES` candidates.
+
+    Candidates with the same parameters and a fixed seed would all be the same, so their seeds are offset by their number.
+
+    Args:
+        spec (str): The description of the candidates
+        parameters (dict): The sampling parameters of the chat, which each candidate starts from
+
+    Returns:
+        list[dict]: The parameters that differ from the chat's parameters, for each candidate
+
+    Raises:
+        ValueError: The description is not valid, or describes fewer than 2 or more than `MAX_CANDIDATES` candidates
+    """
+    spec = spec.strip() or str(DEFAULT_CANDIDATES)
+
+    if spec.isdigit():
+        variants = [{} for number in range(int(spec))]
+    else:
+        names = []
+        values = []
+        for part in filter(None, (part.strip() for part in spec.split(";"))):
+            name, separator, value_list = part.partition("=")
+            name = name.strip().replace("-", "_")
+            if not separator or name not in PARAMETER_TYPES:
+                raise ValueError(f"'{part}' is not of the form parameter=value,value,... (parameters: {', '.join(PARAMETER_TYPES)})")
+            names.append(name)
+            values.append([parse_parameter(name, value.strip()) for value in value_list.split(",") if value.strip()])
+        variants = [dict(zip(names, combination)) for combination in product(*values)]
+
+    if not 2 <= len(variants) <= MAX_CANDIDATES:
+        raise ValueError(f"there must be from 2 to {MAX_CANDIDATES} candidates, not {len(variants)}")
+
+    duplicated = [variants.count(variant) > 1 for variant in variants]
+    for number, variant in enumerate(variants):
+        seed = variant.get('seed', parameters['seed'])
+        if seed >= 0 and duplicated[number]:
+            variant['seed'] = seed + number
+    return variants
@@ -0,0 +1,415 @@
+import asyncio
+import logging
+
+from enchat.chat_history import ChatHistory
+from enchat.completion_backend import CompletionBackend, CompletionError
+from enchat.context_budget import ContextBudget
+from enchat.long_term_memory import LongTermMemory
+from enchat.prompt_cache import PromptCache
+from enchat.prompt_format import format_draft, format_prompt
+from enchat.request_metrics import RequestMetrics, SessionStats
+from enchat.response_cache import ReplayStream, ResponseCache
+from enchat.rolling_summary import RollingSummary
+
+
+class Candidate:
+    """One of several replies to the same user message, generated at the same time with different parameters (or seeds)
+
+    Attributes:
+        number (int): The position of the candidate among the candidates for the message
+        variant (dict): The parameters of the candidate that differ from the parameters of the chat
+        text (str): The text of the candidate, so far
+        result (dict): The final event from the server; empty until the candidate is finished
+        error (Exception | None): The error that ended the candidate, if it failed
+        metrics (RequestMetrics): The latency and throughput of the candidate
+        finished (bool): Whether the candidate has finished (or failed)
+    """
+
+    def __init__(self, number : int, variant : dict):
+        self.number = number
+        self.variant = variant
+        self.text = ""
+        self.result = {}
+        self.error = None
+        self.metrics = RequestMetrics()
+        self.finished = False
+        self._prompt = None
+
+    @property
+    def description(self) -> str:
+        """A short description of the parameters of the candidate, e.g. "temperature=0.2 top_k=20"
+
+        Returns:
+            str: The description
+        """
+        return " ".join(f"{name}={value}" for name, value in self.variant.items()) or f"candidate {self.number + 1}"
+
+
+class ChatSession:
+    """The state of a single chat, and the path by which each user message becomes a reply from the server
+
+    The session holds the history and configuration of the chat, and the per-chat state of the request path: the `PromptCache`
+    (tracking the prompt the server has cached for the chat) and the `ContextBudget` (choosing the messages sent with each
+    request). The completion backend (e.g. the client, and its pool of connections) may be shared between sessions, as may the
+    `ResponseCache`. A long chat may also have a `RollingSummary` of the messages dropped from its prompt, which is sent after the
+    system content, and updated in the background after each reply.
+
+    The session is independent of any widget; the UI displays it through its history (see `ChatHistoryView`), and the same path is
+    exercised without a UI by the load harness.
+
+    Attributes:
+        history (ChatHistory): The history of the chat
+        client (CompletionBackend): The backend used to request completions
+        system_content (str): The system content of the chat
+        parameters (dict): The sampling parameters of the chat
+        response_cache (ResponseCache | None): Cache of the replies to deterministic requests, if any
+        prompt_cache (PromptCache): Tracks the prompt cached by the server for the chat
+        context_budget (ContextBudget): Chooses the messages sent with each request, to fit the server's context window
+        memory (LongTermMemory | None): Recalls relevant messages that no longer fit in the context window, if the chat has one
+        summary (RollingSummary | None): Summarises the messages that no longer fit in the prompt, if the chat has one
+        last_result (dict): The final event from the server for the last reply (empty if it was replayed from the cache, or failed)
+        last_error (Exception | None): The error that ended the last reply, if it failed
+        last_metrics (RequestMetrics | None): The latency and throughput of the last reply
+        stats (SessionStats): The aggregated metrics of every reply in the session
+    """
+
+    def __init__(self, history : ChatHistory, client : CompletionBackend, system_content : str, parameters : dict,
+                 response_cache : ResponseCache = None, memory : LongTermMemory = None, summary : RollingSummary = None,
+                 budget_path = None):
+        """Set up the session
+
+        Args:
+            history (ChatHistory): The history of the chat
+            client (CompletionBackend): The backend used to request completions
+            system_content (str): The system content of the chat
+            parameters (dict): The sampling parameters of the chat
+            response_cache (ResponseCache): Cache of the replies to deterministic requests, if any
+            memory (LongTermMemory): Recalls relevant messages that no longer fit in the context window
+            summary (RollingSummary): Summarises the messages that no longer fit in the prompt
+            budget_path (str | Path): The file the `ContextBudget` saves the oldest message sent to, if any
+        """
+        self.history = history
+        self.client = client
+        self.system_content = system_content
+        self.parameters = dict(parameters)
+        self.response_cache = response_cache
+        self.prompt_cache = PromptCache()
+        self.context_budget = ContextBudget(client, history, path=budget_path)
+        self.memory = memory
+        self.summary = summary
+        self.last_result = {}
+        self.last_error = None
+        self.last_metrics = None
+        self.stats = SessionStats()
+        self._candidate_slots = {}
+
+    def configure(self, system_content : str, parameters : dict):
+        """Change the configuration of the chat, invalidating the server's cached prompt if the change requires it
+
+        Args:
+            system_content (str): The new system content
+            parameters (dict): The new sampling parameters
+        """
+        self.prompt_cache.configuration_changed(self.system_content, system_content, self.parameters, parameters)
+        self.system_content = system_content
+        self.parameters = dict(parameters)
+
+    def set_client(self, client : CompletionBackend):
+        """Request completions from a different backend, from the next request on
+
+        What the session knows about the previous backend's model (its context size, the token counts of the messages, and the
+        prompt it has cached) is forgotten.
+
+        Args:
+            client (CompletionBackend): The backend
+        """
+        self.client = client
+        self.context_budget.set_client(client)
+        self.prompt_cache.invalidate("the backend has changed")
+        self._candidate_slots = {}
+        if self.memory is not None:
+            self.memory.client = client
+        if self.summary is not None:
+            self.summary.client = client
+
+    def memory_size(self) -> int:
+        """An estimate of the memory used by the session, including the messages of its history held in memory
+
+        Returns:
+            int: The estimated size, in bytes
+        """
+        return self.history.memory_size() + self.prompt_cache.memory_size() + self.context_budget.memory_size()
+
+    async def send(self, user_message : str) -> int:
+        """Add a user message to the chat, and stream the assistant's reply into a new message of the history
+
+        The prompt is built from the system content and as much of the history (including the new message) as fits in the server's
+        context window. The reply message is updated as each piece of text arrives, and saved when it is finished. If the request
+        fails, the error is appended to the reply. If the task is cancelled (i.e. the user stops the reply), the stream is closed,
+        which closes its connection and so tells the server to stop generating; the partial reply is saved before the cancellation
+        propagates.
+
+        An unlimited reply (`n_predict` of -1) is limited to the tokens the `ContextBudget` reserves for it, so a runaway
+        generation cannot tie up the server indefinitely.
+
+        The latency and throughput of the reply are recorded in `last_metrics`, attached to the reply message for display, and
+        added to the session `stats`.
+
+        If the chat has a summary, an update of it in progress is stopped while the reply is generated, and started again once the
+        reply has finished (or been stopped), if messages have been dropped from the prompt since it was made.
+
+        Args:
+            user_message (str): The text of the user message
+
+        Returns:
+            int: The index of the reply in the history
+        """
+        metrics = RequestMetrics()
+        self.history.append("user", user_message)
+        self.last_result = {}
+        self.last_error = None
+        self.last_metrics = None
+
+        reply_index = None
+        reply = ""
+        chunks = 0
+        stream = None
+        cached_reply = None
+        self._pause_summary()
+        try:
+            system_content = self._system_content
+            indexes = await self.context_budget.fit(system_content, self.parameters['n_predict'], recall=self._recall,
+                                                    limit=await self._history_limit())
+            prompt = format_prompt(system_content, self.history.as_pairs(indexes))
+            self.prompt_cache.check_prompt(prompt)
+
+            parameters = dict(self.parameters)
+            parameters.update(self.prompt_cache.request_parameters)
+            parameters['n_predict'] = await self.context_budget.reply_limit(self.parameters['n_predict'])
+
+            # Deterministic requests may be answered from the response cache, replayed through the same path as a live reply; the
+            # cache is shared by every backend and server, so only replies from a known model are cached
+            cache_key = None
+            if self.response_cache is not None and ResponseCache.is_deterministic(parameters):
+                model = await self.context_budget.model()
+                if model is not None:
+                    cache_key = ResponseCache.key(prompt, parameters, f"{self.client.name}:{model}")
+            cached_reply = self.response_cache.get(cache_key) if cache_key is not None else None
+            if cached_reply is not None:
+                stream = ReplayStream(cached_reply)
+            else:
+                stream = self.client.stream_completion(prompt, parameters, preferred=self.prompt_cache.endpoint)
+
+            reply_index = self.history.append("assistant", "")
+            async for text in stream:
+                metrics.first_token()
+                chunks += 1
+                reply += text
+                self.history.update(reply_index, reply, save=False)
+            self.history.update(reply_index, reply)
+            metrics.finish(stream.result, chunks, cached=cached_reply is not None)
+
+            if cached_reply is None:
+                self.last_result = stream.result
+                self.prompt_cache.record(prompt, stream.result)
+                if cache_key is not None:
+                    self.response_cache.put(cache_key, reply)
+        except (CompletionError, OSError, asyncio.TimeoutError) as e:
+            logging.error(f"completion request failed: {e!r}")
+            self.last_error = e
+            metrics.finish({}, chunks, error=e)
+            if reply_index is None:
+                reply_index = self.history.append("assistant", "")
+            self.history.update(reply_index, reply + f"[Error: {e or type(e).__name__}]")
+        except asyncio.CancelledError:
+            logging.info(f"reply stopped after {chunks} pieces of text")
+            metrics.finish(stream.result if stream is not None else {}, chunks, stopped=True)
+            self._record_metrics(metrics, reply_index)
+            if reply_index is not None:
+                self.history.update(reply_index, reply)
+            self._update_summary()
+            raise
+
+        self._record_metrics(metrics, reply_index)
+        self._update_summary()
+        return reply_index
+
+    async def prefill(self, draft : str) -> bool:
+        """Send the start of the prompt that a draft of the next user message will be sent with, generating nothing, so the
+        server evaluates (and caches) it while the user is still typing
+
+        When the message is sent, the server then only has to evaluate what was typed after the draft. The request goes to the
+        chat's server and slot, as a reply would. Dropped messages are not recalled for a draft (see `LongTermMemory`), as what is
+        relevant depends on the finished message.
+
+        Args:
+            draft (str): The text of the next user message, so far
+
+        Returns:
+            bool: True if the server evaluated the prompt, False if the request failed
+        """
+        try:
+            system_content = self._system_content
+            indexes = await self.context_budget.fit(system_content, self.parameters['n_predict'],
+                                                    limit=await self._history_limit())
+            prompt = format_draft(system_content, self.history.as_pairs(indexes), draft)
+
+            parameters = dict(self.parameters)
+            parameters.update(self.prompt_cache.request_parameters)
+            parameters['n_predict'] = 0
+            stream = self.client.stream_completion(prompt, parameters, preferred=self.prompt_cache.endpoint)
+            async for text in stream:
+                pass
+        except (CompletionError, OSError, asyncio.TimeoutError) as e:
+            logging.debug(f"could not prefill the prompt of the draft: {e!r}")
+            return False
+
+        self.prompt_cache.record(prompt, stream.result)
+        logging.debug(f"prefilled {stream.result.get('timings', {}).get('prompt_n', '?')} tokens of the prompt of the draft")
+        return True
+
+    async def generate_candidates(self, user_message : str, variants : list, on_update = None) -> list:
+        """Add a user message to the chat, and generate several candidate replies to it at the same time
+
+        Every candidate is sent the same prompt, so the requests differ only in their sampling parameters. They are sent
+        concurrently (through the client's pool of connections), so generating N candidates takes about as long as generating the
+        slowest one, provided the server has N slots free. The first candidate uses the chat's server slot, which holds the cached
+        prefix of the prompt. Each other candidate keeps the slot (and server) it was generated in for the next set of candidates,
+        so from the second set of candidates on, every slot only evaluates the latest turn.
+
+        The candidates are not added to the history; one of them is added with `promote`. If the task is cancelled, every
+        candidate is stopped.
+
+        Args:
+            user_message (str): The text of the user message
+            variants (list[dict]): The parameters that differ from the chat's parameters, for each candidate (see
+                `parse_candidates`)
+            on_update: Called with each candidate (in order) before any is requested, then as its text changes, and when it
+                finishes
+
+        Returns:
+            list[Candidate]: The candidates, each finished or failed
+        """
+        candidates = [Candidate(number, variant) for number, variant in enumerate(variants)]
+        self._pause_summary()
+        self.history.append("user", user_message)
+        self.last_error = None
+        if on_update is not None:
+            for candidate in candidates:
+                on_update(candidate)
+
+        try:
+            # Leave room for the longest candidate
+            limits = [dict(self.parameters, **variant)['n_predict'] for variant in variants]
+            n_predict = -1 if min(limits) < 0 else max(limits)
+            system_content = self._system_content
+            indexes = await self.context_budget.fit(system_content, n_predict, recall=self._recall,
+                                                    limit=await self._history_limit())
+            prompt = format_prompt(system_content, self.history.as_pairs(indexes))
+            self.prompt_cache.check_prompt(prompt)
+        except (CompletionError, OSError, asyncio.TimeoutError) as e:
+            logging.error(f"could not prepare the prompt for the candidates: {e!r}")
+            self.last_error = e
+            for candidate in candidates:
+                candidate.error = e
+                candidate.finished = True
+                candidate.metrics.finish({}, 0, error=e)
+                if on_update is not None:
+                    on_update(candidate)
+            return candidates
+
+        await asyncio.gather(*[self._generate_candidate(candidate, prompt, on_update) for candidate in candidates])
+        return candidates
+
+    def promote(self, candidate : Candidate) -> int:
+        """Add a candidate to the history, as the reply to the user message it was generated for
+
+        The server slot that generated the candidate holds the prompt and the candidate, so it becomes the chat's slot; the chat's
+        previous slot is kept for the candidate's position in the next set of candidates.
+
+        Args:
+            candidate (Candidate): The candidate
+
+        Returns:
+            int: The index of the reply in the history
+        """
+        # The metrics of every candidate were added to the stats as it finished
+        index = self.history.append("assistant", candidate.text)
+        self.last_metrics = candidate.metrics
+        self.history.set_metrics(index, candidate.metrics)
+
+        if candidate.error is None and candidate.number > 0:
+            self._candidate_slots[candidate.number] = (self.prompt_cache.endpoint, self.prompt_cache.slot_id)
+        if candidate.error is None:
+            self.prompt_cache.record(candidate._prompt, candidate.result)
+        self._update_summary()
+        return index
+
+    async def _generate_candidate(self, candidate : Candidate, prompt : str, on_update):
+        parameters = dict(self.parameters, **candidate.variant)
+        parameters['n_predict'] = await self.context_budget.reply_limit(parameters['n_predict'])
+        if candidate.number == 0:
+            parameters.update(self.prompt_cache.request_parameters)
+            preferred = self.prompt_cache.endpoint
+        else:
+            preferred, slot_id = self._candidate_slots.get(candidate.number, (None, -1))
+            parameters.update(cache_prompt=True, id_slot=slot_id)
+
+        candidate._prompt = prompt
+        chunks = 0
+        stream = self.client.stream_completion(prompt, parameters, preferred=preferred)
+        try:
+            async for text in stream:
+                candidate.metrics.first_token()
+                chunks += 1
+                candidate.text += text
+                if on_update is not None:
+                    on_update(candidate)
+            candidate.result = stream.result
+            candidate.metrics.finish(stream.result, chunks)
+            if candidate.number > 0:
+                self._candidate_slots[candidate.number] = (stream.result.get('endpoint'),
+                                                           stream.result.get('id_slot', stream.result.get('slot_id', -1)))
+        except (CompletionError, OSError, asyncio.TimeoutError) as e:
+            logging.error(f"candidate {candidate.number} failed: {e!r}")
+            candidate.error = e
+            candidate.text += f"[Error: {e or type(e).__name__}]"
+            candidate.metrics.finish({}, chunks, error=e)
+        except asyncio.CancelledError:
+            candidate.metrics.finish(stream.result, chunks, stopped=True)
+            raise
+        finally:
+            candidate.finished = True
+            self.stats.add(candidate.metrics)
+            if on_update is not None:
+                on_update(candidate)
+
+    @property
+    def _recall(self):
+        return self.memory.recall if self.memory is not None else None
+
+    @property
+    def _system_content(self) -> str:
+        return self.summary.system_content(self.system_content) if self.summary is not None else self.system_content
+
+    async def _history_limit(self) -> int:
+        # The history is held to the summary's threshold only where the summary can be made (see `RollingSummary`)
+        if self.summary is None or await self.context_budget.slots() == 1:
+            return None
+        return self.summary.threshold
+
+    def _pause_summary(self):
+        if self.summary is not None:
+            self.summary.cancel()
+
+    def _update_summary(self):
+        if self.summary is not None:
+            dropped = range(min(self.context_budget.pin_first, len(self.history)), self.context_budget.first_kept)
+            self.summary.schedule(dropped, self.context_budget, endpoint=self.prompt_cache.endpoint,
+                                  chat_slot=self.prompt_cache.slot_id)
+
+    def _record_metrics(self, metrics : RequestMetrics, reply_index : int):
+        self.last_metrics = metrics
+        self.stats.add(metrics)
+        if reply_index is not None:
+            self.history.set_metrics(reply_index, metrics)
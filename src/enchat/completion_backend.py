@@ -0,0 +1,126 @@
+from typing import AsyncIterator
+
+from enchat.prompt_format import STOP_STRINGS
+
+
+class CompletionError(Exception):
+    """Raised when the server rejects a completion request, or its response cannot be understood"""
+
+
+class ServerUnavailableError(CompletionError):
+    """Raised when the server is temporarily unable to handle a request (e.g. it is overloaded, or still loading its model)"""
+
+
+class CompletionStream:
+    """A streamed completion, returned by `CompletionBackend.stream_completion`
+
+    Iterating over the stream (with `async for`) makes the request, and yields the text of the reply as it is generated. Once the
+    iteration has finished, `result` holds the final event from the backend, without its content, in the form of a llama.cpp-style
+    server's final event (e.g. `id_slot`, the slot that generated the reply, `tokens_cached`, `tokens_predicted`, and `timings`),
+    plus the address of the server (or the name of the backend) that generated the reply, as `endpoint`, and, for servers, the
+    time the request waited for a connection, as `queue_seconds`.
+
+    Closing the iteration before it has finished (e.g. by cancelling the task iterating over it) cancels the request: the backend
+    stops generating the reply.
+
+    Attributes:
+        result (dict): The fields of the final event from the backend; empty until the stream has finished
+    """
+
+    def __init__(self, backend : 'CompletionBackend', body : dict, preferred : str):
+        self.result = {}
+        self._backend = backend
+        self._body = body
+        self._preferred = preferred
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._backend._stream(self._body, self._preferred, self.result)
+
+
+class CompletionBackend:
+    """Generates the replies of the chats, and tokenizes and embeds their messages; the interface shared by every backend
+
+    The rest of the application only uses this interface, so the model can be served in different ways:
+
+    * `CompletionClient` - requests are sent over HTTP to one or more llama.cpp-style servers
+    * `LocalBackend` - a model is run in a worker process of the application, without a server
+    * `StubBackend` - deterministic replies are generated in-process, without a model, for tests
+
+    Every backend takes requests in the form of a llama.cpp-style server's completion API (`n_predict`, `temperature`, `id_slot`
+    etc.), and reports results in the same form; parameters that do not apply to a backend are ignored. An `n_predict` of 0 only
+    evaluates the prompt (see `ChatSession.prefill`).
+
+    Subclasses implement `_stream`, `tokenize`, `embed` and `props`, and `close` if they hold resources.
+
+    Attributes:
+        name (str): A short description of the backend, for the log
+    """
+
+    name = "backend"
+
+    def stream_completion(self, prompt : str, parameters : dict, preferred : str = None) -> CompletionStream:
+        """Request a completion of the given prompt, streaming the text of the reply as it is generated
+
+        Iterating over the returned stream raises `CompletionError` if the backend rejected the request or sent something that
+        could not be understood, `OSError` if a connection failed, and `asyncio.TimeoutError` if the backend did not respond in
+        time.
+
+        Args:
+            prompt (str): The entire prompt to complete
+            parameters (dict): Parameters for the backend, keyed by their names in the completion API
+            preferred (str): The address of the server to use if it is reasonably good (e.g. the server holding the prompt cache
+                for the chat); the `id_slot` parameter only applies to this server
+
+        Returns:
+            CompletionStream: The stream of generated text
+        """
+        body = dict(parameters)
+        body.update(prompt=prompt, stream=True, stop=STOP_STRINGS)
+        return CompletionStream(self, body, preferred)
+
+    async def tokenize(self, text : str) -> list:
+        """Convert text into the model's tokens
+
+        Args:
+            text (str): The text to tokenize
+
+        Returns:
+            list[int]: The tokens of the text
+
+        Raises:
+            CompletionError: The backend could not tokenize the text
+        """
+        raise NotImplementedError
+
+    async def embed(self, text : str) -> list:
+        """Get the embedding of text, i.e. a vector whose direction represents its meaning
+
+        Args:
+            text (str): The text to embed
+
+        Returns:
+            list[float]: The embedding
+
+        Raises:
+            CompletionError: The backend does not provide embeddings, or could not embed the text
+        """
+        raise NotImplementedError
+
+    async def props(self) -> dict:
+        """Get the properties of the model, in the form of a llama.cpp-style server's properties, including its default generation
+        settings (e.g. `n_ctx`, the context size)
+
+        Returns:
+            dict: The properties
+
+        Raises:
+            CompletionError: The backend could not report its properties
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        """Release any resources held by the backend (e.g. a worker process); requests made afterwards may acquire them again"""
+        pass
+
+    def _stream(self, body : dict, preferred : str, result : dict) -> AsyncIterator[str]:
+        raise NotImplementedError
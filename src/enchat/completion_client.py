@@ -0,0 +1,184 @@
+import asyncio
+import json
+import logging
+from contextlib import aclosing
+from typing import AsyncIterator
+
+from enchat.completion_backend import CompletionBackend, CompletionError, ServerUnavailableError
+from enchat.endpoint_pool import EndpointPool
+from enchat.http_transport import HttpResponse, HttpTransport
+
+
+class CompletionClient(CompletionBackend):
+    """An asynchronous client for the completion endpoint of a llama.cpp-style server; the HTTP `CompletionBackend`
+
+    Completions are requested with `"stream": true`, so the server sends its reply as Server-Sent Events, one event per token (or
+    small group of tokens). The client yields the text of each event as soon as it arrives, so callers can display the reply as it
+    is generated, and never block the event loop while waiting for the network.
+
+    Requests are routed through an `EndpointPool`, which may be shared with other clients of the same servers, so it is closed by
+    its owner rather than by `close`. If a server fails a completion request before the first token of the reply arrives, the
+    request is transparently sent to another server.
+
+    Attributes:
+        pool (EndpointPool): The pool of servers that requests are routed to
+        COMPLETION_PATH (str): The path of the completion endpoint on the server
+        TOKENIZE_PATH (str): The path of the tokenization endpoint on the server
+        PROPS_PATH (str): The path of the endpoint describing the server's properties
+        EMBEDDING_PATH (str): The path of the embedding endpoint on the server
+    """
+
+    COMPLETION_PATH = "/completion"
+
+    TOKENIZE_PATH = "/tokenize"
+
+    PROPS_PATH = "/props"
+
+    EMBEDDING_PATH = "/embedding"
+
+    name = "http"
+
+    def __init__(self, pool : EndpointPool):
+        """Set up the client
+
+        Args:
+            pool (EndpointPool): The pool of servers that requests are routed to
+        """
+        self.pool = pool
+
+    async def tokenize(self, text : str) -> list:
+        """Convert text into the model's tokens
+
+        Args:
+            text (str): The text to tokenize
+
+        Returns:
+            list[int]: The tokens of the text
+
+        Raises:
+            CompletionError: The server responded with an error
+        """
+        async with self._transport().request("POST", CompletionClient.TOKENIZE_PATH, {'content': text}) as response:
+            body = await response.read()
+            if response.status != 200:
+                raise CompletionError(f"server returned {response.status} for tokenize request")
+            return json.loads(body)['tokens']
+
+    async def embed(self, text : str) -> list:
+        """Get the embedding of text, i.e. a vector whose direction represents its meaning
+
+        The server must have embeddings enabled (e.g. llama.cpp's `--embedding` option). Both the older response (an object with
+        an `embedding`) and the newer one (a list of results, each with a list of pooled embeddings) are understood.
+
+        Args:
+            text (str): The text to embed
+
+        Returns:
+            list[float]: The embedding
+
+        Raises:
+            CompletionError: The server responded with an error
+        """
+        async with self._transport().request("POST", CompletionClient.EMBEDDING_PATH, {'content': text}) as response:
+            body = await response.read()
+            if response.status != 200:
+                raise CompletionError(f"server returned {response.status} for embedding request")
+            embedding = json.loads(body)
+            if isinstance(embedding, list):
+                embedding = embedding[0]
+            embedding = embedding['embedding']
+            return embedding[0] if embedding and isinstance(embedding[0], list) else embedding
+
+    async def props(self) -> dict:
+        """Get the properties of the server, including its default generation settings (e.g. `n_ctx`, the context size)
+
+        Returns:
+            dict: The server properties
+
+        Raises:
+            CompletionError: The server responded with an error
+        """
+        async with self._transport().request("GET", CompletionClient.PROPS_PATH) as response:
+            body = await response.read()
+            if response.status != 200:
+                raise CompletionError(f"server returned {response.status} for props request")
+            return json.loads(body)
+
+    def _transport(self) -> HttpTransport:
+        return self.pool.select().transport
+
+    async def _stream(self, body : dict, preferred : str, result : dict) -> AsyncIterator[str]:
+        tried = []
+
+        while True:
+            endpoint = self.pool.select(preferred, exclude=tried)
+            tried.append(endpoint.address)
+
+            # Slots are specific to a server, so a request routed elsewhere lets that server choose the slot
+            request_body = body if endpoint.address == preferred else dict(body, id_slot=-1)
+
+            started = False
+            endpoint.in_flight += 1
+            try:
+                async with aclosing(self._stream_from(endpoint.transport, request_body, result)) as stream:
+                    async for text in stream:
+                        started = True
+                        yield text
+                endpoint.failures = 0
+                result['endpoint'] = endpoint.address
+                return
+            except (ServerUnavailableError, OSError, asyncio.TimeoutError) as e:
+                if started or len(tried) == len(self.pool.endpoints):
+                    raise
+                endpoint.failures += 1
+                logging.warning(f"completion request to {endpoint.address} failed before the first token ({e!r}); failing over")
+            finally:
+                endpoint.in_flight -= 1
+
+    async def _stream_from(self, transport : HttpTransport, body : dict, result : dict) -> AsyncIterator[str]:
+        async with transport.request("POST", CompletionClient.COMPLETION_PATH, body,
+                                     headers={'Accept': "text/event-stream"}) as response:
+            result['queue_seconds'] = response.queue_seconds
+            if response.status != 200:
+                error = (await response.read()).decode('utf-8', errors='replace').strip()
+                error_type = ServerUnavailableError if response.status >= 500 else CompletionError
+                raise error_type(f"server returned {response.status}: {error}")
+
+            # The body is read to the end, even after the final ("stop") event, so the connection can go back into the pool
+            async for event in self._read_events(response):
+                if 'error' in event:
+                    raise CompletionError(f"server reported an error: {event['error']}")
+                if 'content' in event and event['content']:
+                    yield event['content']
+                if event.get('stop'):
+                    result.update((name, value) for name, value in event.items() if name != 'content')
+
+    async def _read_events(self, response : HttpResponse) -> AsyncIterator[dict]:
+        buffer = b""
+        data_lines = []
+
+        async for chunk in response.iter_body():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+
+            for line in lines:
+                line = line.rstrip(b"\r")
+
+                # A blank line ends the current event
+                if not line:
+                    if data_lines:
+                        yield self._parse_event(data_lines)
+                        data_lines = []
+                elif line.startswith(b"data:"):
+                    data_lines.append(line[5:].lstrip())
+
+        if data_lines:
+            yield self._parse_event(data_lines)
+
+    def _parse_event(self, data_lines : list) -> dict:
+        data = b"\n".join(data_lines).decode('utf-8')
+        try:
+            return json.loads(data)
+        except json.JSONDecodeError as e:
+            logging.warning(f"could not parse event from server: {data!r}")
+            raise CompletionError("server sent an invalid event") from e
@@ -0,0 +1,301 @@
+import asyncio
+import json
+import logging
+import os
+from array import array
+from pathlib import Path
+
+from enchat.chat_history import ChatHistory
+from enchat.completion_backend import CompletionBackend, CompletionError
+from enchat.prompt_format import format_prompt, format_turn
+
+
+class ContextOverflowError(CompletionError):
+    """Raised when even the shortest possible prompt does not fit in the server's context window"""
+
+
+class ContextBudget:
+    """Chooses which messages of the chat history to send, so the prompt (and the reply) always fit in the server's context window
+
+    The context size is requested from the server once. The number of tokens in each message is counted once, through the server's
+    tokenizer, and kept in a compact array alongside the history; counts are only discarded when a message changes, so each turn
+    only tokenizes the messages that are new since the last one. Messages are counted back from the newest, and only as far as
+    the budget reaches, so the first prompt of a long chat that has just been opened only counts its most recent messages.
+
+    Before each request, the budget for the history is the context size, less the system content and the tokens reserved for the
+    reply (`n_predict`, or a quarter of the context if `n_predict` is unlimited). The policy for fitting the history into the
+    budget is:
+
+    * The first `pin_first` messages of the chat are always sent (e.g. to keep the opening instructions of the chat)
+    * The most recent messages are sent, back to the oldest that fits
+    * When the history no longer fits, old messages are dropped in a block, until the history uses no more than `low_water` of the
+      budget; this keeps the start of the prompt unchanged for a number of turns, so the server's prompt cache stays useful,
+      rather than changing it (and forcing a full re-evaluation) on every turn. The oldest message sent is saved (if the budget
+      has a `path`), so the prompt starts in the same place when the chat is opened again
+    * If the budget grows (e.g. the server's context window is larger), dropped messages are sent again, back to `low_water` of
+      the budget
+    * Once messages have been dropped, the dropped messages most relevant to the latest message may be recalled into the unused
+      part of the budget (see `fit` and `LongTermMemory`)
+    * The history may be held to a `limit` below the budget, so a long conversation is sent as a summary of its dropped messages
+      (see `RollingSummary`) and a bounded number of recent ones, rather than filling the context window
+
+    If the tokenizer is unavailable, counts are estimated from the length of the text.
+
+    Attributes:
+        path (Path | None): The file the oldest message sent is saved to, if any
+        pin_first (int): The number of messages at the start of the chat that are always sent
+        low_water (float): The fraction of the budget the history is trimmed down to when it no longer fits
+        recall_fraction (float): The largest fraction of the budget used for dropped messages that are recalled
+        DEFAULT_CONTEXT_SIZE (int): The context size assumed if the server does not report one
+        SAFETY_MARGIN (int): Tokens left unused, to allow for tokens merging differently across message boundaries
+        CHARACTERS_PER_TOKEN (int): The ratio used to estimate token counts when the tokenizer is unavailable
+    """
+
+    DEFAULT_CONTEXT_SIZE = 2048
+
+    SAFETY_MARGIN = 16
+
+    CHARACTERS_PER_TOKEN = 4
+
+    def __init__(self, client : CompletionBackend, history : ChatHistory, pin_first : int = 0, low_water : float = 0.5,
+                 recall_fraction : float = 0.25, path = None):
+        """Set up the budget, reading the oldest message sent from its file if it has been saved, and start tracking the messages
+        of the history
+
+        Args:
+            client (CompletionBackend): The backend used to query the model
+            history (ChatHistory): The history of the chat
+            pin_first (int): The number of messages at the start of the chat that are always sent
+            low_water (float): The fraction of the budget the history is trimmed down to when it no longer fits
+            recall_fraction (float): The largest fraction of the budget used for dropped messages that are recalled
+            path (str | Path): The file the oldest message sent is saved to, if it is to be kept when the chat is closed
+        """
+        assert(0 < low_water <= 1 and 0 <= recall_fraction < 1)
+
+        self.client = client
+        self.pin_first = pin_first
+        self.low_water = low_water
+        self.recall_fraction = recall_fraction
+        self.path = Path(path) if path is not None else None
+        self._history = history
+        self._context_size = None
+        self._model = None
+        self._slots = None
+        self._first_kept = 0
+        self._budget = None
+        self._system_tokens = (None, 0)
+
+        if self.path is not None:
+            try:
+                self._first_kept = min(int(json.loads(self.path.read_text(encoding='utf-8'))['first_kept']), len(history))
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logging.warning(f"could not read the context budget {self.path} ({e!r}); sending the latest messages")
+
+        # Token counts of each message of the history, or -1 if the message has not been counted
+        self._counts = array('i', [-1]) * len(history)
+        history.add_listener(self)
+
+    def message_added(self, index : int):
+        self._counts.append(-1)
+
+    def message_changed(self, index : int):
+        self._counts[index] = -1
+
+    def reset_context_size(self):
+        """Forget the context size (and model and slots), so it is requested from the server again (e.g. after the server has
+        changed)"""
+        self._context_size = None
+        self._model = None
+        self._slots = None
+
+    def set_client(self, client : CompletionBackend):
+        """Query a different backend, forgetting the context size and the token counts, which depend on its model
+
+        Args:
+            client (CompletionBackend): The backend
+        """
+        self.client = client
+        self._context_size = None
+        self._model = None
+        self._slots = None
+        self._system_tokens = (None, 0)
+        self._counts = array('i', [-1]) * len(self._counts)
+
+    def memory_size(self) -> int:
+        """An estimate of the memory used by the token counts of the messages
+
+        Returns:
+            int: The estimated size, in bytes
+        """
+        return self._counts.itemsize * len(self._counts)
+
+    async def context_size(self) -> int:
+        """The size of the server's context window, in tokens, requested from the server the first time it is needed
+
+        Returns:
+            int: The context size
+        """
+        if self._context_size is None:
+            try:
+                props = await self.client.props()
+                self._context_size = int(props['default_generation_settings']['n_ctx'])
+                self._model = props.get('model_path') or props['default_generation_settings'].get('model')
+                self._slots = int(props['total_slots']) if 'total_slots' in props else None
+            except (CompletionError, OSError, asyncio.TimeoutError, KeyError, ValueError) as e:
+                logging.warning(f"could not get the context size from the server ({e!r}); "
+                                f"assuming {ContextBudget.DEFAULT_CONTEXT_SIZE} tokens")
+                return ContextBudget.DEFAULT_CONTEXT_SIZE
+        return self._context_size
+
+    async def model(self) -> str:
+        """The model of the server, as reported (as its `model_path`) with the context size
+
+        Returns:
+            str | None: The model, or None if the server does not report it
+        """
+        await self.context_size()
+        return self._model
+
+    async def slots(self) -> int:
+        """The number of slots of the server (i.e. the requests it generates at once), as reported with the context size
+
+        Returns:
+            int | None: The number of slots, or None if the server does not report it
+        """
+        await self.context_size()
+        return self._slots
+
+    async def reply_limit(self, n_predict : int) -> int:
+        """The number of tokens reserved for the reply, which is also the most the server should be asked to generate
+
+        An unlimited reply (`n_predict` of -1) would run until the model stops by itself or the context is full, so it is limited
+        to a quarter of the context.
+
+        Args:
+            n_predict (int): The number of tokens requested for the reply, or -1 for unlimited
+
+        Returns:
+            int: The number of tokens reserved for the reply
+        """
+        return n_predict if n_predict >= 0 else await self.context_size() // 4
+
+    @property
+    def first_kept(self) -> int:
+        """The index of the oldest message (after the pinned ones) sent with the last request; the messages between the pinned ones
+        and this one have been dropped
+
+        Returns:
+            int: The index of the message
+        """
+        return self._first_kept
+
+    async def fit(self, system_content : str, n_predict : int, recall = None, limit : int = None) -> list:
+        """Choose the messages to send with the next request
+
+        If messages have been dropped and a `recall` function is given, it is asked which of the dropped messages are relevant to
+        the latest message (see `LongTermMemory.recall`); as many of them as fit in the unused part of the budget (but no more than
+        `recall_fraction` of it) are sent, in their original order, between the pinned and the most recent messages.
+
+        Args:
+            system_content (str): The system content of the chat
+            n_predict (int): The number of tokens requested for the reply, or -1 for unlimited
+            recall: Async function called with the range of dropped messages, returning the indexes of the relevant ones, most
+                relevant first
+            limit (int): The most tokens of history (after the pinned messages) to send, if less than fit in the context window
+
+        Returns:
+            list[int]: The indexes in the history of the messages to send, in order
+
+        Raises:
+            ContextOverflowError: Even the system content and the last message do not fit in the context window
+        """
+        context_size = await self.context_size()
+        reserve = await self.reply_limit(n_predict)
+        window = context_size - reserve - await self._count_system(system_content) - ContextBudget.SAFETY_MARGIN
+
+        count = len(self._history)
+        pinned = range(min(self.pin_first, count))
+        first_kept = max(self._first_kept, len(pinned))
+
+        window -= sum([await self.message_tokens(index) for index in pinned])
+        budget = window if limit is None else min(window, limit)
+
+        if self._budget is not None and budget > self._budget and first_kept > len(pinned):
+            # The budget has grown, so dropped messages may be sent again
+            first_kept = min(first_kept, (await self._walk_back(len(pinned), budget * self.low_water))[0])
+        self._budget = budget
+
+        start, total = await self._walk_back(first_kept, budget)
+        if start > first_kept:
+            # Drop a block of the oldest messages, so the prompt keeps the same start for the next few turns
+            start, total = await self._walk_back(first_kept, budget * self.low_water)
+            logging.info(f"dropped {start - first_kept} old messages from the prompt to fit {budget} tokens of history")
+
+        # A single message over the limit is still sent, as long as it fits in the context window
+        if total > window:
+            raise ContextOverflowError(f"the last message needs {total} tokens, but only {max(0, window)} are available "
+                                       f"in the context window of {context_size} tokens")
+        self._set_first_kept(start)
+
+        recalled = []
+        if recall is not None and self._first_kept > len(pinned):
+            available = min(int(budget * self.recall_fraction), budget - total)
+            for index in await recall(range(len(pinned), self._first_kept)):
+                tokens = await self.message_tokens(index)
+                if tokens <= available:
+                    recalled.append(index)
+                    available -= tokens
+
+        return list(pinned) + sorted(recalled) + list(range(self._first_kept, count))
+
+    async def _walk_back(self, stop : int, target : float) -> tuple:
+        # The oldest message (back to `stop`) from which the messages up to the newest fit in `target` tokens, and their total;
+        # the newest message is always included
+        index, total = len(self._history), 0
+        while index > stop:
+            tokens = await self.message_tokens(index - 1)
+            if total + tokens > target and index < len(self._history):
+                break
+            total += tokens
+            index -= 1
+        return index, total
+
+    def _set_first_kept(self, first_kept : int):
+        if first_kept == self._first_kept:
+            return
+        self._first_kept = first_kept
+        if self.path is not None:
+            temporary = self.path.with_suffix(".tmp")
+            try:
+                temporary.write_text(json.dumps({'first_kept': first_kept}), encoding='utf-8')
+                os.replace(temporary, self.path)
+            except OSError as e:
+                logging.error(f"could not save the context budget {self.path}: {e!r}")
+
+    async def _count_system(self, system_content : str) -> int:
+        if self._system_tokens[0] != system_content:
+            self._system_tokens = (system_content, await self._tokenize(format_prompt(system_content, [])))
+        return self._system_tokens[1]
+
+    async def message_tokens(self, index : int) -> int:
+        """The number of tokens in a message of the history, as a turn of the prompt, counted the first time it is needed
+
+        Args:
+            index (int): The index of the message
+
+        Returns:
+            int: The number of tokens
+        """
+        if self._counts[index] < 0:
+            message = self._history[index]
+            self._counts[index] = await self._tokenize(format_turn(message.role, message.text))
+        return self._counts[index]
+
+    async def _tokenize(self, text : str) -> int:
+        try:
+            return len(await self.client.tokenize(text))
+        except (CompletionError, OSError, asyncio.TimeoutError, KeyError, json.JSONDecodeError) as e:
+            logging.debug(f"could not tokenize text ({e!r}); estimating its length")
+            return len(text) // ContextBudget.CHARACTERS_PER_TOKEN + 1
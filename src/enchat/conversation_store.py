@@ -0,0 +1,153 @@
+import json
+import logging
+import os
+import queue
+import struct
+import threading
+from pathlib import Path
+
+
+class ConversationStore:
+    """An append-only, on-disk store of the messages of a single chat
+
+    The store is a directory holding two files:
+
+    * `messages.log` - an append-only log of JSON records, one per line, each holding the role and text of a message
+    * `messages.idx` - an index of fixed-size (8 byte) entries, one per message, holding the offset of its latest record in the log
+
+    Because the index entries are a fixed size, the number of messages is known from the size of the index alone, and any page of
+    messages can be read with a single read of the index and one seek per message, without reading (or holding in memory) the rest of the conversation. Opening a store is
+    therefore just as fast for 100,000 messages as for 10.
+
+    Messages are never rewritten in place: changing the text of a message (e.g. when a streamed reply finishes) appends a new
+    record to the log, and overwrites the message's entry in the index to point to it.
+
+    Writes are handed to a background thread, so they never block the caller (i.e. the UI). Reads first wait for any pending writes
+    to complete, so they always see every message that has been appended.
+
+    Attributes:
+        directory (Path): The directory holding the store
+        LOG_FILE (str): The name of the log file
+        INDEX_FILE (str): The name of the index file
+    """
+
+    LOG_FILE = "messages.log"
+
+    INDEX_FILE = "messages.idx"
+
+    _INDEX_ENTRY = struct.Struct("<Q")
+
+    def __init__(self, directory):
+        """Open the store, creating it if it does not exist
+
+        Args:
+            directory (str | Path): The directory holding the store
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        (self.directory / ConversationStore.INDEX_FILE).touch(exist_ok=True)
+        self._log = open(self.directory / ConversationStore.LOG_FILE, "a+b")
+        self._index = open(self.directory / ConversationStore.INDEX_FILE, "r+b")
+
+        self._index.seek(0, os.SEEK_END)
+        self._count = self._index.tell() // ConversationStore._INDEX_ENTRY.size
+
+        self._lock = threading.Lock()
+        self._writes = queue.Queue()
+        self._writer = threading.Thread(target=self._write_pending, name="ConversationStore writer", daemon=True)
+        self._writer.start()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, role : str, text : str) -> int:
+        """Add a new message to the end of the store; the message is written in the background
+
+        Args:
+            role (str): The sender role for the message
+            text (str): The text of the message
+
+        Returns:
+            int: The index of the new message
+        """
+        index = self._count
+        self._count += 1
+        self._writes.put((index, role, text))
+        return index
+
+    def update(self, index : int, role : str, text : str):
+        """Replace an existing message; the new version is written in the background
+
+        Args:
+            index (int): The index of the message
+            role (str): The sender role for the message
+            text (str): The new text of the message
+        """
+        assert(0 <= index < self._count)
+        self._writes.put((index, role, text))
+
+    def read(self, start : int, end : int) -> list:
+        """Read a range of messages
+
+        Args:
+            start (int): The index of the first message to read
+            end (int): The index after the last message to read
+
+        Returns:
+            list[tuple[str, str]]: The (role, text) pairs of the messages, in order
+        """
+        start = max(0, start)
+        end = min(end, self._count)
+        if start >= end:
+            return []
+
+        self.flush()
+        with self._lock:
+            self._index.seek(start * ConversationStore._INDEX_ENTRY.size)
+            entries = self._index.read((end - start) * ConversationStore._INDEX_ENTRY.size)
+
+            messages = []
+            for (offset,) in ConversationStore._INDEX_ENTRY.iter_unpack(entries):
+                self._log.seek(offset)
+                record = json.loads(self._log.readline())
+                messages.append((record['role'], record['text']))
+
+        return messages
+
+    def flush(self):
+        """Wait until every pending write has been written to disk"""
+        self._writes.join()
+
+    def close(self):
+        """Write any pending messages, and close the store"""
+        self._writes.put(None)
+        self._writer.join()
+        self._log.close()
+        self._index.close()
+
+    def _write_pending(self):
+        while True:
+            write = self._writes.get()
+            try:
+                if write is None:
+                    return
+                self._write(*write)
+            except OSError as e:
+                logging.error(f"could not write message to {self.directory}: {e!r}")
+            finally:
+                self._writes.task_done()
+
+    def _write(self, index : int, role : str, text : str):
+        record = (json.dumps({'role': role, 'text': text}, ensure_ascii=False) + "\n").encode('utf-8')
+
+        with self._lock:
+            self._log.seek(0, os.SEEK_END)
+            offset = self._log.tell()
+            self._log.write(record)
+            self._log.flush()
+
+            # The log is written before the index, so the index never points past the end of the log
+            self._index.seek(index * ConversationStore._INDEX_ENTRY.size)
+            self._index.write(ConversationStore._INDEX_ENTRY.pack(offset))
+            self._index.flush()
@@ -0,0 +1,282 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import tracemalloc
+from collections import deque
+from pathlib import Path
+from enchat.chat_manager import ChatManager
+from enchat.message_box import MessageBox
+from enchat.response_cache import ResponseCache
+from enchat.search_index import SearchIndex
+
+
+def resident_memory() -> int:
+    """The memory of the process resident in RAM, where the platform reports it (i.e. on Linux)
+
+    Returns:
+        int | None: The resident memory, in bytes, or None if it cannot be measured
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def format_bytes(size : int) -> str:
+    """A human-readable size, e.g. "12.3 MB"
+
+    Args:
+        size (int): The size, in bytes
+
+    Returns:
+        str: The size, in bytes, kilobytes or megabytes
+    """
+    if abs(size) < 1024:
+        return f"{size} B"
+    if abs(size) < 1024 * 1024:
+        return f"{size / 1024:.1f} KB"
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+class Diagnostics:
+    """Measures where the memory of the application goes, keeps periodic snapshots of the measurements, and keeps the memory
+    within a budget
+
+    Each snapshot records the memory of the process (resident, where the platform reports it, and traced by `tracemalloc`, while
+    tracing), the number of `MessageBox` widgets alive and of their labels, the estimated memory of the history of each open chat,
+    and the size of the caches. A snapshot is taken every `interval` seconds, and the last `MAX_SNAPSHOTS` are kept, so growth over
+    a long session shows in the report (see `describe`), and can be exported for comparison with other runs (see `export`).
+
+    Each snapshot is checked against the memory `budget` (the watchdog). The memory checked is the resident memory of the process
+    or, where it cannot be measured, the estimated memory of the chats and the search index. Above `WARNING_FRACTION` of the
+    budget, a warning is logged; above the budget, old history is offloaded (see `ChatManager.offload`): idle chats are closed,
+    and the others are compacted, so only the pages near the end of each chat stay in memory. The process rarely returns freed
+    memory to the operating system, so its resident memory may stay over the budget after offloading; history is only offloaded
+    once each time the budget is exceeded, and not again until the memory has fallen below `WARNING_FRACTION` of the budget.
+
+    Tracing allocations slows the application down, so it is only done on request (see `start_tracing`); while tracing, the lines
+    of code that allocated the most memory still in use (the top allocators) are reported.
+
+    Attributes:
+        chat_manager (ChatManager): The chats whose memory is measured, and offloaded when the budget is exceeded
+        response_cache (ResponseCache | None): The response cache, whose size is measured
+        search_index (SearchIndex | None): The search index, whose memory is measured
+        budget (int): The memory, in bytes, above which old history is offloaded
+        interval (float): The time between snapshots, in seconds
+        snapshots (deque[dict]): The last snapshots, oldest first
+        state (str): The state of the watchdog at the last snapshot: "ok", "warning" or "over budget"
+        offloads (int): The number of times old history was offloaded
+        DEFAULT_BUDGET (int): The default budget, in bytes
+        INTERVAL (float): The default interval, in seconds
+        MAX_SNAPSHOTS (int): The number of snapshots kept
+        WARNING_FRACTION (float): The fraction of the budget above which a warning is logged
+        TOP_ALLOCATORS (int): The number of top allocators reported
+    """
+
+    DEFAULT_BUDGET = 1024 * 1024 * 1024
+
+    INTERVAL = 60.0
+
+    MAX_SNAPSHOTS = 240
+
+    WARNING_FRACTION = 0.9
+
+    TOP_ALLOCATORS = 10
+
+    def __init__(self, chat_manager : ChatManager, response_cache : ResponseCache = None, search_index : SearchIndex = None,
+                 budget : int = DEFAULT_BUDGET, interval : float = INTERVAL):
+        """Set up the diagnostics; no snapshots are taken until they are started
+
+        Args:
+            chat_manager (ChatManager): The chats whose memory is measured, and offloaded when the budget is exceeded
+            response_cache (ResponseCache): The response cache, whose size is measured
+            search_index (SearchIndex): The search index, whose memory is measured
+            budget (int): The memory, in bytes, above which old history is offloaded
+            interval (float): The time between snapshots, in seconds
+        """
+        self.chat_manager = chat_manager
+        self.response_cache = response_cache
+        self.search_index = search_index
+        self.budget = budget
+        self.interval = interval
+        self.snapshots = deque(maxlen=Diagnostics.MAX_SNAPSHOTS)
+        self.state = "ok"
+        self.offloads = 0
+        self._armed = True
+        self._loop = None
+        self._handle = None
+
+    def start(self, loop : asyncio.AbstractEventLoop = None):
+        """Take a snapshot every `interval` seconds, until stopped
+
+        Args:
+            loop (asyncio.AbstractEventLoop): The loop to take the snapshots on; defaults to the current event loop
+        """
+        if self._handle is None:
+            self._loop = loop if loop is not None else asyncio.get_event_loop()
+            self._handle = self._loop.call_later(self.interval, self._tick)
+
+    def stop(self):
+        """Stop taking snapshots"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def snapshot(self) -> dict:
+        """Measure the memory of the application now
+
+        Returns:
+            dict: The measurements, as numbers (None where they are not available), with the estimated memory of each open chat
+                under `chat_bytes`
+        """
+        message_boxes, labels = MessageBox.census()
+        chats = [chat for chat in self.chat_manager.chats.values() if chat.is_open]
+        entries, disk_bytes = self.response_cache.size if self.response_cache is not None else (None, None)
+        return {
+            'time': time.time(),
+            'resident_bytes': resident_memory(),
+            'traced_bytes': tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None,
+            'message_boxes': message_boxes,
+            'labels': labels,
+            'open_chats': len(chats),
+            'history_bytes': sum(chat.history.memory_size() for chat in chats),
+            'chat_bytes': {chat.name: chat.session.memory_size() for chat in chats},
+            'response_cache_entries': entries,
+            'response_cache_disk_bytes': disk_bytes,
+            'search_index_bytes': self.search_index.memory_size() if self.search_index is not None else None,
+            'style_cache_entries': MessageBox.style_cache_size()
+        }
+
+    def check(self, snapshot : dict) -> str:
+        """Check a snapshot against the budget, logging a warning if it is nearly exceeded, and offloading old history if it is
+
+        Args:
+            snapshot (dict): The snapshot
+
+        Returns:
+            str: The new state of the watchdog
+        """
+        used = snapshot['resident_bytes']
+        if used is None:
+            used = sum(snapshot['chat_bytes'].values()) + (snapshot['search_index_bytes'] or 0)
+
+        if used > self.budget:
+            if self._armed:
+                freed = self.chat_manager.offload()
+                self.offloads += 1
+                self._armed = False
+                logging.warning(f"memory {format_bytes(used)} is over the budget of {format_bytes(self.budget)}; "
+                                f"offloaded {format_bytes(freed)} of old history")
+            self.state = "over budget"
+        elif used > self.budget * Diagnostics.WARNING_FRACTION:
+            if self.state == "ok":
+                logging.warning(f"memory {format_bytes(used)} is approaching the budget of {format_bytes(self.budget)}")
+            self.state = "warning"
+        else:
+            self.state = "ok"
+            self._armed = True
+        return self.state
+
+    @property
+    def is_tracing(self) -> bool:
+        """Whether memory allocations are being traced
+
+        Returns:
+            bool: True if allocations are being traced
+        """
+        return tracemalloc.is_tracing()
+
+    def start_tracing(self):
+        """Start tracing memory allocations, so the top allocators can be reported; only allocations from then on are traced"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            logging.info("tracing memory allocations")
+
+    def stop_tracing(self):
+        """Stop tracing memory allocations, and free the traces"""
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            logging.info("stopped tracing memory allocations")
+
+    def top_allocators(self, limit : int = TOP_ALLOCATORS) -> list:
+        """The lines of code that allocated the most memory still in use, since tracing started
+
+        Args:
+            limit (int): The maximum number of allocators
+
+        Returns:
+            list[tuple[str, int, int]]: The location ("file:line"), size in bytes and number of blocks of each allocator, largest
+                first; empty if allocations are not being traced
+        """
+        if not tracemalloc.is_tracing():
+            return []
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        return [(f"{statistic.traceback[0].filename}:{statistic.traceback[0].lineno}", statistic.size, statistic.count)
+                for statistic in snapshot.statistics('lineno')[:limit]]
+
+    def describe(self) -> str:
+        """A human-readable report of the memory of the application now, and how it has changed since the oldest snapshot
+
+        Returns:
+            str: The report, one measurement per line
+        """
+        current = self.snapshot()
+        oldest = self.snapshots[0] if self.snapshots else None
+
+        def line(label : str, name : str, size : bool = False) -> str:
+            value = current[name]
+            if value is None:
+                return f"{label}: -"
+            text = format_bytes(value) if size else str(value)
+            if oldest is not None and oldest[name] is not None:
+                change = value - oldest[name]
+                text += f" ({'+' if change >= 0 else '-'}{format_bytes(abs(change)) if size else abs(change)})"
+            return f"{label}: {text}"
+
+        lines = [f"Budget: {format_bytes(self.budget)} ({self.state}, offloaded {self.offloads} times)"]
+        if oldest is not None:
+            lines.append(f"Changes since {time.strftime('%H:%M:%S', time.localtime(oldest['time']))} in brackets")
+        lines += [line("Resident memory", 'resident_bytes', size=True), line("Traced memory", 'traced_bytes', size=True),
+                  line("Message boxes", 'message_boxes'), line("Labels", 'labels'), line("Open chats", 'open_chats'),
+                  line("History", 'history_bytes', size=True)]
+        lines += [f"  {name}: {format_bytes(size)}" for name, size in current['chat_bytes'].items()]
+        lines += [line("Response cache entries", 'response_cache_entries'),
+                  line("Response cache on disk", 'response_cache_disk_bytes', size=True),
+                  line("Search index", 'search_index_bytes', size=True), line("Style cache entries", 'style_cache_entries')]
+        if self.is_tracing:
+            lines.append("Top allocators:")
+            lines += [f"  {location}: {format_bytes(size)} in {count} blocks" for location, size, count in self.top_allocators()]
+        return "\n".join(lines)
+
+    def export(self, directory) -> Path:
+        """Write the snapshots (and a snapshot of now) to a new JSON file, for comparison with other snapshots, or other runs
+
+        The file also holds the top allocators, while allocations are being traced.
+
+        Args:
+            directory (str | Path): The directory to write the file to, created if it does not exist
+
+        Returns:
+            Path: The file, named by the time of the export
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / time.strftime("snapshots-%Y%m%d-%H%M%S.json")
+        export = {'budget': self.budget, 'snapshots': list(self.snapshots) + [self.snapshot()],
+                  'top_allocators': self.top_allocators()}
+        path.write_text(json.dumps(export, indent=1), encoding='utf-8')
+        logging.info(f"exported {len(export['snapshots'])} memory snapshots to {path}")
+        return path
+
+    def _tick(self):
+        self._handle = None
+        try:
+            snapshot = self.snapshot()
+            self.snapshots.append(snapshot)
+            self.check(snapshot)
+        except Exception:
+            logging.exception("could not take a memory snapshot")
+        self._handle = self._loop.call_later(self.interval, self._tick)
@@ -0,0 +1,76 @@
+from toga import Box, Button, Label, MultilineTextInput, Switch, Widget
+from toga.style.pack import COLUMN, MONOSPACE, ROW, Pack
+
+class DiagnosticsBox(Box):
+    """A box displaying a report of the memory and widgets of the application, with controls for tracing allocations and exporting
+    snapshots
+
+    The box only holds the controls; the report is produced by the handlers (see `Diagnostics`), which set the `report` to display.
+
+    Attributes:
+        _report_mti (MultilineTextInput): Read-only display of the report
+        _trace_sw (Switch): Switch for tracing memory allocations
+        _status_lbl (Label): Label for the outcome of the last action, e.g. the file the snapshots were exported to
+        REPORT_FONT_SIZE (int): The font size of the report
+    """
+
+    REPORT_FONT_SIZE = 11
+
+    def __init__(self, on_refresh : (Widget), on_trace : (Widget), on_export : (Widget), on_close : (Widget)):
+        """Set up the box, with an empty report
+
+        Args:
+            on_refresh: Handler called to refresh the report
+            on_trace: Handler called when tracing is switched on or off
+            on_export: Handler called to export the snapshots
+            on_close: Handler called when the box is closed
+        """
+        self._report_mti = MultilineTextInput(readonly=True,
+                                              style=Pack(flex=1, font_family=MONOSPACE, font_size=DiagnosticsBox.REPORT_FONT_SIZE))
+        self._trace_sw = Switch("Trace allocations", on_change=on_trace)
+        refresh_btn = Button(text="Refresh", on_press=on_refresh)
+        export_btn = Button(text="Export snapshots", on_press=on_export)
+        close_btn = Button(text="Close", on_press=on_close)
+        self._status_lbl = Label("", style=Pack(flex=1))
+
+        controls_bx = Box(style=Pack(direction=ROW), children=[refresh_btn, self._trace_sw, export_btn, self._status_lbl, close_btn])
+        super(DiagnosticsBox, self).__init__(style=Pack(direction=COLUMN), children=[controls_bx, self._report_mti])
+
+    @property
+    def report(self) -> str:
+        """The report displayed
+
+        Returns:
+            str: The report
+        """
+        return self._report_mti.value
+
+    @report.setter
+    def report(self, value : str):
+        self._report_mti.value = value
+
+    @property
+    def tracing(self) -> bool:
+        """Whether the switch for tracing memory allocations is on
+
+        Returns:
+            bool: True if allocations should be traced
+        """
+        return self._trace_sw.value
+
+    @tracing.setter
+    def tracing(self, value : bool):
+        self._trace_sw.value = value
+
+    @property
+    def status(self) -> str:
+        """The outcome of the last action
+
+        Returns:
+            str: The status
+        """
+        return self._status_lbl.text
+
+    @status.setter
+    def status(self, value : str):
+        self._status_lbl.text = value
@@ -0,0 +1,255 @@
+import asyncio
+import logging
+from urllib.parse import urlparse
+
+from enchat.http_transport import HttpTransport
+
+
+def parse_endpoints(text : str) -> list:
+    """Parse a list of server endpoints, e.g. "http://gpu1:8080 2, http://gpu2:8080"
+
+    Endpoints are separated by commas. Each is a server address, optionally followed by a positive weight (default 1); an endpoint
+    with weight 2 is expected to handle twice the load of one with weight 1.
+
+    Args:
+        text (str): The list of endpoints
+
+    Returns:
+        list[tuple[str, float]]: The (address, weight) pairs of the endpoints
+
+    Raises:
+        ValueError: The list is empty, or an endpoint is not a valid http(s) address and weight
+    """
+    endpoints = []
+    for item in text.split(','):
+        parts = item.split()
+        if not parts:
+            continue
+        if len(parts) > 2:
+            raise ValueError(f"invalid endpoint: {item.strip()!r}")
+
+        address = parts[0]
+        parsed = urlparse(address, scheme='http')
+        if parsed.scheme not in ['http', 'https'] or not parsed.hostname:
+            raise ValueError(f"invalid server address: {address!r}")
+
+        weight = float(parts[1]) if len(parts) == 2 else 1.0
+        if weight <= 0:
+            raise ValueError(f"weight of {address} must be greater than 0")
+
+        endpoints.append((address, weight))
+
+    if not endpoints:
+        raise ValueError("at least one endpoint is required")
+
+    return endpoints
+
+
+def format_endpoints(endpoints : list) -> str:
+    """Format a list of server endpoints, as accepted by `parse_endpoints`
+
+    Args:
+        endpoints (list[tuple[str, float]]): The (address, weight) pairs of the endpoints
+
+    Returns:
+        str: The formatted list
+    """
+    return ", ".join(address if weight == 1 else f"{address} {weight:g}" for address, weight in endpoints)
+
+
+class Endpoint:
+    """A single server in an `EndpointPool`
+
+    Attributes:
+        transport (HttpTransport): The pooled connections to the server
+        weight (float): The relative share of the load the server should handle
+        in_flight (int): The number of requests this client currently has in progress on the server
+        latency (float | None): A moving average of the server's response time, in seconds
+        failures (int): The number of consecutive requests that failed before the first token
+    """
+
+    def __init__(self, transport : HttpTransport, weight : float):
+        self.transport = transport
+        self.weight = weight
+        self.in_flight = 0
+        self.latency = None
+        self.failures = 0
+
+    @property
+    def address(self) -> str:
+        return self.transport.server_address
+
+    def record_latency(self, seconds : float):
+        """Fold a new latency measurement into the moving average
+
+        Args:
+            seconds (float): The measured latency
+        """
+        self.latency = seconds if self.latency is None else 0.7 * self.latency + 0.3 * seconds
+
+    @property
+    def available(self) -> bool:
+        """Whether the endpoint should be used; it is not used after failing, until a health check succeeds again
+
+        Returns:
+            bool: True unless the last health check or request failed
+        """
+        return self.transport.healthy is not False and self.failures == 0
+
+    def score(self, default_latency : float) -> float:
+        """The expected cost of sending a request to this endpoint; lower is better
+
+        Args:
+            default_latency (float): The latency to assume if the endpoint hasn't been measured yet
+
+        Returns:
+            float: The score, combining recent latency with the number of requests queued on the server
+        """
+        latency = self.latency if self.latency is not None else default_latency
+        return latency * (1 + self.in_flight + self.transport.queue_depth) / self.weight
+
+
+class EndpointPool:
+    """A weighted pool of llama.cpp-style servers, with latency-aware routing and failover
+
+    Each endpoint has its own `HttpTransport`. A background task probes the health endpoint of every server, measuring its latency
+    and (where the server reports it) how many requests it is processing. Each request is routed to the available endpoint with the
+    lowest score - recent latency scaled by its queue depth and divided by its weight - so load spreads across the servers in
+    proportion to their capacity.
+
+    A request may ask for a preferred endpoint (e.g. the server holding the chat's cached prompt); it is used unless it is
+    unavailable or its score is more than `STICKINESS` times the best.
+
+    Attributes:
+        pool_size (int): The maximum number of connections to each server
+        connect_timeout (float): The maximum number of seconds to wait for a new connection
+        read_timeout (float): The maximum number of seconds to wait for any single read from a server
+        probe_interval (float): The number of seconds between health probes
+        STICKINESS (float): How much worse than the best endpoint a preferred endpoint may score and still be used
+        DEFAULT_LATENCY (float): The latency assumed for an endpoint that hasn't been measured
+    """
+
+    STICKINESS = 2.0
+
+    DEFAULT_LATENCY = 0.1
+
+    def __init__(self, endpoints : list, pool_size : int = 4, connect_timeout : float = 5.0, read_timeout : float = 60.0,
+                 probe_interval : float = 10.0):
+        """Set up the pool; no connections are opened until they are needed
+
+        Args:
+            endpoints (list[tuple[str, float]]): The (address, weight) pairs of the servers
+            pool_size (int): The maximum number of connections to each server
+            connect_timeout (float): The maximum number of seconds to wait for a new connection
+            read_timeout (float): The maximum number of seconds to wait for any single read from a server
+            probe_interval (float): The number of seconds between health probes
+        """
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.probe_interval = probe_interval
+        self._endpoints = []
+        self._probe_task = None
+        self.configure(endpoints, pool_size, connect_timeout, read_timeout)
+
+    @property
+    def endpoints(self) -> list:
+        """The endpoints of the pool
+
+        Returns:
+            list[Endpoint]: The endpoints, in the order they were configured
+        """
+        return list(self._endpoints)
+
+    def configure(self, endpoints : list, pool_size : int, connect_timeout : float, read_timeout : float):
+        """Change the servers and connection settings of the pool
+
+        The transports of servers that remain in the pool are kept, with their open connections; only the transports of new
+        servers are built, and those of removed servers closed.
+
+        Args:
+            endpoints (list[tuple[str, float]]): The (address, weight) pairs of the servers
+            pool_size (int): The maximum number of connections to each server
+            connect_timeout (float): The maximum number of seconds to wait for a new connection
+            read_timeout (float): The maximum number of seconds to wait for any single read from a server
+        """
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        existing = {endpoint.address: endpoint for endpoint in self._endpoints}
+        self._endpoints = []
+        for address, weight in endpoints:
+            endpoint = existing.pop(address, None)
+            if endpoint is None:
+                logging.info(f"adding server {address} to the endpoint pool")
+                endpoint = Endpoint(HttpTransport(address), weight)
+            endpoint.weight = weight
+            endpoint.transport.pool_size = pool_size
+            endpoint.transport.connect_timeout = connect_timeout
+            endpoint.transport.read_timeout = read_timeout
+            self._endpoints.append(endpoint)
+
+        for endpoint in existing.values():
+            logging.info(f"removing server {endpoint.address} from the endpoint pool")
+            asyncio.ensure_future(endpoint.transport.close())
+
+    def select(self, preferred : str = None, exclude : tuple = ()) -> Endpoint:
+        """Choose the endpoint for a request
+
+        Args:
+            preferred (str): The address of the endpoint to use if it is reasonably good, if any
+            exclude (tuple[str]): The addresses of endpoints not to use (e.g. because they have already failed the request)
+
+        Returns:
+            Endpoint | None: The chosen endpoint, or None if every endpoint is excluded
+        """
+        candidates = [endpoint for endpoint in self._endpoints if endpoint.address not in exclude]
+        if not candidates:
+            return None
+
+        # Unavailable endpoints are only tried if there is nothing else
+        available = [endpoint for endpoint in candidates if endpoint.available] or candidates
+        measured = [endpoint.latency for endpoint in available if endpoint.latency is not None]
+        default_latency = sum(measured) / len(measured) if measured else EndpointPool.DEFAULT_LATENCY
+
+        best = min(available, key=lambda endpoint: endpoint.score(default_latency))
+        for endpoint in available:
+            if endpoint.address == preferred and \
+                    endpoint.score(default_latency) <= best.score(default_latency) * EndpointPool.STICKINESS:
+                return endpoint
+        return best
+
+    async def probe(self):
+        """Check the health of every server at once, and record the latency of those that respond"""
+        # The pool may be configured while the probes are in flight, so the results are matched to the endpoints probed
+        endpoints = list(self._endpoints)
+        results = await asyncio.gather(*[endpoint.transport.check_health() for endpoint in endpoints])
+        for endpoint, healthy in zip(endpoints, results):
+            if healthy:
+                endpoint.failures = 0
+                endpoint.record_latency(endpoint.transport.latency)
+
+    def start_probes(self, loop : asyncio.AbstractEventLoop = None):
+        """Start probing the health of the servers in the background, every `probe_interval` seconds
+
+        Args:
+            loop (asyncio.AbstractEventLoop): The loop to run the probes on; defaults to the current event loop
+        """
+        if self._probe_task is None:
+            loop = loop if loop is not None else asyncio.get_event_loop()
+            self._probe_task = loop.create_task(self._run_probes())
+
+    async def close(self):
+        """Stop probing, and close the idle connections to every server"""
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+
+        for endpoint in self._endpoints:
+            await endpoint.transport.close()
+
+    async def _run_probes(self):
+        while True:
+            await self.probe()
+            await asyncio.sleep(self.probe_interval)
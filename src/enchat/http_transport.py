@@ -0,0 +1,357 @@
+import asyncio
+import json
+import logging
+import ssl
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from urllib.parse import urlparse
+
+
+class TransportError(OSError):
+    """Raised when the server cannot be reached, or breaks the HTTP protocol"""
+
+
+async def _with_timeout(awaitable, seconds : float):
+    """Await with a timeout, without losing a cancellation that arrives as the awaitable finishes
+
+    Before Python 3.12, `asyncio.wait_for` returns the result (and swallows the cancellation) if the awaitable completes in the
+    same turn of the event loop as the task is cancelled, so stopping a streaming reply could be silently ignored.
+    """
+    if not hasattr(asyncio, 'timeout'):
+        return await asyncio.wait_for(awaitable, seconds)
+    async with asyncio.timeout(seconds):
+        return await awaitable
+
+
+class _Connection:
+    """A single persistent connection to the server
+
+    Attributes:
+        reader (asyncio.StreamReader): The stream for reading from the server
+        writer (asyncio.StreamWriter): The stream for writing to the server
+    """
+
+    def __init__(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @property
+    def is_closed(self) -> bool:
+        return self.writer.is_closing() or self.reader.at_eof()
+
+    def close(self):
+        self.writer.close()
+
+
+class HttpResponse:
+    """The response to a request made through the `HttpTransport`
+
+    The body is not read up front; it is read incrementally with `iter_body()` (e.g. for streamed events), or all at once with
+    `read()` / `json()`. The connection only goes back into the pool if the body is read to the end.
+
+    Attributes:
+        status (int): The HTTP status code
+        headers (dict): The response headers, with lower-case names
+        complete (bool): Whether the body has been read to the end
+        queue_seconds (float): The time the request waited for a connection from the pool
+    """
+
+    def __init__(self, connection : _Connection, status : int, headers : dict, read_timeout : float):
+        self.status = status
+        self.headers = headers
+        self._connection = connection
+        self._read_timeout = read_timeout
+        self.complete = False
+        self.queue_seconds = 0.0
+
+    @property
+    def keep_alive(self) -> bool:
+        """Whether the connection can carry another request after this response
+
+        Returns:
+            bool: True unless the server asked to close the connection
+        """
+        return self.headers.get('connection', '').lower() != 'close'
+
+    async def iter_body(self) -> AsyncIterator[bytes]:
+        """Read the body of the response, yielding each piece as it arrives
+
+        Yields:
+            bytes: Successive pieces of the body
+        """
+        reader = self._connection.reader
+
+        if self.headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await self._readline()).split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    await self._readline()
+                    break
+                chunk = await self._wait(reader.readexactly(size + 2))
+                yield chunk[:-2]
+
+        elif 'content-length' in self.headers:
+            remaining = int(self.headers['content-length'])
+            while remaining > 0:
+                chunk = await self._wait(reader.read(min(remaining, 65536)))
+                if not chunk:
+                    raise TransportError("connection closed before the end of the response")
+                remaining -= len(chunk)
+                yield chunk
+
+        else:
+            # Without a length or chunking, the body ends when the server closes the connection
+            while chunk := await self._wait(reader.read(65536)):
+                yield chunk
+            self.headers['connection'] = 'close'
+
+        self.complete = True
+
+    async def read(self) -> bytes:
+        """Read the entire body of the response
+
+        Returns:
+            bytes: The body
+        """
+        return b"".join([chunk async for chunk in self.iter_body()])
+
+    async def json(self):
+        """Read the entire body of the response, and decode it as JSON
+
+        Returns:
+            The decoded body
+        """
+        return json.loads(await self.read())
+
+    async def _readline(self) -> bytes:
+        return await self._wait(self._connection.reader.readline())
+
+    async def _wait(self, awaitable):
+        try:
+            return await _with_timeout(awaitable, self._read_timeout)
+        except asyncio.IncompleteReadError as e:
+            raise TransportError("connection closed before the end of the response") from e
+
+
+class HttpTransport:
+    """A pool of persistent (keep-alive) HTTP/1.1 connections to a single server
+
+    All requests to the server share the pool, so consecutive chat turns reuse an open connection rather than paying for a new
+    TCP (and, for `https`, TLS) handshake each time. At most `pool_size` connections are open at once; further requests wait for a
+    connection to be returned to the pool. Connections that the server has closed while idle are detected and replaced
+    transparently.
+
+    `check_health()` probes the `/health` endpoint of the server, recording whether it is ready, how long it took to respond, and
+    (if the server reports it) how many requests it is processing. Probing periodically (see `EndpointPool`) also keeps an idle
+    connection warm.
+
+    The pool is bound to a single server address; if the address changes, a new transport should be built (and the old one closed).
+
+    Attributes:
+        server_address (str): The base address of the server, e.g. "http://localhost:1234"
+        pool_size (int): The maximum number of connections open at once
+        connect_timeout (float): The maximum number of seconds to wait for a new connection
+        read_timeout (float): The maximum number of seconds to wait for any single read from the server
+        healthy (bool | None): The result of the last health check, or None if there hasn't been one
+        latency (float | None): The number of seconds the last successful health check took, or None if there hasn't been one
+        queue_depth (int): The number of requests the server reported it was processing at the last health check
+        HEALTH_PATH (str): The path of the health check endpoint on the server
+    """
+
+    HEALTH_PATH = "/health"
+
+    def __init__(self, server_address : str, pool_size : int = 4, connect_timeout : float = 5.0, read_timeout : float = 60.0):
+        """Set up the transport; no connections are opened until they are needed
+
+        Args:
+            server_address (str): The base address of the server, e.g. "http://localhost:1234"
+            pool_size (int): The maximum number of connections open at once
+            connect_timeout (float): The maximum number of seconds to wait for a new connection
+            read_timeout (float): The maximum number of seconds to wait for any single read from the server
+        """
+        address = urlparse(server_address, scheme='http')
+        self.server_address = server_address
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.healthy = None
+        self.latency = None
+        self.queue_depth = 0
+
+        self._https = address.scheme == 'https'
+        self._host = address.hostname
+        self._port = address.port if address.port is not None else (443 if self._https else 80)
+        self._netloc = address.netloc
+        self._base_path = address.path.rstrip('/')
+
+        self._idle = []
+        self._in_use = 0
+        self._available = None
+        self._closed = False
+
+    @asynccontextmanager
+    async def request(self, method : str, path : str, body : dict = None, headers : dict = None) -> AsyncIterator[HttpResponse]:
+        """Make a request to the server over a pooled connection
+
+        The response is only valid inside the `async with` block. Its connection is returned to the pool when the block exits if the
+        body was read to the end; otherwise (e.g. if the caller stopped reading a stream part-way) the connection is closed.
+
+        Args:
+            method (str): The HTTP method, e.g. "GET" or "POST"
+            path (str): The path of the endpoint, relative to the server address
+            body (dict): A body to send as JSON, if any
+            headers (dict): Additional request headers, if any
+
+        Yields:
+            HttpResponse: The response, with its headers read but its body unread
+
+        Raises:
+            TransportError: The connection failed, or the server broke the protocol
+            asyncio.TimeoutError: The server did not respond in time
+        """
+        payload = json.dumps(body).encode('utf-8') if body is not None else b""
+        head = self._format_head(method, path, payload, headers or {})
+
+        started = time.perf_counter()
+        await self._acquire()
+        queue_seconds = time.perf_counter() - started
+        connection = None
+        response = None
+        try:
+            connection, response = await self._send(head + payload)
+            response.queue_seconds = queue_seconds
+            yield response
+        finally:
+            if connection is not None:
+                if response is not None and response.complete and response.keep_alive and not self._closed:
+                    self._idle.append(connection)
+                else:
+                    connection.close()
+            await self._release()
+
+    async def get_json(self, path : str):
+        """Make a GET request, and decode the body of the response as JSON
+
+        Args:
+            path (str): The path of the endpoint, relative to the server address
+
+        Returns:
+            The decoded body of the response
+
+        Raises:
+            TransportError: The request failed, or the server returned an error status
+        """
+        async with self.request("GET", path) as response:
+            result = await response.json()
+            if response.status != 200:
+                raise TransportError(f"GET {path} returned {response.status}")
+            return result
+
+    async def check_health(self) -> bool:
+        """Check the health endpoint of the server, and record the result in `healthy`, `latency` and `queue_depth`
+
+        Returns:
+            bool: True if the server reports that it is ready
+        """
+        started = time.perf_counter()
+        try:
+            async with self.request("GET", HttpTransport.HEALTH_PATH) as response:
+                body = await response.read()
+                healthy = response.status == 200
+        except (OSError, asyncio.TimeoutError) as e:
+            logging.debug(f"health check of {self.server_address} failed: {e!r}")
+            healthy = False
+
+        if healthy:
+            self.latency = time.perf_counter() - started
+            try:
+                self.queue_depth = int(json.loads(body).get('slots_processing', 0))
+            except (ValueError, AttributeError):
+                self.queue_depth = 0
+
+        if healthy != self.healthy:
+            logging.info(f"server {self.server_address} is {'healthy' if healthy else 'unhealthy'}")
+        self.healthy = healthy
+        return healthy
+
+    async def close(self):
+        """Close every idle connection; connections in use are closed as their requests finish"""
+        self._closed = True
+        while self._idle:
+            self._idle.pop().close()
+
+    def _format_head(self, method : str, path : str, payload : bytes, headers : dict) -> bytes:
+        lines = [f"{method} {self._base_path}{path} HTTP/1.1", f"Host: {self._netloc}", "Connection: keep-alive"]
+        if payload:
+            lines.extend(["Content-Type: application/json", f"Content-Length: {len(payload)}"])
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+    async def _acquire(self):
+        if self._available is None:
+            self._available = asyncio.Condition()
+
+        async with self._available:
+            await self._available.wait_for(lambda: self._in_use < self.pool_size)
+            self._in_use += 1
+
+    async def _release(self):
+        async with self._available:
+            self._in_use -= 1
+            self._available.notify_all()
+
+    async def _send(self, request : bytes) -> tuple:
+        # Idle connections may have been closed by the server since they were last used; if sending over one fails before any of
+        # the response arrives, the request is retried over a new connection.
+        while self._idle:
+            connection = self._idle.pop()
+            if connection.is_closed:
+                connection.close()
+                continue
+            try:
+                return connection, await self._exchange(connection, request)
+            except BaseException as e:
+                # The connection is closed whatever went wrong (e.g. a timeout, or the request being stopped), so the server
+                # stops generating the response
+                connection.close()
+                if not isinstance(e, (ConnectionError, TransportError)):
+                    raise
+
+        connection = await self._connect()
+        try:
+            return connection, await self._exchange(connection, request)
+        except BaseException:
+            connection.close()
+            raise
+
+    async def _connect(self) -> _Connection:
+        ssl_context = ssl.create_default_context() if self._https else None
+        try:
+            reader, writer = await _with_timeout(
+                asyncio.open_connection(self._host, self._port, ssl=ssl_context), self.connect_timeout)
+        except OSError as e:
+            raise TransportError(f"could not connect to {self.server_address}: {e}") from e
+        return _Connection(reader, writer)
+
+    async def _exchange(self, connection : _Connection, request : bytes) -> HttpResponse:
+        connection.writer.write(request)
+        await connection.writer.drain()
+
+        status_line = await _with_timeout(connection.reader.readline(), self.read_timeout)
+        if not status_line:
+            raise TransportError("connection closed by server")
+
+        parts = status_line.decode('latin-1').strip().split(' ', 2)
+        if len(parts) < 2 or not parts[1].isdigit():
+            raise TransportError(f"invalid response from server: {status_line!r}")
+
+        headers = {}
+        while True:
+            line = (await _with_timeout(connection.reader.readline(), self.read_timeout)).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        return HttpResponse(connection, int(parts[1]), headers, self.read_timeout)
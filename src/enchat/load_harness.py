@@ -0,0 +1,229 @@
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+
+from enchat.chat_history import ChatHistory
+from enchat.chat_parameters import DEFAULT_PARAMETERS
+from enchat.chat_session import ChatSession
+from enchat.completion_client import CompletionClient
+from enchat.endpoint_pool import EndpointPool, parse_endpoints
+from enchat.request_metrics import percentile
+
+
+class _ReplyWatcher:
+    """A history listener that signals when the text of each reply first arrives"""
+
+    def __init__(self):
+        self.first_text_event = asyncio.Event()
+        self._reply_index = None
+
+    def start(self):
+        self.first_text_event.clear()
+        self._reply_index = None
+
+    def message_added(self, index : int):
+        self._reply_index = index
+
+    def message_changed(self, index : int):
+        if index == self._reply_index:
+            self.first_text_event.set()
+
+
+class LoadHarness:
+    """Drives many concurrent chat sessions through the same request path as the app, and reports how the client performs
+
+    Each simulated user has its own `ChatSession` (with its own history, prompt cache and context budget); all of them share one
+    `CompletionClient`, and so one `EndpointPool` and its connections, as the sessions of the app do. Each user sends `turns`
+    messages, one after the other, pausing for `think_time` seconds between them.
+
+    A fraction of turns (`cancel_rate`) are cancelled as soon as the first text of the reply arrives, as when the user stops a
+    reply, to check that cancelled streams release their connections.
+
+    Attributes:
+        client (CompletionClient): The client shared by every session
+        sessions (int): The number of concurrent sessions
+        turns (int): The number of messages sent by each session
+        parameters (dict): The sampling parameters of every session
+        think_time (float): The number of seconds each session waits between turns
+        cancel_rate (float): The fraction of turns that are cancelled after their first text
+    """
+
+    def __init__(self, client : CompletionClient, sessions : int, turns : int, parameters : dict, think_time : float = 0.0,
+                 cancel_rate : float = 0.0, seed : int = None):
+        """Set up the harness
+
+        Args:
+            client (CompletionClient): The client shared by every session
+            sessions (int): The number of concurrent sessions
+            turns (int): The number of messages sent by each session
+            parameters (dict): The sampling parameters of every session
+            think_time (float): The number of seconds each session waits between turns
+            cancel_rate (float): The fraction of turns that are cancelled after their first text
+            seed (int): The seed for choosing which turns are cancelled, for repeatable runs
+        """
+        self.client = client
+        self.sessions = sessions
+        self.turns = turns
+        self.parameters = parameters
+        self.think_time = think_time
+        self.cancel_rate = cancel_rate
+        self._random = random.Random(seed)
+        self._latencies = []
+        self._first_text_latencies = []
+        self._tokens = 0
+        self._errors = 0
+        self._cancelled = 0
+
+    async def run(self) -> dict:
+        """Run every session to the end
+
+        Returns:
+            dict: The report, with the number of requests, errors and cancellations, the p50/p99 latency and time to first text
+                (in seconds), the total rate of generated tokens, and the CPU time used by this process
+        """
+        wall_started = time.perf_counter()
+        cpu_started = time.process_time()
+
+        await asyncio.gather(*[self._run_session(number) for number in range(self.sessions)])
+
+        wall = time.perf_counter() - wall_started
+        cpu = time.process_time() - cpu_started
+        return {
+            'sessions': self.sessions,
+            'requests': self.sessions * self.turns,
+            'errors': self._errors,
+            'cancelled': self._cancelled,
+            'latency_p50': percentile(self._latencies, 0.5),
+            'latency_p99': percentile(self._latencies, 0.99),
+            'first_text_p50': percentile(self._first_text_latencies, 0.5),
+            'first_text_p99': percentile(self._first_text_latencies, 0.99),
+            'tokens_generated': self._tokens,
+            'tokens_per_second': self._tokens / wall if wall > 0 else 0.0,
+            'wall_seconds': wall,
+            'client_cpu_seconds': cpu,
+            'client_cpu_percent': 100 * cpu / wall if wall > 0 else 0.0
+        }
+
+    async def _run_session(self, number : int):
+        history = ChatHistory()
+        session = ChatSession(history, self.client, f"You are assistant number {number}.", self.parameters)
+        watcher = _ReplyWatcher()
+        history.add_listener(watcher)
+
+        for turn in range(self.turns):
+            if turn > 0 and self.think_time > 0:
+                await asyncio.sleep(self.think_time)
+
+            watcher.start()
+            task = asyncio.ensure_future(session.send(f"Session {number} asks question {turn}: what happens next?"))
+
+            if self._random.random() < self.cancel_rate:
+                first_text = asyncio.ensure_future(watcher.first_text_event.wait())
+                await asyncio.wait([task, first_text], return_when=asyncio.FIRST_COMPLETED)
+                first_text.cancel()
+                task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                self._cancelled += 1
+                continue
+
+            if session.last_error is not None:
+                self._errors += 1
+                continue
+
+            metrics = session.last_metrics
+            self._latencies.append(metrics.wall_seconds)
+            if metrics.first_token_seconds is not None:
+                self._first_text_latencies.append(metrics.first_token_seconds)
+            self._tokens += metrics.generated_tokens or 0
+
+
+def start_mock_server(options : list) -> tuple:
+    """Start a mock server in a separate process, so its CPU time is not counted as the client's
+
+    Args:
+        options (list[str]): Command line options for the mock server
+
+    Returns:
+        tuple[subprocess.Popen, str]: The server process, and its address
+    """
+    process = subprocess.Popen([sys.executable, "-m", "enchat.mock_server", "--port", "0", *options],
+                               stdout=subprocess.PIPE, text=True)
+    return process, process.stdout.readline().strip()
+
+
+def main(argv : list = None) -> dict:
+    """Run the load harness, e.g. `python -m enchat.load_harness --sessions 50 --turns 5 --token-rate 30`
+
+    The report is printed (and optionally written to a file) as JSON.
+
+    Args:
+        argv (list[str]): The command line arguments, without the program name; defaults to `sys.argv[1:]`
+
+    Returns:
+        dict: The report
+    """
+    parser = argparse.ArgumentParser(prog="python -m enchat.load_harness", description="Drive concurrent chat sessions")
+    parser.add_argument("--servers", default=None, help="server endpoints to load; by default a mock server is started")
+    parser.add_argument("--sessions", type=int, default=20, help="number of concurrent sessions")
+    parser.add_argument("--turns", type=int, default=5, help="number of messages sent by each session")
+    parser.add_argument("--n-predict", type=int, default=64, help="tokens requested for each reply")
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds each session waits between turns")
+    parser.add_argument("--cancel-rate", type=float, default=0.0, help="fraction of turns cancelled after their first text")
+    parser.add_argument("--pool-size", type=int, default=8, help="maximum number of connections to each server")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the random choices of the harness and mock server")
+    parser.add_argument("--out", default=None, help="file to write the JSON report to")
+
+    mock = parser.add_argument_group("mock server")
+    mock.add_argument("--token-rate", default="50", help="tokens generated per second, for each request")
+    mock.add_argument("--ttft", default="0.2", help="seconds before the first token of each reply")
+    mock.add_argument("--error-rate", default="0", help="fraction of completion requests that fail")
+    mock.add_argument("--stall-rate", default="0", help="fraction of completion requests that stall")
+    mock.add_argument("--stall-seconds", default="2", help="length of each stall")
+    mock.add_argument("--slots", default="4", help="number of requests generated at once")
+    arguments = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    process = None
+    if arguments.servers is None:
+        options = ["--token-rate", arguments.token_rate, "--ttft", arguments.ttft, "--error-rate", arguments.error_rate,
+                   "--stall-rate", arguments.stall_rate, "--stall-seconds", arguments.stall_seconds, "--slots", arguments.slots]
+        if arguments.seed is not None:
+            options += ["--seed", str(arguments.seed)]
+        process, address = start_mock_server(options)
+        endpoints = [(address, 1.0)]
+    else:
+        endpoints = parse_endpoints(arguments.servers)
+
+    parameters = dict(DEFAULT_PARAMETERS, n_predict=arguments.n_predict)
+
+    async def run():
+        pool = EndpointPool(endpoints, pool_size=arguments.pool_size)
+        harness = LoadHarness(CompletionClient(pool), arguments.sessions, arguments.turns, parameters,
+                              think_time=arguments.think_time, cancel_rate=arguments.cancel_rate, seed=arguments.seed)
+        try:
+            return await harness.run()
+        finally:
+            await pool.close()
+
+    try:
+        report = asyncio.run(run())
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if arguments.out is not None:
+        with open(arguments.out, "w") as file:
+            file.write(text + "\n")
+    return report
+
+
+if __name__ == "__main__":
+    main()
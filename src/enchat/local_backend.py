@@ -0,0 +1,361 @@
+import asyncio
+import collections
+import importlib.util
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from typing import AsyncIterator
+
+from enchat.completion_backend import CompletionBackend, CompletionError, ServerUnavailableError
+
+
+def completion_result(prompt_tokens : int, cached : int, generated : int, seconds : float, slot : int = 0) -> dict:
+    """The final event of a completion generated in-process, in the form of a llama.cpp-style server's final event
+
+    Args:
+        prompt_tokens (int): The number of tokens in the prompt
+        cached (int): The number of tokens at the start of the prompt that were already evaluated
+        generated (int): The number of tokens generated
+        seconds (float): The time taken to evaluate the prompt and generate the reply
+        slot (int): The slot that evaluated the prompt
+
+    Returns:
+        dict: The final event
+    """
+    return {
+        'stop': True,
+        'id_slot': slot,
+        'tokens_predicted': generated,
+        'tokens_evaluated': prompt_tokens,
+        'tokens_cached': cached,
+        'timings': {
+            'prompt_n': prompt_tokens - cached,
+            'predicted_n': generated,
+            'predicted_per_second': generated / seconds if seconds > 0 else 0.0
+        }
+    }
+
+
+class LlamaEngine:
+    """Runs a GGUF model through llama-cpp-python (the optional `llama_cpp` module), in the worker process of a `LocalBackend`
+
+    The model keeps the tokens it last evaluated, and only evaluates the part of a new prompt after the prefix they have in common,
+    so (as with a server's prompt cache) each turn of a chat only evaluates the new messages. There is one cache, so chats that
+    take turns evaluate each other's prompts again.
+
+    The model is loaded for generation only, so it does not provide embeddings (and `LongTermMemory` recalls nothing).
+
+    llama-cpp-python is an optional dependency of the application (see `is_installed`), installed with
+    `pip install llama-cpp-python`.
+
+    Attributes:
+        model_path (str): The GGUF file of the model
+    """
+
+    def __init__(self, model_path : str, n_ctx : int):
+        """Load the model, offloading as many layers to the GPU as llama.cpp was built to support
+
+        Args:
+            model_path (str): The GGUF file of the model
+            n_ctx (int): The size of the context window, in tokens
+        """
+        from llama_cpp import Llama
+
+        self.model_path = model_path
+        self._llama = Llama(model_path=model_path, n_ctx=n_ctx, n_gpu_layers=-1, verbose=False)
+        self._evaluated = []
+
+    @staticmethod
+    def is_installed() -> bool:
+        """Whether llama-cpp-python is installed, so a model can be run; checked without importing it
+
+        Returns:
+            bool: True if the `llama_cpp` module can be imported
+        """
+        return importlib.util.find_spec("llama_cpp") is not None
+
+    def tokenize(self, text : str) -> list:
+        return self._llama.tokenize(text.encode('utf-8'), add_bos=False, special=True)
+
+    def embed(self, text : str) -> list:
+        raise CompletionError("the local model does not provide embeddings")
+
+    def props(self) -> dict:
+        return {'default_generation_settings': {'n_ctx': self._llama.n_ctx()}, 'model_path': self.model_path, 'total_slots': 1}
+
+    def complete(self, prompt : str, parameters : dict):
+        """Generate a completion of a prompt
+
+        Args:
+            prompt (str): The entire prompt to complete
+            parameters (dict): Parameters in the form of the completion API
+
+        Returns:
+            Generator[str, None, dict]: Yields each piece of text of the reply, and returns the final event
+        """
+        started = time.perf_counter()
+        tokens = self._llama.tokenize(prompt.encode('utf-8'), add_bos=True, special=True)
+        cached = len(os.path.commonprefix([self._evaluated, tokens]))
+        n_predict = int(parameters.get('n_predict', -1))
+        sampling = dict(top_k=int(parameters.get('top_k', 40)), top_p=float(parameters.get('top_p', 0.95)),
+                        min_p=float(parameters.get('min_p', 0.05)), repeat_penalty=float(parameters.get('repeat_penalty', 1.1)))
+
+        if n_predict == 0:
+            # Generating evaluates the prompt before the first token is sampled; the token is discarded
+            generator = self._llama.generate(tokens, temp=0.0, **sampling)
+            next(generator, None)
+            generator.close()
+            self._evaluated = tokens
+            return completion_result(len(tokens), cached, 0, time.perf_counter() - started)
+
+        seed = int(parameters.get('seed', -1))
+        reply = ""
+        generated = 0
+        chunks = self._llama.create_completion(tokens, max_tokens=n_predict if n_predict > 0 else None,
+                                               temperature=float(parameters.get('temperature', 0.8)),
+                                               seed=seed if seed >= 0 else None, stop=parameters.get('stop'), stream=True,
+                                               **sampling)
+        try:
+            for chunk in chunks:
+                text = chunk['choices'][0]['text']
+                if text:
+                    generated += 1
+                    reply += text
+                    yield text
+        finally:
+            chunks.close()
+            self._evaluated = tokens + self.tokenize(reply)
+        return completion_result(len(tokens), cached, generated, time.perf_counter() - started)
+
+
+def _serve(connection, engine_factory, arguments : tuple):
+    # The main function of the worker process. Requests are handled one at a time, in order; while a completion is generated, the
+    # connection is checked for requests between pieces of text, so a completion can be cancelled, and the worker can be stopped,
+    # part-way through
+    try:
+        engine = engine_factory(*arguments)
+        failure = None
+    except Exception as e:
+        engine = None
+        failure = f"could not load the model: {e!r}"
+
+    backlog = collections.deque()
+    cancelled = set()
+    while True:
+        if not backlog:
+            # Every request has been answered, so any cancellations are for requests that finished before they arrived
+            cancelled.clear()
+        try:
+            message = backlog.popleft() if backlog else connection.recv()
+        except (EOFError, OSError):
+            return
+        if message is None:
+            return
+
+        request_id, command, request_arguments = message
+        if command == "cancel":
+            cancelled.add(request_arguments[0])
+            continue
+        if request_id in cancelled:
+            continue
+
+        try:
+            if failure is not None:
+                raise CompletionError(failure)
+            if command != "complete":
+                connection.send(("done", request_id, getattr(engine, command)(*request_arguments)))
+                continue
+
+            pieces = engine.complete(*request_arguments)
+            try:
+                while True:
+                    connection.send(("text", request_id, next(pieces)))
+                    while connection.poll():
+                        message = connection.recv()
+                        if message is not None and message[1] == "cancel":
+                            cancelled.add(message[2][0])
+                        else:
+                            backlog.append(message)
+                    if request_id in cancelled or None in backlog:
+                        pieces.close()
+                        break
+            except StopIteration as stop:
+                connection.send(("done", request_id, stop.value))
+        except (EOFError, OSError):
+            return
+        except Exception as e:
+            connection.send(("error", request_id, str(e) or type(e).__name__))
+
+
+class LocalBackend(CompletionBackend):
+    """Runs a model in a worker process of the application, rather than on a server
+
+    For a single user on a laptop, running the model in-process drops the HTTP request (and the event stream) for each reply, and
+    the separate server process. The model is run in a worker process, so loading it, and evaluating prompts, never blocks the
+    GUI. The worker is started when the first request is made (so the application starts as quickly as without a model), and the
+    model is loaded there; a worker that has stopped (e.g. crashed) is started again by the next request.
+
+    Requests are sent to the worker over a pipe, and handled one at a time, in order (there is one model, and one prompt cache).
+    A thread reads the pieces of each reply from the pipe, and hands them to the event loop. Closing a stream (e.g. stopping the
+    reply) cancels its request, and the worker stops generating after the current piece of text.
+
+    The model is run by an engine, created in the worker: by default a `LlamaEngine`, which runs a GGUF model with
+    llama-cpp-python. Any class with the same methods (e.g. `StubEngine`) can be used instead.
+
+    Attributes:
+        model_path (str): The file of the model
+        n_ctx (int): The size of the context window, in tokens
+        engine (type): The class of the engine, created in the worker with the model path and context size
+        DEFAULT_CONTEXT_SIZE (int): The default context size
+        CLOSE_TIMEOUT (float): The time, in seconds, the worker is given to stop before it is terminated
+    """
+
+    DEFAULT_CONTEXT_SIZE = 4096
+
+    CLOSE_TIMEOUT = 5.0
+
+    name = "local"
+
+    def __init__(self, model_path : str, n_ctx : int = DEFAULT_CONTEXT_SIZE, engine : type = LlamaEngine):
+        """Set up the backend; the worker is not started until the first request
+
+        Args:
+            model_path (str): The file of the model
+            n_ctx (int): The size of the context window, in tokens
+            engine (type): The class of the engine, created in the worker with the model path and context size
+        """
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.engine = engine
+        self._process = None
+        self._connection = None
+        self._loop = None
+        self._requests = {}
+        self._next_id = 0
+
+    async def tokenize(self, text : str) -> list:
+        return await self._call("tokenize", text)
+
+    async def embed(self, text : str) -> list:
+        return await self._call("embed", text)
+
+    async def props(self) -> dict:
+        return await self._call("props")
+
+    async def close(self):
+        """Stop the worker, waiting (in a thread, so the event loop keeps running) for it to finish the current piece of text;
+        requests in flight fail"""
+        if self._process is None:
+            return
+
+        process, connection = self._process, self._connection
+        self._process = None
+        self._connection = None
+        self._fail_requests("the local model was closed")
+        try:
+            connection.send(None)
+        except OSError:
+            pass
+        await asyncio.get_running_loop().run_in_executor(None, process.join, LocalBackend.CLOSE_TIMEOUT)
+        if process.is_alive():
+            logging.warning(f"the worker running {self.model_path} did not stop; terminating it")
+            process.terminate()
+        connection.close()
+
+    async def _stream(self, body : dict, preferred : str, result : dict) -> AsyncIterator[str]:
+        request_id, queue = self._request("complete", body['prompt'], body)
+        finished = False
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind == "text":
+                    yield value
+                    continue
+                finished = True
+                if kind == "error":
+                    raise CompletionError(value)
+                if kind == "unavailable":
+                    raise ServerUnavailableError(value)
+                result.update(value, endpoint=LocalBackend.name)
+                return
+        finally:
+            del self._requests[request_id]
+            if not finished and self._connection is not None:
+                try:
+                    self._connection.send((request_id, "cancel", (request_id,)))
+                except OSError:
+                    pass
+
+    async def _call(self, command : str, *arguments):
+        request_id, queue = self._request(command, *arguments)
+        try:
+            kind, value = await queue.get()
+        finally:
+            del self._requests[request_id]
+        if kind == "error":
+            raise CompletionError(value)
+        if kind == "unavailable":
+            raise ServerUnavailableError(value)
+        return value
+
+    def _request(self, command : str, *arguments) -> tuple:
+        if self._process is None:
+            self._start()
+        self._next_id += 1
+        try:
+            self._connection.send((self._next_id, command, arguments))
+        except OSError as e:
+            # The worker has died, and the reader thread has not yet reported it; the next request starts it again
+            raise ServerUnavailableError(f"the worker running the local model stopped ({e!r})")
+        queue = self._requests[self._next_id] = asyncio.Queue()
+        return self._next_id, queue
+
+    def _start(self):
+        # Spawned, rather than forked, so the worker does not inherit the GUI's threads and native state
+        context = multiprocessing.get_context("spawn")
+        self._connection, child = context.Pipe()
+        self._process = context.Process(target=_serve, args=(child, self.engine, (self.model_path, self.n_ctx)),
+                                        name="enchat-local-model", daemon=True)
+        self._process.start()
+        child.close()
+        self._loop = asyncio.get_running_loop()
+        threading.Thread(target=self._read, args=(self._connection,), name="enchat-local-model-reader", daemon=True).start()
+        logging.info(f"started a worker process for the local model {self.model_path}")
+
+    def _read(self, connection):
+        # Runs in the reader thread, until the worker stops
+        while True:
+            try:
+                kind, request_id, value = connection.recv()
+            except (EOFError, OSError):
+                break
+            try:
+                self._loop.call_soon_threadsafe(self._dispatch, request_id, kind, value)
+            except RuntimeError:
+                # The event loop has been closed
+                return
+        try:
+            self._loop.call_soon_threadsafe(self._stopped, connection)
+        except RuntimeError:
+            pass
+
+    def _dispatch(self, request_id : int, kind : str, value):
+        queue = self._requests.get(request_id)
+        if queue is not None:
+            queue.put_nowait((kind, value))
+
+    def _stopped(self, connection):
+        if connection is not self._connection:
+            return
+        logging.warning(f"the worker running the local model {self.model_path} stopped; it will be started by the next request")
+        self._process.join(0)
+        self._process = None
+        self._connection = None
+        connection.close()
+        self._fail_requests("the worker running the local model stopped")
+
+    def _fail_requests(self, message : str):
+        for queue in self._requests.values():
+            queue.put_nowait(("unavailable", message))
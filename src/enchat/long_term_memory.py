@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import time
+from pathlib import Path
+from enchat.chat_history import ChatHistory
+from enchat.completion_backend import CompletionBackend, CompletionError
+from enchat.prompt_format import format_turn
+
+
+class LongTermMemory:
+    """Recalls the earlier messages of a chat that are most relevant to its latest message, by the similarity of their embeddings
+
+    When a chat no longer fits in the server's context window, the `ContextBudget` drops its oldest messages from the prompt. The
+    memory lets the most relevant of the dropped messages back in: each message is embedded (once) through the server's embedding
+    endpoint, and the embeddings are kept in a memory-mapped `VectorIndex` saved alongside the chat. For each prompt, the dropped
+    messages whose embeddings are most similar (by cosine similarity) to that of the latest message are recalled, up to `top_k` of
+    them, as long as they fit in the part of the context the budget sets aside for them.
+
+    Nothing is embedded until a message has been dropped, so a chat that fits in the context window costs no embedding requests.
+    From then on, only the latest message is embedded before a prompt is sent (to search for the messages relevant to it); the
+    other messages added or changed since the last prompt are embedded in the background, so a long chat that has just been
+    opened is not held up while its messages are embedded, and recalls from the messages embedded so far. The index (and NumPy)
+    are only loaded when they are first needed.
+
+    If the server does not provide embeddings, nothing is recalled, and the server is not asked again for `RETRY_SECONDS`.
+
+    Attributes:
+        client (CompletionBackend): The backend used to request embeddings
+        path (Path): The file holding the embeddings of the messages
+        top_k (int): The maximum number of messages recalled for a prompt
+        min_similarity (float): The cosine similarity below which a message is never recalled
+        RETRY_SECONDS (float): The time after a failed embedding request before embeddings are requested again
+        BATCH_SIZE (int): The number of embedding requests made at once
+    """
+
+    RETRY_SECONDS = 60.0
+
+    BATCH_SIZE = 8
+
+    def __init__(self, client : CompletionBackend, history : ChatHistory, path, top_k : int = 4, min_similarity : float = 0.4):
+        """Set up the memory of a chat, and start tracking the messages of its history
+
+        Args:
+            client (CompletionBackend): The backend used to request embeddings
+            history (ChatHistory): The history of the chat
+            path (str | Path): The file holding the embeddings of the messages
+            top_k (int): The maximum number of messages recalled for a prompt
+            min_similarity (float): The cosine similarity below which a message is never recalled
+        """
+        self.client = client
+        self.path = Path(path)
+        self.top_k = top_k
+        self.min_similarity = min_similarity
+        self._history = history
+        self._index = None
+        self._changed = set()
+        self._retry_at = 0.0
+        self._task = None
+        history.add_listener(self)
+
+    def message_added(self, index : int):
+        pass
+
+    def message_changed(self, index : int):
+        if self._index is not None and index < len(self._index):
+            self._changed.add(index)
+
+    @property
+    def is_embedding(self) -> bool:
+        """Whether messages are being embedded in the background
+
+        Returns:
+            bool: True if messages are being embedded
+        """
+        return self._task is not None
+
+    async def recall(self, dropped : range) -> list:
+        """Find the dropped messages most relevant to the latest message of the history
+
+        Args:
+            dropped (range): The indexes of the messages that were dropped from the prompt
+
+        Returns:
+            list[int]: The indexes of up to `top_k` of the dropped messages, most relevant first
+        """
+        if not dropped or time.monotonic() < self._retry_at:
+            return []
+
+        if self._index is None:
+            from enchat.vector_index import VectorIndex
+            self._index = VectorIndex(self.path)
+            if len(self._index) > len(self._history):
+                self._index.clear(self._index.dimensions)
+
+        latest = len(self._history) - 1
+        try:
+            if latest < len(self._index) and latest not in self._changed:
+                query = self._index.vector(latest)
+            else:
+                message = self._history[latest]
+                query = await self.client.embed(format_turn(message.role, message.text))
+        except (CompletionError, OSError, asyncio.TimeoutError, LookupError, TypeError, ValueError) as e:
+            self._failed(e)
+            return []
+
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._update())
+            self._task.add_done_callback(self._finished)
+
+        hits = self._index.search(query, self.top_k, dropped.start, dropped.stop)
+        recalled = [index for index, similarity in hits if similarity >= self.min_similarity]
+        if recalled:
+            logging.debug(f"recalled messages {recalled} of the {len(dropped)} dropped from the prompt")
+        return recalled
+
+    def close(self):
+        """Stop embedding messages, stop tracking the history, and close the index"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._history.remove_listener(self)
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+
+    async def _update(self):
+        # Messages changed since they were embedded are embedded again, and new messages are added in order; if embedding fails
+        # (or is stopped), the changed messages are embedded again next time
+        changed, self._changed = sorted(self._changed), set()
+        try:
+            pending = changed + list(range(len(self._index), len(self._history)))
+            for start in range(0, len(pending), LongTermMemory.BATCH_SIZE):
+                batch = pending[start:start + LongTermMemory.BATCH_SIZE]
+                messages = [self._history[index] for index in batch]
+                vectors = await asyncio.gather(*[self.client.embed(format_turn(message.role, message.text))
+                                                 for message in messages])
+                for index, vector in zip(batch, vectors):
+                    self._index.set(index, vector)
+                    if index >= len(self._index):
+                        # The embeddings changed size (e.g. the server's model changed), so the index was cleared; embed every
+                        # message again
+                        changed = []
+                        return await self._update()
+                changed = [index for index in changed if index not in batch]
+        except BaseException:
+            self._changed.update(changed)
+            raise
+        finally:
+            if self._index is not None:
+                self._index.flush()
+
+    def _finished(self, task : asyncio.Task):
+        if self._task is task:
+            self._task = None
+        if not task.cancelled() and task.exception() is not None:
+            self._failed(task.exception())
+
+    def _failed(self, e : Exception):
+        logging.warning(f"could not embed messages ({e!r}); no messages will be recalled for {self.RETRY_SECONDS:.0f} s")
+        self._retry_at = time.monotonic() + LongTermMemory.RETRY_SECONDS
@@ -0,0 +1,232 @@
+import re
+
+_FENCE = re.compile(r"^\s{0,3}(`{3,}|~{3,})\s*([\w+#.-]*)")
+
+_HEADING = re.compile(r"^\s{0,3}(#{1,6})(?:\s+|$)(.*?)\s*#*\s*$")
+
+_LIST_ITEM = re.compile(r"^(\s*)([-*+]|\d{1,9}[.)])\s+")
+
+_TABLE_SEPARATOR = re.compile(r"^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$")
+
+_BOLD = re.compile(r"(\*\*|__)(?=\S)(.+?)(?<=\S)\1")
+
+_LINK = re.compile(r"!?\[([^\]]*)\]\(([^)\s]+)[^)]*\)")
+
+
+class Block:
+    """A block of a Markdown document: a paragraph, heading, code block, list or table
+
+    Attributes:
+        kind (str): The kind of block; one of `PARAGRAPH`, `HEADING`, `CODE`, `LIST` or `TABLE`
+        start (int): The offset in the document of the first character of the block
+        end (int): The offset in the document after the last character of the block
+        source (str): The Markdown text of the block
+        level (int): The level of a heading (1 to 6), otherwise 0
+        language (str): The language of a code block, if it was given, otherwise ""
+        PARAGRAPH, HEADING, CODE, LIST, TABLE (str): The kinds of block
+    """
+
+    PARAGRAPH = "paragraph"
+
+    HEADING = "heading"
+
+    CODE = "code"
+
+    LIST = "list"
+
+    TABLE = "table"
+
+    def __init__(self, kind : str, start : int, end : int, source : str, level : int = 0, language : str = ""):
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.source = source
+        self.level = level
+        self.language = language
+        self._text = None
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Block) and (self.kind, self.source, self.level) == (other.kind, other.source, other.level)
+
+    def __repr__(self) -> str:
+        return f"Block({self.kind!r}, {self.start}, {self.end}, {self.source!r})"
+
+    @property
+    def text(self) -> str:
+        """The text of the block, as it is displayed
+
+        Code blocks are displayed verbatim, without their fences. The markers of list items are replaced with bullets, and the
+        cells of tables are padded so their columns line up (tables are displayed in a monospaced font). Bold markers are removed
+        from other text, and links are displayed as the link text followed by the address.
+
+        Returns:
+            str: The displayed text
+        """
+        if self._text is None:
+            self._text = self._render()
+        return self._text
+
+    def _render(self) -> str:
+        if self.kind == Block.CODE:
+            lines = self.source.splitlines()
+            fence = _FENCE.match(lines[0]).group(1)
+            if len(lines) > 1 and lines[-1].strip().startswith(fence) and lines[-1].strip().strip(fence[0]) == "":
+                lines = lines[:-1]
+            return "\n".join(lines[1:])
+
+        if self.kind == Block.HEADING:
+            return _inline(_HEADING.match(self.source).group(2))
+
+        if self.kind == Block.LIST:
+            return "\n".join(_LIST_ITEM.sub(_bullet, line.rstrip()) for line in self.source.splitlines())
+
+        if self.kind == Block.TABLE:
+            rows = [_cells(line) for line in self.source.splitlines() if not _TABLE_SEPARATOR.match(line)]
+            widths = [max(len(row[column]) if column < len(row) else 0 for row in rows) for column in range(max(map(len, rows)))]
+            return "\n".join(" │ ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows)
+
+        return _inline(" ".join(line.strip() for line in self.source.splitlines()))
+
+
+class MarkdownDocument:
+    """A Markdown document that is parsed incrementally as its text is updated, e.g. as a reply is streamed from the server
+
+    The document is parsed into a sequence of `Block`s. A block is finished once a complete line after it has decided where it
+    ends; finished blocks are kept as they are when the text is updated, and only the text from the start of the first unfinished
+    block (the open 'tail' of the document) is parsed again. As a streamed reply only ever grows at its end, each update parses
+    no more than the last block or two, rather than the whole reply, so streaming a long reply costs time in proportion to its
+    length, rather than its length squared.
+
+    If an update changes text that a finished block was parsed from (e.g. the document is reused for a different message), the
+    whole text is parsed again.
+
+    The parser covers the Markdown that assistants usually produce: paragraphs, ATX headings (`# Title`), fenced code blocks,
+    lists and pipe tables. Of the inline markup, only bold text and links are interpreted.
+
+    Attributes:
+        text (str): The text of the document
+        blocks (list[Block]): The blocks of the document, in order
+    """
+
+    def __init__(self, text : str = ""):
+        """Set up the document
+
+        Args:
+            text (str): The initial text of the document
+        """
+        self.text = ""
+        self.blocks = []
+        self._finished = 0
+        self._parse_from = 0
+        self.update(text)
+
+    def update(self, text : str) -> int:
+        """Replace the text of the document, parsing as little of it as possible
+
+        Args:
+            text (str): The new text
+
+        Returns:
+            int: The index of the first block that may have changed; blocks before it are unchanged
+        """
+        if self._parse_from > 0 and text[:self._parse_from] == self.text[:self._parse_from]:
+            first = self._finished
+            self.blocks[first:] = _parse(text, self._parse_from)
+        else:
+            first = 0
+            self.blocks = _parse(text, 0)
+        self.text = text
+
+        # A block is finished if a complete line after it decided where it ends, so nothing appended to the text can change it
+        last_line = text.rfind("\n", 0, len(text) - 1) + 1
+        finished = first
+        while finished < len(self.blocks) and self.blocks[finished].end < last_line:
+            finished += 1
+        self._finished = finished
+        if finished < len(self.blocks):
+            self._parse_from = self.blocks[finished].start
+        else:
+            self._parse_from = self.blocks[-1].end if self.blocks else 0
+
+        return first
+
+
+def _parse(text : str, position : int) -> list:
+    blocks = []
+    kind = None
+    start = position
+    lines = []
+    fence = None
+    level = 0
+    language = ""
+
+    def close(end):
+        blocks.append(Block(kind, start, end, "".join(lines), level=level, language=language))
+
+    for line in text[position:].splitlines(keepends=True):
+        stripped = line.strip()
+
+        if kind == Block.CODE:
+            lines.append(line)
+            if stripped.startswith(fence) and stripped.strip(fence[0]) == "" and line.endswith("\n"):
+                close(position + len(line))
+                kind = None
+        elif not stripped:
+            if kind is not None:
+                close(position)
+                kind = None
+        elif _FENCE.match(line):
+            if kind is not None:
+                close(position)
+            match = _FENCE.match(line)
+            kind, start, lines, fence, level, language = Block.CODE, position, [line], match.group(1), 0, match.group(2)
+        elif _HEADING.match(line):
+            if kind is not None:
+                close(position)
+            kind, start, lines, level, language = Block.HEADING, position, [line], len(_HEADING.match(line).group(1)), ""
+            close(position + len(line))
+            kind = None
+        elif _LIST_ITEM.match(line) or (kind == Block.LIST and line[:1] in (" ", "\t")):
+            if kind != Block.LIST:
+                if kind is not None:
+                    close(position)
+                kind, start, lines, level, language = Block.LIST, position, [], 0, ""
+            lines.append(line)
+        elif stripped.startswith("|"):
+            if kind != Block.TABLE:
+                if kind is not None:
+                    close(position)
+                kind, start, lines, level, language = Block.TABLE, position, [], 0, ""
+            lines.append(line)
+        elif kind in (Block.PARAGRAPH, Block.LIST):
+            # Continuation of the paragraph, or of the last list item
+            lines.append(line)
+        else:
+            if kind is not None:
+                close(position)
+            kind, start, lines, level, language = Block.PARAGRAPH, position, [line], 0, ""
+
+        position += len(line)
+
+    if kind is not None:
+        close(position)
+    return blocks
+
+
+def _inline(text : str) -> str:
+    return _LINK.sub(lambda match: f"{match.group(1)} ({match.group(2)})" if match.group(1) else match.group(2),
+                     _BOLD.sub(r"\2", text))
+
+
+def _bullet(match) -> str:
+    indent, marker = match.group(1), match.group(2)
+    return f"{indent}{'•' if marker in '-*+' else marker} "
+
+
+def _cells(line : str) -> list:
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|"):
+        line = line[:-1]
+    return [_inline(cell.strip()) for cell in line.split("|")]
@@ -1,10 +1,24 @@
+import weakref
 from toga import Box, Label
-from toga.style.pack import ROW, Pack
+from toga.style.pack import BOLD, COLUMN, MONOSPACE, NONE, NORMAL, PACK, ROW, SYSTEM, Pack
+from enchat.chat_history import ChatMessage
+from enchat.markdown_document import Block, MarkdownDocument
 
 class MessageBox(Box):
     """A box containing all the info for a single message from either the User or the Assistant
 
-    The MessageBox displays the role of the message. This is usually one of the following:
+    The MessageBox displays the role of the message, and optionally a compact footer (e.g. the metrics of a reply) under the
+    message. The message is rendered as Markdown, with a label for each block (paragraph, heading, code block, list or table) of
+    the text; code blocks and tables are displayed in a monospaced font.
+
+    A MessageBox is a view of a `ChatMessage`: the model holds the message, and `show` updates the box to display it, so boxes can
+    be recycled to display other messages. The style properties of every label are computed once for each role and kind of block,
+    and shared by every box.
+
+    The Markdown is rendered incrementally (see `MarkdownDocument`): when the message is updated (e.g. as a reply is streamed),
+    only the blocks at the end of the message that have changed are parsed again, and only their labels are updated.
+
+    The role is usually one of the following:
 
     * "System" - A initial message describing the role of the system / assistant in the conversation
     * "Assistant" - The message comes from the AI agent
@@ -16,7 +30,17 @@ class MessageBox(Box):
     Attributes:
         COLORS (lst[dict]): Data structure holding style and colour combinations
         _role_lbl (toga.Label): Label for the 'role' string
-        _message_lbl (toga.Label): Label for the message text
+        _document (MarkdownDocument): The message text, parsed into Markdown blocks
+        _blocks (list[Block]): The blocks displayed by the labels of the content box, in order
+        _content_box (toga.Box): Box holding a label for each block of the message
+        _footer_lbl (toga.Label): Label for the footer, hidden when the footer is empty
+        _role_key (str): The key in `COLOURS` of the colours of the current role
+        HEADING_FONT_SIZES (dict[int, int]): The font size of the headings of each level; deeper levels use `FONT_SIZE`
+        CODE_FONT_SIZE (int): The font size of code blocks and tables
+        CODE_COLOURS (dict): The foreground and background colours of code blocks
+        BLOCK_SPACING (int): The space under each block of the message
+        _styles (dict): The style properties shared by every box, by label and role (and kind of block)
+        _instances (weakref.WeakSet): Every box that has not been garbage collected, for diagnostics (see `census`)
     """
 
     COLOURS = {
@@ -44,8 +68,27 @@ class MessageBox(Box):
 
     FONT_SIZE = 12
 
+    HEADING_FONT_SIZES = {1: 18, 2: 16, 3: 14}
+
+    CODE_FONT_SIZE = 11
+
+    CODE_COLOURS = {
+        'foreground': '#cdc',
+        'background': '#000'
+    }
+
+    BLOCK_SPACING = 4
+
+    FOOTER_FONT_SIZE = 9
+
+    FOOTER_COLOUR = '#888'
+
     ROLE_WIDTH = 100
 
+    _styles = {}
+
+    _instances = weakref.WeakSet()
+
     def __init__(self, role : str, message : str):
         """Set up the MessageBox object
 
@@ -54,29 +97,51 @@ class MessageBox(Box):
             message (str): The entire text of the message
         """
 
-        rl = 'user'
-
-        if role == "assistant":
-            rl = 'assistant'
-
-        self._role_lbl = Label(
-            text=role,
-            style=Pack(
-                color=MessageBox.COLOURS[rl]['role']['foreground'],
-                background_color=MessageBox.COLOURS[rl]['role']['background'],
-                font_size=MessageBox.FONT_SIZE,
-                width=MessageBox.ROLE_WIDTH
-            ))
-        self._message_lbl = Label(
-            text=message,
-            style=Pack(
-                flex=1,
-                color=MessageBox.COLOURS[rl]['message']['foreground'],
-                background_color=MessageBox.COLOURS[rl]['message']['background'],
-                font_size=MessageBox.FONT_SIZE
-            ))
-
-        super(MessageBox, self).__init__(style=Pack(direction=ROW), children=[self._role_lbl, self._message_lbl])
+        self._role_lbl = Label(text=role, style=Pack(**MessageBox._role_style(role)))
+        self._document = MarkdownDocument()
+        self._blocks = []
+        self._content_box = Box(style=Pack(direction=COLUMN, flex=1))
+        self._role_key = MessageBox._colours_key(role)
+        self._footer_lbl = Label(text="", style=Pack(display=NONE, **MessageBox._footer_style(role)))
+        self.message = message
+
+        text_box = Box(style=Pack(direction=COLUMN, flex=1), children=[self._content_box, self._footer_lbl])
+        super(MessageBox, self).__init__(style=Pack(direction=ROW), children=[self._role_lbl, text_box])
+        MessageBox._instances.add(self)
+
+    @staticmethod
+    def census() -> tuple:
+        """Count the message boxes that are alive (i.e. have not been garbage collected), and their labels
+
+        Returns:
+            tuple[int, int]: The number of boxes, and the number of labels they hold
+        """
+        boxes = list(MessageBox._instances)
+        return len(boxes), sum(2 + len(box._blocks) for box in boxes)
+
+    @staticmethod
+    def style_cache_size() -> int:
+        """The number of sets of style properties shared by the boxes
+
+        Returns:
+            int: The number of entries in the style cache
+        """
+        return len(MessageBox._styles)
+
+    def show(self, message : ChatMessage):
+        """Display a message of the chat, changing only what differs from the message displayed
+
+        Args:
+            message (ChatMessage): The message
+        """
+        if self.role != message.role:
+            self.role = message.role
+        text = message.text
+        if self.message != text:
+            self.message = text
+        footer = message.metrics.footer() if message.metrics is not None else ""
+        if self.footer != footer:
+            self.footer = footer
 
     @property
     def role(self) -> str:
@@ -90,16 +155,126 @@ class MessageBox(Box):
     @role.setter
     def role(self, value : str):
         self._role_lbl.text = value
+        self._apply_colours(value)
 
     @property
     def message(self) -> str:
-        """The message text
+        """The message text, as Markdown
 
         Returns:
             str: The text of the message
         """
-        return self._message_lbl.text
-    
+        return self._document.text
+
     @message.setter
     def message(self, value : str):
-        self._message_lbl.text = value
+        first = self._document.update(value)
+        blocks = self._document.blocks
+        labels = self._content_box.children
+
+        for index in range(first, len(blocks)):
+            block = blocks[index]
+            if index >= len(self._blocks):
+                self._content_box.add(Label(text=block.text, style=Pack(**MessageBox._block_style(self._role_key, block))))
+                self._blocks.append(block)
+            elif self._blocks[index] != block:
+                if (self._blocks[index].kind, self._blocks[index].level) != (block.kind, block.level):
+                    labels[index].style.update(**MessageBox._block_style(self._role_key, block))
+                labels[index].text = block.text
+                self._blocks[index] = block
+
+        while len(self._blocks) > len(blocks):
+            self._content_box.remove(labels[-1])
+            self._blocks.pop()
+
+    @property
+    def footer(self) -> str:
+        """A compact line of text under the message, e.g. the metrics of a reply; empty (and hidden) by default
+
+        Returns:
+            str: The text of the footer
+        """
+        return self._footer_lbl.text
+
+    @footer.setter
+    def footer(self, value : str):
+        self._footer_lbl.text = value
+        self._footer_lbl.style.display = PACK if value else NONE
+
+    def _apply_colours(self, role : str):
+        """Set the colours of the labels to those for the given role
+
+        Args:
+            role (str): The sender role for the message
+        """
+        self._role_key = MessageBox._colours_key(role)
+        self._role_lbl.style.update(**MessageBox._role_style(role))
+        self._footer_lbl.style.update(**MessageBox._footer_style(role))
+        for block, label in zip(self._blocks, self._content_box.children):
+            label.style.update(**MessageBox._block_style(self._role_key, block))
+
+    @staticmethod
+    def _colours_key(role : str) -> str:
+        return 'assistant' if role == "assistant" else 'user'
+
+    @staticmethod
+    def _role_style(role : str) -> dict:
+        key = ('role', MessageBox._colours_key(role))
+        style = MessageBox._styles.get(key)
+        if style is None:
+            colours = MessageBox.COLOURS[key[1]]['role']
+            style = MessageBox._styles[key] = {
+                'font_size': MessageBox.FONT_SIZE,
+                'width': MessageBox.ROLE_WIDTH,
+                'color': colours['foreground'],
+                'background_color': colours['background']
+            }
+        return style
+
+    @staticmethod
+    def _footer_style(role : str) -> dict:
+        key = ('footer', MessageBox._colours_key(role))
+        style = MessageBox._styles.get(key)
+        if style is None:
+            style = MessageBox._styles[key] = {
+                'font_size': MessageBox.FOOTER_FONT_SIZE,
+                'color': MessageBox.FOOTER_COLOUR,
+                'background_color': MessageBox.COLOURS[key[1]]['message']['background']
+            }
+        return style
+
+    @staticmethod
+    def _block_style(role_key : str, block : Block) -> dict:
+        """The style properties of the label displaying a block of a message, computed once for each role and kind of block, and
+        shared by every label
+
+        Args:
+            role_key (str): The key in `COLOURS` of the colours of the role of the message
+            block (Block): The block
+
+        Returns:
+            dict: The style properties, which must not be modified
+        """
+        key = (role_key, block.kind, block.level)
+        style = MessageBox._styles.get(key)
+        if style is not None:
+            return style
+
+        colours = MessageBox.COLOURS[role_key]['message']
+        style = {
+            'font_family': SYSTEM,
+            'font_size': MessageBox.FONT_SIZE,
+            'font_weight': NORMAL,
+            'color': colours['foreground'],
+            'background_color': colours['background'],
+            'padding_bottom': MessageBox.BLOCK_SPACING
+        }
+        if block.kind == Block.HEADING:
+            style.update(font_weight=BOLD, font_size=MessageBox.HEADING_FONT_SIZES.get(block.level, MessageBox.FONT_SIZE))
+        elif block.kind == Block.CODE:
+            style.update(font_family=MONOSPACE, font_size=MessageBox.CODE_FONT_SIZE, color=MessageBox.CODE_COLOURS['foreground'],
+                         background_color=MessageBox.CODE_COLOURS['background'])
+        elif block.kind == Block.TABLE:
+            style.update(font_family=MONOSPACE, font_size=MessageBox.CODE_FONT_SIZE)
+        MessageBox._styles[key] = style
+        return style
@@ -0,0 +1,304 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+
+
+class MockServer:
+    """A local stand-in for a llama.cpp-style inference server, for testing the client without a GPU
+
+    The server speaks the same HTTP/1.1 (keep-alive) API as the real server, on the endpoints the client uses:
+
+    * `POST /completion` - generates `n_predict` tokens (or `default_n_predict` if it is unlimited), streamed as Server-Sent Events
+      if `stream` is set, otherwise returned as a single JSON object
+    * `POST /tokenize` - splits the text into words, each standing in for a token
+    * `GET /props` - reports the context size, as `default_generation_settings.n_ctx`, and the model, as `model_path`
+    * `GET /health` - reports the number of idle and busy slots
+    * `POST /embedding` - returns a deterministic pseudo-random unit vector for the content
+
+    Generation is simulated with configurable timings: a delay before the first token (`time_to_first_token`), then one token
+    every `1 / token_rate` seconds. A fraction of requests (`error_rate`) fail with status 503, and a fraction (`stall_rate`)
+    pause for `stall_seconds` part-way through the reply. At most `slots` requests are generated at once; further requests wait
+    for a free slot. Each slot remembers its last prompt, so (as with the real server's prompt cache) only the part of a prompt
+    after the prefix it shares with the slot's previous prompt is counted as evaluated.
+
+    Attributes:
+        token_rate (float): The number of tokens generated per second, for each request
+        time_to_first_token (float): The number of seconds before the first token of each reply
+        error_rate (float): The fraction of completion requests that fail
+        stall_rate (float): The fraction of completion requests that stall part-way through
+        stall_seconds (float): The length of each stall, in seconds
+        slots (int): The number of requests generated at once
+        n_ctx (int): The context size reported by the server
+        default_n_predict (int): The number of tokens generated when a request does not limit them
+        embedding_size (int): The number of dimensions of each embedding
+        address (str | None): The address the server is listening on, once started
+        stats (dict): Counts of the requests, errors, stalls, cancelled replies and generated tokens
+    """
+
+    def __init__(self, token_rate : float = 50.0, time_to_first_token : float = 0.2, error_rate : float = 0.0,
+                 stall_rate : float = 0.0, stall_seconds : float = 2.0, slots : int = 4, n_ctx : int = 4096,
+                 default_n_predict : int = 64, embedding_size : int = 64, seed : int = None):
+        """Set up the server; it does not listen until it is started
+
+        Args:
+            token_rate (float): The number of tokens generated per second, for each request
+            time_to_first_token (float): The number of seconds before the first token of each reply
+            error_rate (float): The fraction of completion requests that fail
+            stall_rate (float): The fraction of completion requests that stall part-way through
+            stall_seconds (float): The length of each stall, in seconds
+            slots (int): The number of requests generated at once
+            n_ctx (int): The context size reported by the server
+            default_n_predict (int): The number of tokens generated when a request does not limit them
+            embedding_size (int): The number of dimensions of each embedding
+            seed (int): The seed for choosing which requests fail or stall, for repeatable runs
+        """
+        assert(token_rate > 0 and slots > 0)
+
+        self.token_rate = token_rate
+        self.time_to_first_token = time_to_first_token
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.slots = slots
+        self.n_ctx = n_ctx
+        self.default_n_predict = default_n_predict
+        self.embedding_size = embedding_size
+        self.address = None
+        self.stats = {'requests': 0, 'errors': 0, 'stalls': 0, 'cancelled': 0, 'tokens_generated': 0}
+
+        self._random = random.Random(seed)
+        self._server = None
+        self._free_slots = None
+        self._slot_prompts = [""] * slots
+        self._busy = 0
+
+    async def start(self, host : str = "127.0.0.1", port : int = 0) -> str:
+        """Start listening
+
+        Args:
+            host (str): The interface to listen on
+            port (int): The port to listen on; 0 chooses a free port
+
+        Returns:
+            str: The address of the server, e.g. "http://127.0.0.1:8080"
+        """
+        self._free_slots = asyncio.Queue()
+        for slot in range(self.slots):
+            self._free_slots.put_nowait(slot)
+
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        host, port = self._server.sockets[0].getsockname()[:2]
+        self.address = f"http://{host}:{port}"
+        return self.address
+
+    async def close(self):
+        """Stop listening, and close every connection"""
+        if self._server is not None:
+            self._server.close()
+            if hasattr(self._server, 'close_clients'):
+                self._server.close_clients()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self) -> 'MockServer':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _handle_connection(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                payload = await reader.readexactly(int(headers.get('content-length', 0)))
+                body = json.loads(payload) if payload else {}
+
+                await self._route(method, path, body, writer)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logging.error(f"mock server failed to handle a request: {e!r}")
+        finally:
+            writer.close()
+
+    async def _route(self, method : str, path : str, body : dict, writer : asyncio.StreamWriter):
+        if method == "POST" and path == "/completion":
+            await self._complete(body, writer)
+        elif method == "POST" and path == "/tokenize":
+            await self._send_json(writer, 200, {'tokens': self._tokenize(body.get('content', ""))})
+        elif method == "GET" and path == "/props":
+            await self._send_json(writer, 200, {'default_generation_settings': {'n_ctx': self.n_ctx}, 'total_slots': self.slots,
+                                                'model_path': "mock"})
+        elif method == "GET" and path == "/health":
+            await self._send_json(writer, 200, {'status': "ok", 'slots_idle': self.slots - self._busy,
+                                                'slots_processing': self._busy})
+        elif method == "POST" and path == "/embedding":
+            await self._send_json(writer, 200, {'embedding': self._embed(body.get('content', ""))})
+        else:
+            await self._send_json(writer, 404, {'error': {'code': 404, 'message': "File Not Found"}})
+
+    async def _complete(self, body : dict, writer : asyncio.StreamWriter):
+        self.stats['requests'] += 1
+        if self._random.random() < self.error_rate:
+            self.stats['errors'] += 1
+            await self._send_json(writer, 503, {'error': {'code': 503, 'message': "Server busy (simulated)"}})
+            return
+
+        prompt = body.get('prompt', "")
+        n_predict = int(body.get('n_predict', -1))
+        n_predict = n_predict if n_predict >= 0 else self.default_n_predict
+        stall_at = self._random.randrange(n_predict) if n_predict and self._random.random() < self.stall_rate else None
+
+        slot = await self._take_slot(int(body.get('id_slot', -1)))
+        self._busy += 1
+        try:
+            started = time.perf_counter()
+
+            # As with the real prompt cache, only the tokens after the prefix shared with the slot's last prompt are evaluated
+            cached = len(self._tokenize(os.path.commonprefix([self._slot_prompts[slot], prompt]))) if body.get('cache_prompt') else 0
+            prompt_tokens = len(self._tokenize(prompt))
+            self._slot_prompts[slot] = prompt
+
+            if body.get('stream'):
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+
+            await asyncio.sleep(self.time_to_first_token)
+            generated = []
+            for index in range(n_predict):
+                if index == stall_at:
+                    self.stats['stalls'] += 1
+                    await asyncio.sleep(self.stall_seconds)
+                elif index > 0:
+                    await asyncio.sleep(1 / self.token_rate)
+
+                token = self._token(prompt, index)
+                generated.append(token)
+                self.stats['tokens_generated'] += 1
+                if body.get('stream'):
+                    await self._send_event(writer, {'content': token, 'stop': False, 'id_slot': slot})
+
+            seconds = time.perf_counter() - started
+            final = {
+                'content': "" if body.get('stream') else "".join(generated),
+                'stop': True,
+                'id_slot': slot,
+                'tokens_predicted': n_predict,
+                'tokens_evaluated': prompt_tokens,
+                'tokens_cached': cached,
+                'timings': {
+                    'prompt_n': prompt_tokens - cached,
+                    'predicted_n': n_predict,
+                    'predicted_per_second': n_predict / seconds if seconds > 0 else 0.0
+                }
+            }
+
+            if body.get('stream'):
+                await self._send_event(writer, final)
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+            else:
+                await self._send_json(writer, 200, final)
+
+        except ConnectionError:
+            # The client closed the connection part-way through the reply (e.g. the user cancelled it)
+            self.stats['cancelled'] += 1
+            raise
+        finally:
+            self._busy -= 1
+            self._free_slots.put_nowait(slot)
+
+    async def _take_slot(self, requested : int) -> int:
+        slot = await self._free_slots.get()
+        if 0 <= requested < self.slots and slot != requested:
+            # Swap for the requested slot, if it is free, so the slot's cached prompt can be reused
+            free = [slot]
+            while not self._free_slots.empty():
+                free.append(self._free_slots.get_nowait())
+            slot = requested if requested in free else slot
+            for other in free:
+                if other != slot:
+                    self._free_slots.put_nowait(other)
+        return slot
+
+    def _tokenize(self, text : str) -> list:
+        return [int.from_bytes(hashlib.blake2s(word.encode('utf-8'), digest_size=2).digest(), 'little') for word in text.split()]
+
+    def _token(self, prompt : str, index : int) -> str:
+        words = prompt.split()[-16:] or ["lorem"]
+        return " " + words[(len(prompt) + index) % len(words)]
+
+    def _embed(self, content : str) -> list:
+        generator = random.Random(hashlib.sha256(content.encode('utf-8')).digest())
+        vector = [generator.gauss(0, 1) for _ in range(self.embedding_size)]
+        norm = sum(value * value for value in vector) ** 0.5
+        return [value / norm for value in vector]
+
+    async def _send_event(self, writer : asyncio.StreamWriter, event : dict):
+        data = f"data: {json.dumps(event)}\n\n".encode('utf-8')
+        writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+        await writer.drain()
+
+    async def _send_json(self, writer : asyncio.StreamWriter, status : int, body : dict):
+        payload = json.dumps(body).encode('utf-8')
+        writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(payload)}\r\n\r\n".encode('latin-1') + payload)
+        await writer.drain()
+
+
+def main(argv : list = None):
+    """Run a mock server until interrupted, e.g. `python -m enchat.mock_server --port 1234 --token-rate 30`
+
+    The address of the server is printed once it is listening.
+
+    Args:
+        argv (list[str]): The command line arguments, without the program name; defaults to `sys.argv[1:]`
+    """
+    parser = argparse.ArgumentParser(prog="python -m enchat.mock_server", description="Run a mock llama.cpp-style server")
+    parser.add_argument("--host", default="127.0.0.1", help="interface to listen on")
+    parser.add_argument("--port", type=int, default=1234, help="port to listen on; 0 chooses a free port")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="tokens generated per second, for each request")
+    parser.add_argument("--ttft", type=float, default=0.2, help="seconds before the first token of each reply")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of completion requests that fail")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="fraction of completion requests that stall")
+    parser.add_argument("--stall-seconds", type=float, default=2.0, help="length of each stall")
+    parser.add_argument("--slots", type=int, default=4, help="number of requests generated at once")
+    parser.add_argument("--n-ctx", type=int, default=4096, help="context size reported by the server")
+    parser.add_argument("--n-predict", type=int, default=64, help="tokens generated when a request does not limit them")
+    parser.add_argument("--seed", type=int, default=None, help="seed for choosing which requests fail or stall")
+    arguments = parser.parse_args(argv)
+
+    server = MockServer(token_rate=arguments.token_rate, time_to_first_token=arguments.ttft, error_rate=arguments.error_rate,
+                        stall_rate=arguments.stall_rate, stall_seconds=arguments.stall_seconds, slots=arguments.slots,
+                        n_ctx=arguments.n_ctx, default_n_predict=arguments.n_predict, seed=arguments.seed)
+
+    async def run():
+        print(await server.start(arguments.host, arguments.port), flush=True)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import logging
+import os
+import sys
+
+
+class PromptCache:
+    """Keeps track of the prompt cached by the server for a single chat, so each turn only evaluates the new part of the prompt
+
+    A llama.cpp-style server keeps the evaluated prompt (its KV cache) for each of its slots, and when asked to `cache_prompt`, only
+    evaluates the part of a new prompt that follows the longest prefix it has in common with the cached one. The chat is pinned to
+    one slot: the first request lets the server choose a slot, and every later request asks for the same slot. When there are
+several servers, the chat prefers the server holding its cached prompt; if a request is routed to another server (e.g. because
+the preferred one is busy or has failed), the cache moves with it.
+
+    Because prompts are formatted as an append-only transcript, each new prompt extends the previous prompt (and the reply that the
+    server generated for it), so only the latest turn needs to be evaluated. Changes to the system content rewrite the beginning of
+    the transcript, and so invalidate the whole cached prefix. Sampling parameters (temperature, top_k etc.) only affect how new
+    tokens are chosen, so changing them does not invalidate anything.
+
+    Attributes:
+        slot_id (int): The server slot the chat is pinned to, or -1 if the server has not yet assigned one
+        endpoint (str | None): The address of the server holding the cached prompt, or None if there isn't one
+        invalidation_reason (str | None): Why the cached prefix was last invalidated, until the next prompt is recorded
+    """
+
+    def __init__(self):
+        self.slot_id = -1
+        self.endpoint = None
+        self.invalidation_reason = None
+        self._cached_prompt = ""
+
+    @property
+    def request_parameters(self) -> dict:
+        """The parameters to add to each completion request so that the server reuses the cached prompt
+
+        Returns:
+            dict: The cache parameters for the completion API
+        """
+        return {'cache_prompt': True, 'id_slot': self.slot_id}
+
+    def configuration_changed(self, old_system_content : str, new_system_content : str, old_parameters : dict,
+                              new_parameters : dict) -> bool:
+        """Check whether a change to the chat configuration invalidates the cached prefix, and report it if so
+
+        Args:
+            old_system_content (str): The system content before the change
+            new_system_content (str): The system content after the change
+            old_parameters (dict): The sampling parameters before the change
+            new_parameters (dict): The sampling parameters after the change
+
+        Returns:
+            bool: True if the cached prefix has been invalidated
+        """
+        changed_parameters = sorted(name for name in new_parameters if old_parameters.get(name) != new_parameters[name])
+        if changed_parameters:
+            logging.debug(f"changed sampling parameters {', '.join(changed_parameters)} do not affect the cached prompt")
+
+        if old_system_content != new_system_content:
+            self.invalidate("the system content has changed")
+            return True
+
+        return False
+
+    def invalidate(self, reason : str):
+        """Record that the cached prefix is no longer valid, so the next prompt will be evaluated in full
+
+        Args:
+            reason (str): A human-readable description of why the prefix is invalid
+        """
+        if self._cached_prompt:
+            logging.info(f"cached prompt in slot {self.slot_id} invalidated: {reason}; the next prompt will be evaluated in full")
+        self.invalidation_reason = reason
+        self._cached_prompt = ""
+
+    def memory_size(self) -> int:
+        """An estimate of the memory used to track the cached prompt
+
+        Returns:
+            int: The estimated size, in bytes
+        """
+        return sys.getsizeof(self._cached_prompt)
+
+    def check_prompt(self, prompt : str) -> bool:
+        """Check whether a new prompt extends the cached one, reporting it if it does not
+
+        Args:
+            prompt (str): The prompt about to be sent
+
+        Returns:
+            bool: True if the prompt extends the cached prompt, so only the new suffix will be evaluated
+        """
+        if not self._cached_prompt:
+            return False
+
+        if prompt.startswith(self._cached_prompt):
+            return True
+
+        common = len(os.path.commonprefix([self._cached_prompt, prompt]))
+        self.invalidate(f"the prompt diverges from the cached prompt after {common} of {len(self._cached_prompt)} characters")
+        return False
+
+    def record(self, prompt : str, result : dict):
+        """Record a completed request, so the next prompt can be checked against it
+
+        Args:
+            prompt (str): The prompt that was sent
+            result (dict): The final event from the server, which identifies the server and slot, and reports what was cached
+        """
+        endpoint = result.get('endpoint')
+        if endpoint is not None and endpoint != self.endpoint:
+            if self.endpoint is not None:
+                self.invalidate(f"the request was routed from {self.endpoint} to {endpoint}")
+            self.endpoint = endpoint
+            self.slot_id = -1
+
+        slot_id = result.get('id_slot', result.get('slot_id'))
+        if slot_id is not None and slot_id != self.slot_id:
+            logging.debug(f"chat pinned to server slot {slot_id}")
+            self.slot_id = slot_id
+
+        self._cached_prompt = prompt
+        self.invalidation_reason = None
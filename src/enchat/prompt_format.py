@@ -0,0 +1,59 @@
+ROLE_PREFIXES = {
+    'system': "",
+    'user': "User: ",
+    'assistant': "Assistant: "
+}
+
+ASSISTANT_CUE = "Assistant:"
+
+STOP_STRINGS = ["\nUser:"]
+
+
+def format_turn(role : str, message : str) -> str:
+    """Format a single message of the conversation as a turn of the transcript
+
+    Args:
+        role (str): The sender role for the message
+        message (str): The text of the message
+
+    Returns:
+        str: The formatted turn, including its trailing newline
+    """
+    prefix = ROLE_PREFIXES.get(role.lower(), f"{role}: ")
+    return f"{prefix}{message.strip()}\n"
+
+
+def format_prompt(system_content : str, messages : list) -> str:
+    """Format an entire conversation as a prompt, ending with the cue for the next assistant message
+
+    The `/completion` endpoint takes a single prompt string rather than a list of messages, so the conversation is rendered as a
+    simple transcript: the system content, one prefixed line per message, and an open cue for the assistant to reply.
+
+    Args:
+        system_content (str): The system content at the beginning of the chat
+        messages (list[tuple[str, str]]): The (role, message) pairs of the conversation so far, oldest first
+
+    Returns:
+        str: The prompt to send to the server
+    """
+    parts = [f"{system_content.strip()}\n\n"] if system_content.strip() else []
+    parts.extend(format_turn(role, message) for role, message in messages)
+    parts.append(ASSISTANT_CUE)
+    return "".join(parts)
+
+
+def format_draft(system_content : str, messages : list, draft : str) -> str:
+    """Format the start of the prompt that a draft of the next user message will be sent with, as far as it has been typed
+
+    The result is a prefix of the prompt `format_prompt` produces once the message is finished (as long as the draft is only added
+    to), so it can be sent ahead of the message to warm the server's prompt cache.
+
+    Args:
+        system_content (str): The system content at the beginning of the chat
+        messages (list[tuple[str, str]]): The (role, message) pairs of the conversation so far, oldest first
+        draft (str): The text of the next user message, so far
+
+    Returns:
+        str: The start of the prompt
+    """
+    return format_prompt(system_content, messages)[:-len(ASSISTANT_CUE)] + format_turn("user", draft).rstrip("\n")
@@ -0,0 +1,300 @@
+import json
+import logging
+import os
+import time
+from collections import deque
+from pathlib import Path
+
+
+def percentile(values, fraction : float) -> float:
+    """The nearest-rank percentile of a collection of values
+
+    Args:
+        values (Iterable[float]): The values
+        fraction (float): The percentile, as a fraction, e.g. 0.99
+
+    Returns:
+        float | None: The percentile, or None if there are no values
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class RequestMetrics:
+    """The latency and throughput of a single reply
+
+    Times are measured from when the user's message was sent (`started`), so the time to the first token includes preparing the
+    prompt, waiting for a connection (`queue_seconds`) and the server's evaluation of the prompt.
+
+    Attributes:
+        started (float): The `time.perf_counter` value at which the message was sent
+        queue_seconds (float | None): The time spent waiting for a connection to the server
+        first_token_seconds (float | None): The time until the first text of the reply arrived
+        wall_seconds (float | None): The time until the reply was finished
+        prompt_tokens (int | None): The number of prompt tokens the server evaluated (i.e. that were not already cached)
+        generated_tokens (int | None): The number of tokens in the reply
+        cached (bool): Whether the reply was replayed from the response cache, rather than generated
+        endpoint (str | None): The address of the server that generated the reply
+        error (str | None): The error that ended the reply, if it failed
+        stopped (bool): Whether the reply was stopped by the user before it was finished
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queue_seconds = None
+        self.first_token_seconds = None
+        self.wall_seconds = None
+        self.prompt_tokens = None
+        self.generated_tokens = None
+        self.cached = False
+        self.endpoint = None
+        self.error = None
+        self.stopped = False
+
+    def first_token(self):
+        """Record the arrival of the first text of the reply; later calls have no effect"""
+        if self.first_token_seconds is None:
+            self.first_token_seconds = time.perf_counter() - self.started
+
+    def finish(self, result : dict, chunks : int, cached : bool = False, error : Exception = None, stopped : bool = False):
+        """Record the end of the reply
+
+        Args:
+            result (dict): The final event from the server (see `CompletionStream.result`); empty if there wasn't one
+            chunks (int): The number of pieces of text received, used as the token count if the server did not report one
+            cached (bool): Whether the reply was replayed from the response cache
+            error (Exception): The error that ended the reply, if it failed
+            stopped (bool): Whether the reply was stopped by the user
+        """
+        self.wall_seconds = time.perf_counter() - self.started
+        self.queue_seconds = result.get('queue_seconds')
+        self.prompt_tokens = result.get('timings', {}).get('prompt_n', result.get('tokens_evaluated'))
+        self.generated_tokens = result.get('tokens_predicted', chunks)
+        self.cached = cached
+        self.endpoint = result.get('endpoint')
+        self.error = (str(error) or type(error).__name__) if error is not None else None
+        self.stopped = stopped
+
+    @property
+    def tokens_per_second(self) -> float:
+        """The rate at which the reply was generated, after its first token
+
+        Returns:
+            float | None: The number of tokens per second, or None if it cannot be measured
+        """
+        if self.generated_tokens is None or self.first_token_seconds is None or self.wall_seconds is None:
+            return None
+        seconds = self.wall_seconds - self.first_token_seconds
+        return (self.generated_tokens - 1) / seconds if self.generated_tokens > 1 and seconds > 0 else None
+
+    def footer(self) -> str:
+        """A compact, one-line summary of the metrics, for display under the reply
+
+        Returns:
+            str: The summary, e.g. "first token 0.31s · 42.5 tok/s · 120 → 64 tokens · 1.82s"
+        """
+        if self.error is not None:
+            return f"failed after {self.wall_seconds:.2f}s"
+        if self.stopped:
+            return f"stopped after {self.generated_tokens} tokens, {self.wall_seconds:.2f}s"
+
+        parts = []
+        if self.cached:
+            parts.append("cached")
+        if self.first_token_seconds is not None:
+            parts.append(f"first token {self.first_token_seconds:.2f}s")
+        if self.tokens_per_second is not None:
+            parts.append(f"{self.tokens_per_second:.1f} tok/s")
+        if self.prompt_tokens is not None:
+            parts.append(f"{self.prompt_tokens} → {self.generated_tokens} tokens")
+        elif self.generated_tokens is not None:
+            parts.append(f"{self.generated_tokens} tokens")
+        if self.wall_seconds is not None:
+            parts.append(f"{self.wall_seconds:.2f}s")
+        return " · ".join(parts)
+
+    def as_dict(self) -> dict:
+        """The metrics, as a dictionary suitable for JSON
+
+        Returns:
+            dict: The metrics, keyed by attribute name, plus `tokens_per_second`
+        """
+        return {
+            'queue_seconds': self.queue_seconds,
+            'first_token_seconds': self.first_token_seconds,
+            'tokens_per_second': self.tokens_per_second,
+            'prompt_tokens': self.prompt_tokens,
+            'generated_tokens': self.generated_tokens,
+            'wall_seconds': self.wall_seconds,
+            'cached': self.cached,
+            'endpoint': self.endpoint,
+            'error': self.error,
+            'stopped': self.stopped
+        }
+
+
+class SessionStats:
+    """Aggregated metrics of the replies in a chat session
+
+    Totals cover every reply; percentiles cover the most recent `WINDOW` replies.
+
+    Attributes:
+        requests (int): The number of replies requested
+        errors (int): The number of replies that failed
+        stopped (int): The number of replies stopped by the user
+        cached (int): The number of replies replayed from the response cache
+        prompt_tokens (int): The total number of prompt tokens evaluated by the server
+        generated_tokens (int): The total number of tokens generated
+        generation_seconds (float): The total time spent generating tokens, after the first token of each reply
+        WINDOW (int): The number of recent replies the percentiles are calculated over
+    """
+
+    WINDOW = 1000
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.stopped = 0
+        self.cached = 0
+        self.prompt_tokens = 0
+        self.generated_tokens = 0
+        self.generation_seconds = 0.0
+        self._generation_tokens = 0
+        self._first_token = deque(maxlen=SessionStats.WINDOW)
+        self._wall = deque(maxlen=SessionStats.WINDOW)
+        self._queue = deque(maxlen=SessionStats.WINDOW)
+
+    def add(self, metrics : RequestMetrics):
+        """Add the metrics of a finished reply
+
+        Args:
+            metrics (RequestMetrics): The metrics of the reply
+        """
+        self.requests += 1
+        if metrics.error is not None:
+            self.errors += 1
+            return
+        if metrics.stopped:
+            self.stopped += 1
+            return
+        if metrics.cached:
+            self.cached += 1
+            return
+
+        self.prompt_tokens += metrics.prompt_tokens or 0
+        self.generated_tokens += metrics.generated_tokens or 0
+        if metrics.first_token_seconds is not None:
+            self._first_token.append(metrics.first_token_seconds)
+            self.generation_seconds += metrics.wall_seconds - metrics.first_token_seconds
+            self._generation_tokens += max(0, (metrics.generated_tokens or 0) - 1)
+        if metrics.queue_seconds is not None:
+            self._queue.append(metrics.queue_seconds)
+        self._wall.append(metrics.wall_seconds)
+
+    def summary(self) -> dict:
+        """The aggregated metrics
+
+        The generation rate, as for each reply, counts the tokens after the first one over the time after the first one.
+
+        Returns:
+            dict: The totals, the overall generation rate, and the p50/p99 of queue time, time to first token and wall time
+        """
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'stopped': self.stopped,
+            'cached': self.cached,
+            'prompt_tokens': self.prompt_tokens,
+            'generated_tokens': self.generated_tokens,
+            'tokens_per_second': self._generation_tokens / self.generation_seconds if self.generation_seconds > 0 else None,
+            'queue_seconds_p50': percentile(self._queue, 0.5),
+            'queue_seconds_p99': percentile(self._queue, 0.99),
+            'first_token_seconds_p50': percentile(self._first_token, 0.5),
+            'first_token_seconds_p99': percentile(self._first_token, 0.99),
+            'wall_seconds_p50': percentile(self._wall, 0.5),
+            'wall_seconds_p99': percentile(self._wall, 0.99)
+        }
+
+    def describe(self) -> str:
+        """A human-readable description of the aggregated metrics
+
+        Returns:
+            str: The description, one metric per line
+        """
+        lines = []
+        for name, value in self.summary().items():
+            label = name.replace('_', ' ').capitalize()
+            lines.append(f"{label}: {'-' if value is None else f'{value:.3f}' if isinstance(value, float) else value}")
+        return "\n".join(lines)
+
+
+class MetricsExporter:
+    """Exports request metrics to files that other tools can read
+
+    Two files are written to the directory:
+
+    * `requests.jsonl` - one JSON record per reply, appended as each reply finishes
+    * `enchat.prom` - the aggregated metrics of each session in the Prometheus text format, replaced atomically after each reply,
+      so it can be scraped (e.g. by the node exporter's textfile collector) at any time
+
+    Attributes:
+        directory (Path): The directory holding the files
+        REQUESTS_FILE (str): The name of the file of per-reply records
+        PROMETHEUS_FILE (str): The name of the file of aggregated metrics
+    """
+
+    REQUESTS_FILE = "requests.jsonl"
+
+    PROMETHEUS_FILE = "enchat.prom"
+
+    def __init__(self, directory):
+        """Set up the exporter, creating the directory if it does not exist
+
+        Args:
+            directory (str | Path): The directory holding the files
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._sessions = {}
+
+    def record(self, metrics : RequestMetrics, stats : SessionStats, session : str = "default"):
+        """Export the metrics of a finished reply, and the updated session metrics
+
+        Args:
+            metrics (RequestMetrics): The metrics of the reply
+            stats (SessionStats): The aggregated metrics of the session, including the reply
+            session (str): The name of the session, used as a label
+        """
+        self._sessions[session] = stats
+        record = dict(metrics.as_dict(), time=time.time(), session=session)
+        try:
+            with open(self.directory / MetricsExporter.REQUESTS_FILE, "a", encoding='utf-8') as file:
+                file.write(json.dumps(record) + "\n")
+
+            path = self.directory / MetricsExporter.PROMETHEUS_FILE
+            temporary = path.with_suffix(".tmp")
+            temporary.write_text(self._format_prometheus(), encoding='utf-8')
+            os.replace(temporary, path)
+        except OSError as e:
+            logging.warning(f"could not export metrics to {self.directory}: {e!r}")
+
+    def _format_prometheus(self) -> str:
+        summaries = {session: stats.summary() for session, stats in self._sessions.items()}
+        lines = []
+
+        for name in ('requests', 'errors', 'stopped', 'cached', 'prompt_tokens', 'generated_tokens'):
+            lines.append(f"# TYPE enchat_{name}_total counter")
+            for session, summary in summaries.items():
+                lines.append(f'enchat_{name}_total{{session="{session}"}} {summary[name]}')
+
+        for name in ('queue_seconds', 'first_token_seconds', 'wall_seconds'):
+            lines.append(f"# TYPE enchat_{name} summary")
+            for session, summary in summaries.items():
+                for quantile in ('p50', 'p99'):
+                    value = summary[f"{name}_{quantile}"]
+                    if value is not None:
+                        lines.append(f'enchat_{name}{{session="{session}",quantile="0.{quantile[1:]}"}} {value:.6f}')
+
+        return "\n".join(lines) + "\n"
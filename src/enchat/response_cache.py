@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import AsyncIterator
+
+
+class ReplayStream:
+    """A stream that replays a cached reply, with the same interface as a `CompletionStream`
+
+    The text is yielded in small pieces, yielding to the event loop between them, so a replayed reply goes through exactly the same
+    path (and the same display updates) as one streamed from the server.
+
+    Attributes:
+        result (dict): Always empty, as no request was made to the server
+        CHUNK_SIZE (int): The number of characters yielded at a time
+    """
+
+    CHUNK_SIZE = 64
+
+    def __init__(self, text : str):
+        self.result = {}
+        self._text = text
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._replay()
+
+    async def _replay(self) -> AsyncIterator[str]:
+        for start in range(0, len(self._text), ReplayStream.CHUNK_SIZE):
+            yield self._text[start:start + ReplayStream.CHUNK_SIZE]
+            await asyncio.sleep(0)
+
+
+class ResponseCache:
+    """A two-tier cache of the replies to deterministic completion requests
+
+    A request is deterministic when its temperature is 0 (so the most probable token is always chosen) or its seed is fixed; the
+    same prompt and sampling parameters then always give the same reply from the same model, so the reply can be cached rather than
+    generated again. The prompt includes the system content and the history of the chat, so the key is a hash of the prompt, every
+    sampling parameter and the model (including the backend running it), as the cache is shared by every backend and server.
+
+    The first tier is an in-memory LRU cache of a limited number of entries. The second is a directory on disk, limited to a
+    total size in bytes; when it is full, the least recently used files are deleted. The size of the files already on disk is only
+    measured when the first reply is added, so opening the cache (e.g. at startup) is cheap. Within an event loop, replies are
+    written to disk (and the size first measured) by a background thread, so adding a reply never blocks the loop.
+
+    Attributes:
+        directory (Path): The directory holding the on-disk tier
+        memory_entries (int): The maximum number of entries held in memory
+        disk_bytes (int): The maximum total size of the on-disk tier
+        SAMPLING_PARAMETERS (tuple[str]): The parameters that determine the reply, and are part of the key
+    """
+
+    SAMPLING_PARAMETERS = ('temperature', 'n_predict', 'top_k', 'repeat_penalty', 'min_p', 'top_p', 'seed')
+
+    def __init__(self, directory, memory_entries : int = 256, disk_bytes : int = 64 * 1024 * 1024):
+        """Set up the cache, creating the on-disk tier if it does not exist
+
+        Args:
+            directory (str | Path): The directory holding the on-disk tier
+            memory_entries (int): The maximum number of entries held in memory
+            disk_bytes (int): The maximum total size of the on-disk tier
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.memory_entries = memory_entries
+        self.disk_bytes = disk_bytes
+
+        self._memory = OrderedDict()
+        self._disk_size = None
+        self._disk_lock = threading.Lock()
+        self._writer = None
+
+    @staticmethod
+    def is_deterministic(parameters : dict) -> bool:
+        """Whether a request with the given parameters always gives the same reply to the same prompt
+
+        Args:
+            parameters (dict): The sampling parameters of the request
+
+        Returns:
+            bool: True if the temperature is 0, or the seed is fixed
+        """
+        seed = parameters.get('seed')
+        return parameters.get('temperature') == 0 or (seed is not None and seed >= 0)
+
+    @staticmethod
+    def key(prompt : str, parameters : dict, model : str = "") -> str:
+        """The cache key for a request
+
+        Args:
+            prompt (str): The prompt of the request
+            parameters (dict): The sampling parameters of the request
+            model (str): The model the request is sent to, including the backend running it, e.g. "http:/models/llama.gguf"
+
+        Returns:
+            str: A hash of the prompt, sampling parameters and model
+        """
+        sampling = {name: parameters.get(name) for name in ResponseCache.SAMPLING_PARAMETERS}
+        content = json.dumps([prompt, sampling, model], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def get(self, key : str) -> str:
+        """Look up a reply, first in memory and then on disk
+
+        Args:
+            key (str): The cache key of the request
+
+        Returns:
+            str | None: The cached reply, or None if there isn't one
+        """
+        text = self._memory.get(key)
+        if text is not None:
+            self._memory.move_to_end(key)
+            return text
+
+        path = self._path(key)
+        try:
+            text = path.read_text(encoding='utf-8')
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logging.warning(f"could not read cached reply {path}: {e!r}")
+            return None
+
+        # Mark the file as recently used, so it is not the next to be evicted
+        try:
+            os.utime(path)
+        except OSError as e:
+            logging.debug(f"could not mark cached reply {path} as used: {e!r}")
+        self._remember(key, text)
+        return text
+
+    def put(self, key : str, text : str):
+        """Add a reply to both tiers of the cache; within an event loop, it is written to disk in the background
+
+        Args:
+            key (str): The cache key of the request
+            text (str): The reply
+        """
+        self._remember(key, text)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(key, text)
+            return
+
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ResponseCache writer")
+        loop.run_in_executor(self._writer, self._write, key, text)
+
+    def close(self):
+        """Wait for the replies being written to disk in the background"""
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+
+    @property
+    def size(self) -> tuple:
+        """The current size of the cache
+
+        Returns:
+            tuple[int, int]: The number of entries in memory, and the number of bytes on disk
+        """
+        with self._disk_lock:
+            if self._disk_size is None:
+                self._disk_size = self._measure_disk_size()
+            return len(self._memory), self._disk_size
+
+    def _write(self, key : str, text : str):
+        with self._disk_lock:
+            if self._disk_size is None:
+                self._disk_size = self._measure_disk_size()
+
+            path = self._path(key)
+            data = text.encode('utf-8')
+            try:
+                previous_size = path.stat().st_size if path.exists() else 0
+                path.write_bytes(data)
+            except OSError as e:
+                logging.warning(f"could not write cached reply {path}: {e!r}")
+                return
+
+            self._disk_size += len(data) - previous_size
+            if self._disk_size > self.disk_bytes:
+                self._evict(keep=path)
+
+    def _measure_disk_size(self) -> int:
+        return sum(path.stat().st_size for path in self.directory.glob("*.txt"))
+
+    def _path(self, key : str) -> Path:
+        return self.directory / f"{key}.txt"
+
+    def _remember(self, key : str, text : str):
+        self._memory[key] = text
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, keep : Path):
+        files = sorted(self.directory.glob("*.txt"), key=lambda path: path.stat().st_mtime)
+        for path in files:
+            if self._disk_size <= self.disk_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                size = path.stat().st_size
+                path.unlink()
+                self._disk_size -= size
+            except OSError as e:
+                logging.warning(f"could not evict cached reply {path}: {e!r}")
@@ -0,0 +1,228 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from enchat.chat_history import ChatHistory
+from enchat.completion_backend import CompletionBackend, CompletionError
+from enchat.context_budget import ContextBudget
+from enchat.prompt_format import format_turn
+
+
+class RollingSummary:
+    """A summary of the messages of a chat that have been dropped from its prompt, sent in their place after the system content
+
+    Once the history of a chat passes `threshold` tokens, the `ContextBudget` drops its oldest messages from the prompt (in a block,
+    so the start of the prompt stays the same for a number of turns). The summary folds the dropped messages into a few sentences,
+    so the prompt keeps a bounded size (and the time the server takes to evaluate it stays about the same) however long the chat
+    runs, without the model losing track of how it started. The messages themselves stay in the history, for display.
+
+    The summary is rolling: each update summarises the previous summary and the messages dropped since it was made, so only newly
+    dropped messages are read, and the summary never grows beyond `n_predict` tokens. It is generated by the chat's backend (and
+    server), with a small `n_predict` and a fixed `TEMPERATURE`, in the background after a reply has finished. The server does not
+    rank requests, so the update is not queued behind other requests; it only gives way to the chat's own replies: the next reply
+    (or set of candidates) cancels an update in progress, which is started again after that reply. A new summary changes the start
+    of the prompt, so the server evaluates it once more; a prefill of the next message (see `ChatSession.prefill`) does this while
+    the user is typing.
+
+    The update is generated in a different server slot from the chat's (see `summary_slot`), so it does not evict the prompt the
+    server has cached for the chat. If the server has a single slot, the summary is not made, and old messages are only dropped
+    when the context window is full.
+
+    The summary, and the number of messages it covers, are saved alongside the chat. If a message it covers changes, the summary is
+    discarded, and made again from the start.
+
+    Attributes:
+        client (CompletionBackend): The backend used to generate the summary
+        path (Path): The file holding the summary
+        threshold (int): The most tokens of history sent with a prompt, before older messages are summarised
+        n_predict (int): The most tokens generated for the summary
+        text (str): The summary, or an empty string if there is none
+        covered (int): The number of messages at the start of the history covered by the summary (including pinned messages,
+            which are never summarised)
+        HEADING (str): The line introducing the summary in the prompt
+        INSTRUCTIONS (str): The instructions of the prompt that generates the summary
+        TEMPERATURE (float): The temperature the summary is generated at
+        RETRY_SECONDS (float): The time after a failed update before the summary is updated again
+    """
+
+    HEADING = "Summary of the earlier conversation:"
+
+    INSTRUCTIONS = ("Summarise the conversation below between a user and an assistant, so the assistant can carry on with it "
+                    "without seeing these messages. Keep names, facts, decisions and open questions, in as few words as possible.")
+
+    TEMPERATURE = 0.2
+
+    RETRY_SECONDS = 60.0
+
+    def __init__(self, client : CompletionBackend, history : ChatHistory, path, threshold : int = 2048, n_predict : int = 256):
+        """Set up the summary of a chat, reading it from its file if it has been saved, and start tracking the messages of its
+        history
+
+        Args:
+            client (CompletionBackend): The backend used to generate the summary
+            history (ChatHistory): The history of the chat
+            path (str | Path): The file holding the summary
+            threshold (int): The most tokens of history sent with a prompt, before older messages are summarised
+            n_predict (int): The most tokens generated for the summary
+        """
+        self.client = client
+        self.path = Path(path)
+        self.threshold = threshold
+        self.n_predict = n_predict
+        self.text = ""
+        self.covered = 0
+        self._history = history
+        self._task = None
+        self._retry_at = 0.0
+
+        try:
+            saved = json.loads(self.path.read_text(encoding='utf-8'))
+            if saved['covered'] <= len(history):
+                self.text, self.covered = saved['text'], saved['covered']
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f"could not read the summary {self.path} ({e!r}); it will be made again")
+        history.add_listener(self)
+
+    def message_added(self, index : int):
+        pass
+
+    def message_changed(self, index : int):
+        if index < self.covered:
+            logging.info(f"message {index} has changed since it was summarised; the summary will be made again")
+            self.cancel()
+            self.text, self.covered = "", 0
+            self._save()
+
+    @property
+    def is_updating(self) -> bool:
+        """Whether the summary is being updated in the background
+
+        Returns:
+            bool: True if an update is in progress
+        """
+        return self._task is not None
+
+    def system_content(self, system_content : str) -> str:
+        """The system content to send with a prompt, i.e. the chat's system content followed by the summary, if there is one
+
+        Args:
+            system_content (str): The system content of the chat
+
+        Returns:
+            str: The system content, with the summary
+        """
+        if not self.text:
+            return system_content
+        return f"{system_content.strip()}\n\n{RollingSummary.HEADING}\n{self.text}".strip()
+
+    def schedule(self, dropped : range, context_budget : ContextBudget, endpoint : str = None, chat_slot : int = -1):
+        """Start updating the summary in the background, if messages have been dropped from the prompt since it was made
+
+        Args:
+            dropped (range): The indexes of the messages dropped from the prompt
+            context_budget (ContextBudget): The budget of the chat, which counts the tokens of the messages
+            endpoint (str): The server to send the request to, i.e. the chat's server, if it has one
+            chat_slot (int): The chat's slot on that server, which the request keeps clear of, or -1 if it has none
+        """
+        if self._task is not None or max(self.covered, dropped.start) >= dropped.stop or time.monotonic() < self._retry_at:
+            return
+        self._task = asyncio.ensure_future(self.update(dropped, context_budget, endpoint, chat_slot))
+        self._task.add_done_callback(self._finished)
+
+    def cancel(self):
+        """Stop an update in progress, e.g. to let a reply have the server to itself; the summary is left as it was"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def update(self, dropped : range, context_budget : ContextBudget, endpoint : str = None, chat_slot : int = -1):
+        """Fold the messages dropped from the prompt since the summary was made into it
+
+        The messages are summarised in batches of up to half the context window, each batch with the summary so far, and the
+        summary is saved after each batch. Nothing is summarised if the server has a single slot.
+
+        Args:
+            dropped (range): The indexes of the messages dropped from the prompt
+            context_budget (ContextBudget): The budget of the chat, which counts the tokens of the messages
+            endpoint (str): The server to send the requests to
+            chat_slot (int): The chat's slot on that server, or -1 if it has none
+        """
+        slot = RollingSummary.summary_slot(await context_budget.slots(), chat_slot)
+        if slot is None:
+            logging.debug("the server has a single slot, which holds the chat's cached prompt; old messages are not summarised")
+            return
+
+        batch_tokens = await context_budget.context_size() // 2 - self.n_predict
+        while max(self.covered, dropped.start) < dropped.stop:
+            start = max(self.covered, dropped.start)
+            end, tokens = start + 1, await context_budget.message_tokens(start)
+            while end < dropped.stop and tokens + await context_budget.message_tokens(end) <= batch_tokens:
+                tokens += await context_budget.message_tokens(end)
+                end += 1
+
+            turns = []
+            for index in range(start, end):
+                message = self._history[index]
+                turns.append(format_turn(message.role, message.text[:batch_tokens * ContextBudget.CHARACTERS_PER_TOKEN]))
+            parts = [f"{RollingSummary.INSTRUCTIONS}\n\n"]
+            if self.text:
+                parts.append(f"{RollingSummary.HEADING}\n{self.text}\n\nLater messages:\n")
+            parts += turns
+            parts.append("\nSummary:")
+
+            parameters = {'n_predict': self.n_predict, 'temperature': RollingSummary.TEMPERATURE, 'cache_prompt': False,
+                          'id_slot': slot}
+            stream = self.client.stream_completion("".join(parts), parameters, preferred=endpoint)
+            text = "".join([piece async for piece in stream]).strip()
+
+            self.text = text or self.text
+            self.covered = end
+            self._save()
+            logging.debug(f"summarised messages {start} to {end - 1} in {stream.result.get('tokens_predicted', '?')} tokens")
+
+    @staticmethod
+    def summary_slot(slots : int, chat_slot : int) -> int:
+        """The server slot to generate the summary in, which is the slot after the chat's, so the summary never takes the chat's
+        slot (and the prompt cached in it)
+
+        Args:
+            slots (int | None): The number of slots of the server, or None if it does not report them
+            chat_slot (int): The chat's slot, or -1 if it has none
+
+        Returns:
+            int | None: The slot, -1 to let the server choose one, or None if the server only has the chat's slot
+        """
+        if slots == 1:
+            return None
+        if slots is None or chat_slot < 0:
+            return -1
+        return (chat_slot + 1) % slots
+
+    def close(self):
+        """Stop an update in progress, and stop tracking the history"""
+        self.cancel()
+        self._history.remove_listener(self)
+
+    def _finished(self, task : asyncio.Task):
+        if self._task is task:
+            self._task = None
+        if task.cancelled():
+            return
+        e = task.exception()
+        if isinstance(e, (CompletionError, OSError, asyncio.TimeoutError)):
+            logging.warning(f"could not summarise old messages ({e!r}); trying again in {RollingSummary.RETRY_SECONDS:.0f} s")
+            self._retry_at = time.monotonic() + RollingSummary.RETRY_SECONDS
+        elif e is not None:
+            logging.error(f"could not summarise old messages: {e!r}")
+
+    def _save(self):
+        temporary = self.path.with_suffix(".tmp")
+        try:
+            temporary.write_text(json.dumps({'text': self.text, 'covered': self.covered}), encoding='utf-8')
+            os.replace(temporary, self.path)
+        except OSError as e:
+            logging.error(f"could not save the summary {self.path}: {e!r}")
@@ -0,0 +1,95 @@
+from toga import Box, Button, Selection, Table, TextInput, Widget
+from toga.style.pack import COLUMN, ROW, Pack
+
+class SearchBox(Box):
+    """A box containing controls for searching the messages of the chats
+
+    The box only holds the controls; the search itself is run by the handler of `on_change`, which reads the `query` and `role`
+    and sets the `hits` to display.
+
+    Attributes:
+        _query_txi (TextInput): Input for the words (and quoted phrases) to search for
+        _role_sel (Selection): Selection of the sender role of the messages to find
+        _results_tbl (Table): Table of the messages found
+        ANY_ROLE (str): The role selection that finds messages of any role
+        ROLES (list[str]): The roles that can be selected
+        SNIPPET_LENGTH (int): The maximum number of characters of each message shown in the results
+    """
+
+    ANY_ROLE = "Any role"
+
+    ROLES = [ANY_ROLE, "user", "assistant"]
+
+    SNIPPET_LENGTH = 120
+
+    def __init__(self, on_change : (Widget), on_select : (Widget), on_close : (Widget)):
+        """Set up the box
+
+        Args:
+            on_change: Handler called when the query or role changes
+            on_select: Handler called when a message is selected in the results
+            on_close: Handler called when the box is closed
+        """
+        self._query_txi = TextInput(placeholder="Search messages", on_change=on_change, on_confirm=on_change)
+        self._query_txi.style.flex = 1
+        self._role_sel = Selection(items=SearchBox.ROLES, on_change=on_change)
+        close_btn = Button(text="Close", on_press=on_close)
+
+        query_bx = Box(style=Pack(direction=ROW), children=[self._query_txi, self._role_sel, close_btn])
+
+        self._results_tbl = Table(headings=["Chat", "Role", "Message"], accessors=["chat", "role", "snippet"], on_select=on_select)
+        self._results_tbl.style.flex = 1
+
+        super(SearchBox, self).__init__(style=Pack(direction=COLUMN), children=[query_bx, self._results_tbl])
+
+    @property
+    def query(self) -> str:
+        """The words (and quoted phrases) to search for
+
+        Returns:
+            str: The query
+        """
+        return self._query_txi.value
+
+    @property
+    def role(self) -> str:
+        """The sender role of the messages to find
+
+        Returns:
+            str | None: The role, or None to find messages of any role
+        """
+        role = self._role_sel.value
+        return None if role == SearchBox.ANY_ROLE else role
+
+    @property
+    def hits(self) -> list:
+        """The messages displayed as the results of the search
+
+        Returns:
+            list[SearchHit]: The messages
+        """
+        return [row.hit for row in self._results_tbl.data]
+
+    @hits.setter
+    def hits(self, value : list):
+        self._results_tbl.data = [
+            {'chat': hit.chat, 'role': hit.role, 'snippet': SearchBox._snippet(hit.text), 'hit': hit} for hit in value]
+
+    @property
+    def selected_hit(self):
+        """The message selected in the results
+
+        Returns:
+            SearchHit | None: The message, or None if none is selected
+        """
+        row = self._results_tbl.selection
+        return row.hit if row is not None else None
+
+    def focus(self):
+        """Give the input focus to the query"""
+        self._query_txi.focus()
+
+    @staticmethod
+    def _snippet(text : str) -> str:
+        text = " ".join(text.split())
+        return text if len(text) <= SearchBox.SNIPPET_LENGTH else text[:SearchBox.SNIPPET_LENGTH - 1] + "…"
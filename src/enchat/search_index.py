@@ -0,0 +1,281 @@
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from enchat.chat_history import ChatHistory
+from enchat.conversation_store import ConversationStore
+
+_WORD = re.compile(r"\w+")
+
+_PHRASE = re.compile(r'"([^"]*)"')
+
+
+def tokenize(text : str) -> list:
+    """Split text into the words that are indexed and searched for
+
+    Args:
+        text (str): The text
+
+    Returns:
+        list[str]: The words of the text, in lower case, in order
+    """
+    return _WORD.findall(text.lower())
+
+
+class SearchHit:
+    """A message found by a search
+
+    Attributes:
+        chat (str): The name of the chat holding the message
+        index (int): The index of the message in the history of the chat
+        role (str): The sender role of the message
+        text (str): The text of the message
+    """
+
+    def __init__(self, chat : str, index : int, role : str, text : str):
+        self.chat = chat
+        self.index = index
+        self.role = role
+        self.text = text
+
+    def __repr__(self) -> str:
+        return f"SearchHit({self.chat!r}, {self.index}, {self.role!r})"
+
+
+class _ChatListener:
+    """A history listener that keeps the index up to date with the messages of one chat"""
+
+    def __init__(self, index : 'SearchIndex', chat : str, history : ChatHistory):
+        self._index = index
+        self._chat = chat
+        self._history = history
+
+    def message_added(self, index : int):
+        message = self._history[index]
+        self._index.index_message(self._chat, index, message.role, message.text)
+
+    def message_changed(self, index : int):
+        self._index.mark_changed(self._chat, index)
+
+
+class SearchIndex:
+    """An inverted index of the words of the messages of one or more chats, for finding messages by keyword or phrase
+
+    Each version of a message indexed is a 'document', numbered in the order it was indexed. For each word, the index holds the
+    (ascending) numbers of the documents containing it in a compact array, so a search only visits the documents holding the
+    rarest word of the query, and checks each of them for the other words with a binary search, rather than scanning the text of
+    every message. When a message changes, it is indexed again as a new document, and the old document is ignored from then on.
+
+    A chat added with `follow` is kept up to date as messages are added to its history. Changes to a message (e.g. each piece of a
+    streamed reply) only mark it as changed; changed messages are indexed again before the next search, so streaming a long reply
+    does not index its text again for every piece.
+
+    Messages already saved in a chat's `ConversationStore` are indexed with `index_store`, which may be called from a background
+    thread, so a large chat can be indexed without blocking the UI. A chat's messages stay indexed when its history is removed
+    (e.g. when the chat is closed to save memory); the text of its hits is then read through `open_history`.
+
+    Attributes:
+        MAX_HITS (int): The default maximum number of hits returned by a search
+    """
+
+    MAX_HITS = 100
+
+    def __init__(self, open_history = None):
+        """Set up an empty index
+
+        Args:
+            open_history: Called with the name of a chat that has no registered history, to get its history (e.g. by opening it)
+                so the text of its hits can be read; by default, hits in such chats are not returned
+        """
+        self._open_history = open_history
+        self._lock = threading.Lock()
+        self._histories = {}
+        self._listeners = {}
+        self._postings = {}
+        self._keys = []
+        self._roles = array('B')
+        self._role_names = []
+        self._current = {}
+        self._changed = set()
+
+    def __len__(self) -> int:
+        return len(self._current)
+
+    def memory_size(self) -> int:
+        """An estimate of the memory used by the index: the postings of each word, and the key of each document
+
+        Returns:
+            int: The estimated size, in bytes
+        """
+        with self._lock:
+            postings = sum(sys.getsizeof(word) + sys.getsizeof(documents) for word, documents in self._postings.items())
+            documents = sum(sys.getsizeof(key) for key in self._keys) + sys.getsizeof(self._roles)
+            return postings + documents + sys.getsizeof(self._postings) + sys.getsizeof(self._keys) + sys.getsizeof(self._current)
+
+    def add_chat(self, chat : str, history : ChatHistory, follow : bool = False):
+        """Register the history of a chat, from which the text of its hits are read
+
+        Args:
+            chat (str): The name of the chat
+            history (ChatHistory): The history of the chat
+            follow (bool): Whether to index messages as they are added to (or changed in) the history
+        """
+        with self._lock:
+            self._histories[chat] = history
+        if follow:
+            listener = self._listeners[chat] = _ChatListener(self, chat, history)
+            history.add_listener(listener)
+
+    def remove_chat(self, chat : str):
+        """Stop following the history of a chat, e.g. because it has been closed; its messages stay in the index
+
+        Args:
+            chat (str): The name of the chat
+        """
+        self._index_changed()
+        with self._lock:
+            history = self._histories.pop(chat, None)
+        listener = self._listeners.pop(chat, None)
+        if history is not None and listener is not None:
+            history.remove_listener(listener)
+
+    def index_store(self, chat : str, store : ConversationStore, batch_size : int = 1000) -> int:
+        """Index the messages saved in the store of a chat; messages that are already indexed are skipped
+
+        This method may be called from a background thread. The index is only locked while each batch of messages is added to it,
+        so searches can run between batches.
+
+        Args:
+            chat (str): The name of the chat
+            store (ConversationStore): The store of the chat
+            batch_size (int): The number of messages read from the store at a time
+
+        Returns:
+            int: The number of messages indexed
+        """
+        count = 0
+        end = len(store)
+        for start in range(0, end, batch_size):
+            batch = [(index, role, set(tokenize(text)))
+                     for index, (role, text) in enumerate(store.read(start, min(start + batch_size, end)), start)]
+            with self._lock:
+                for index, role, words in batch:
+                    if (chat, index) not in self._current:
+                        self._add_document(chat, index, role, words)
+                        count += 1
+        return count
+
+    def index_message(self, chat : str, index : int, role : str, text : str):
+        """Index a message, replacing any earlier version of it
+
+        Args:
+            chat (str): The name of the chat holding the message
+            index (int): The index of the message in the history of the chat
+            role (str): The sender role of the message
+            text (str): The text of the message
+        """
+        words = set(tokenize(text))
+        with self._lock:
+            self._changed.discard((chat, index))
+            self._add_document(chat, index, role, words)
+
+    def mark_changed(self, chat : str, index : int):
+        """Mark a message as changed, so it is indexed again before the next search
+
+        Args:
+            chat (str): The name of the chat holding the message
+            index (int): The index of the message in the history of the chat
+        """
+        with self._lock:
+            self._changed.add((chat, index))
+
+    def search(self, query : str, role : str = None, limit : int = MAX_HITS) -> list:
+        """Find the messages containing every word of a query
+
+        Words in double quotes must appear together as a phrase, e.g. `"prompt cache" server`. Words are matched whole, and case
+        is ignored.
+
+        Args:
+            query (str): The words (and phrases) to search for
+            role (str): The sender role of the messages to find; by default, messages of any role are found
+            limit (int): The maximum number of hits to return
+
+        Returns:
+            list[SearchHit]: The messages found, most recently indexed first
+        """
+        self._index_changed()
+
+        phrases = [tokenize(phrase) for phrase in _PHRASE.findall(query)]
+        phrases = [re.compile(r"\b" + r"\W+".join(map(re.escape, words)) + r"\b", re.IGNORECASE)
+                   for words in phrases if len(words) > 1]
+        words = set(tokenize(query))
+        if not words:
+            return []
+
+        with self._lock:
+            postings = [self._postings.get(word) for word in words]
+            if None in postings:
+                return []
+            if role is not None and role not in self._role_names:
+                return []
+            role_number = self._role_names.index(role) if role is not None else None
+
+            postings.sort(key=len)
+            rarest, others = postings[0], postings[1:]
+            candidates = []
+            for document in reversed(rarest):
+                if role_number is not None and self._roles[document] != role_number:
+                    continue
+                key = self._keys[document]
+                if self._current.get(key) != document or not all(_contains(other, document) for other in others):
+                    continue
+                candidates.append(key)
+                if not phrases and len(candidates) >= limit:
+                    break
+            histories = dict(self._histories)
+
+        # The text of the candidates is read outside the lock, as it may have to be read from a store
+        hits = []
+        for chat, index in candidates:
+            history = histories.get(chat)
+            if history is None and self._open_history is not None:
+                history = histories[chat] = self._open_history(chat)
+            if history is None:
+                continue
+            message = history[index]
+            if all(phrase.search(message.text) for phrase in phrases):
+                hits.append(SearchHit(chat, index, message.role, message.text))
+                if len(hits) >= limit:
+                    break
+        return hits
+
+    def _index_changed(self):
+        with self._lock:
+            changed, self._changed = self._changed, set()
+            histories = dict(self._histories)
+
+        for chat, index in changed:
+            history = histories.get(chat)
+            if history is not None and index < len(history):
+                message = history[index]
+                self.index_message(chat, index, message.role, message.text)
+
+    def _add_document(self, chat : str, index : int, role : str, words : set):
+        if role not in self._role_names:
+            self._role_names.append(role)
+
+        document = len(self._keys)
+        self._keys.append((chat, index))
+        self._roles.append(self._role_names.index(role))
+        self._current[(chat, index)] = document
+        for word in words:
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = array('I')
+            postings.append(document)
+
+
+def _contains(postings : array, document : int) -> bool:
+    position = bisect_left(postings, document)
+    return position < len(postings) and postings[position] == document
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+from enchat.chat_session import ChatSession
+
+
+class SpeculativePrefill:
+    """Warms the server's prompt cache with the draft of the next user message while it is being typed
+
+    Each change to the draft restarts a short timer (a debounce), so nothing is sent while the user is typing steadily; when they
+    pause, the draft is prefilled through `ChatSession.prefill`. The requests are rate-limited, so fast typists do not flood the
+    server:
+
+    * At most one prefill is in flight at a time; a draft that changes while one is in flight is prefilled when it finishes
+    * Prefills start no more often than once every `min_interval` seconds
+    * A draft that has already been prefilled, or has grown by fewer than `min_growth` characters since, is not sent again
+
+    When the message is sent, `cancel` stops any prefill in flight (closing its connection, so the server stops evaluating it),
+    so the reply does not queue behind it.
+
+    Attributes:
+        delay (float): The pause in typing, in seconds, after which the draft is prefilled
+        min_interval (float): The shortest time, in seconds, between the starts of two prefills
+        min_growth (int): The number of characters a draft must grow by to be prefilled again
+        requests (int): The number of prefills started
+        DELAY (float): The default delay
+        MIN_INTERVAL (float): The default minimum interval
+        MIN_GROWTH (int): The default minimum growth
+    """
+
+    DELAY = 0.5
+
+    MIN_INTERVAL = 2.0
+
+    MIN_GROWTH = 16
+
+    def __init__(self, delay : float = DELAY, min_interval : float = MIN_INTERVAL, min_growth : int = MIN_GROWTH):
+        """Set up the prefill, with nothing scheduled
+
+        Args:
+            delay (float): The pause in typing, in seconds, after which the draft is prefilled
+            min_interval (float): The shortest time, in seconds, between the starts of two prefills
+            min_growth (int): The number of characters a draft must grow by to be prefilled again
+        """
+        self.delay = delay
+        self.min_interval = min_interval
+        self.min_growth = min_growth
+        self.requests = 0
+        self._timer = None
+        self._task = None
+        self._pending = None
+        self._last = (None, "")
+        self._last_start = -min_interval
+
+    def draft_changed(self, session : ChatSession, draft : str):
+        """Schedule a prefill of a draft, after the debounce delay; called each time the draft changes
+
+        Args:
+            session (ChatSession): The session of the chat the draft is for
+            draft (str): The text of the draft
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._pending = (session, draft) if draft.strip() else None
+        if self._pending is not None and self._task is None:
+            self._schedule()
+
+    def cancel(self):
+        """Cancel the scheduled prefill, and stop any prefill in flight"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._pending = None
+        self._last = (None, "")
+        if self._task is not None:
+            self._task.cancel()
+
+    def _schedule(self):
+        delay = max(self.delay, self._last_start + self.min_interval - time.monotonic())
+        self._timer = asyncio.get_running_loop().call_later(delay, self._start)
+
+    def _start(self):
+        self._timer = None
+        (session, draft), self._pending = self._pending, None
+        last_session, last_draft = self._last
+        if session is last_session and draft.startswith(last_draft) and len(draft) - len(last_draft) < self.min_growth:
+            return
+
+        self.requests += 1
+        self._last = (session, draft)
+        self._last_start = time.monotonic()
+        self._task = asyncio.ensure_future(session.prefill(draft))
+        self._task.add_done_callback(self._finished)
+
+    def _finished(self, task : asyncio.Task):
+        self._task = None
+        if task.cancelled():
+            logging.debug("prefill of the draft cancelled")
+            self._last = (None, "")
+        elif not task.result():
+            self._last = (None, "")
+        if self._pending is not None and self._timer is None:
+            self._schedule()
@@ -0,0 +1,59 @@
+import logging
+import time
+
+
+class StartupTimer:
+    """Measures the phases of the application's start, up to the point where the main window is interactive
+
+    Each call to `mark` records the time since the previous mark as the duration of the named phase, so the report shows where the
+    start-up time goes (e.g. importing modules, building the main window, or waiting for the first turn of the event loop).
+
+    Attributes:
+        started (float): The `time.perf_counter` value at which timing started
+        phases (list[tuple[str, float]]): The name and duration (in seconds) of each phase, in order
+    """
+
+    def __init__(self, started : float = None):
+        """Start timing
+
+        Args:
+            started (float): The `time.perf_counter` value at which the application started, if it was taken before the timer
+                could be created (e.g. before importing the application's modules); defaults to now
+        """
+        self.started = started if started is not None else time.perf_counter()
+        self.phases = []
+        self._last = self.started
+
+    def mark(self, phase : str):
+        """Record the end of a phase
+
+        Args:
+            phase (str): The name of the phase that has just finished
+        """
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    @property
+    def total(self) -> float:
+        """The time from the start of timing to the last mark, in seconds
+
+        Returns:
+            float: The total time
+        """
+        return self._last - self.started
+
+    def report(self) -> dict:
+        """The measured start-up time
+
+        Returns:
+            dict: The duration of each phase and the total, in milliseconds
+        """
+        report = {phase: round(seconds * 1000, 1) for phase, seconds in self.phases}
+        report['total'] = round(self.total * 1000, 1)
+        return report
+
+    def log(self):
+        """Log the report"""
+        phases = ", ".join(f"{phase} {seconds * 1000:.1f}ms" for phase, seconds in self.phases)
+        logging.info(f"interactive {self.total * 1000:.1f}ms after start ({phases})")
@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import os
+import random
+import time
+from typing import AsyncIterator
+
+from enchat.completion_backend import CompletionBackend
+from enchat.local_backend import completion_result
+
+
+class StubEngine:
+    """A deterministic stand-in for a model, which generates the same reply to the same prompt, for tests
+
+    The engine behaves as the `MockServer` does, without a server: each word of the text stands in for a token, the reply is made
+    of words of the prompt, and embeddings are pseudo-random unit vectors determined by the text. As with a model, only the part
+    of a prompt after the prefix it shares with the previous prompt in the same slot is counted as evaluated. A request is
+    evaluated in the slot given by its `id_slot`, or the first slot if it does not give one.
+
+    It has the methods of a `LlamaEngine`, so it can be run in-process (by a `StubBackend`), or in a worker process (by a
+    `LocalBackend`).
+
+    Attributes:
+        model_path (str): The model reported by the engine
+        n_ctx (int): The context size reported by the engine
+        default_n_predict (int): The number of tokens generated when a request does not limit them
+        embedding_size (int): The number of dimensions of each embedding
+        slots (int): The number of slots, each holding the last prompt evaluated in it
+    """
+
+    def __init__(self, model_path : str = None, n_ctx : int = 4096, default_n_predict : int = 64, embedding_size : int = 64,
+                 slots : int = 1):
+        """Set up the engine
+
+        Args:
+            model_path (str): The model reported by the engine; accepted so the engine can be created by a `LocalBackend`
+            n_ctx (int): The context size reported by the engine
+            default_n_predict (int): The number of tokens generated when a request does not limit them
+            embedding_size (int): The number of dimensions of each embedding
+            slots (int): The number of slots, each holding the last prompt evaluated in it
+        """
+        assert(slots > 0)
+
+        self.model_path = model_path if model_path is not None else "stub"
+        self.n_ctx = n_ctx
+        self.default_n_predict = default_n_predict
+        self.embedding_size = embedding_size
+        self.slots = slots
+        self._evaluated = [[] for _ in range(slots)]
+
+    def tokenize(self, text : str) -> list:
+        return [int.from_bytes(hashlib.blake2s(word.encode('utf-8'), digest_size=2).digest(), 'little') for word in text.split()]
+
+    def embed(self, text : str) -> list:
+        generator = random.Random(hashlib.sha256(text.encode('utf-8')).digest())
+        vector = [generator.gauss(0, 1) for _ in range(self.embedding_size)]
+        norm = sum(value * value for value in vector) ** 0.5
+        return [value / norm for value in vector]
+
+    def props(self) -> dict:
+        return {'default_generation_settings': {'n_ctx': self.n_ctx}, 'model_path': self.model_path, 'total_slots': self.slots}
+
+    def complete(self, prompt : str, parameters : dict):
+        """Generate a completion of a prompt
+
+        Args:
+            prompt (str): The entire prompt to complete
+            parameters (dict): Parameters in the form of the completion API; only `n_predict` and `id_slot` are used
+
+        Returns:
+            Generator[str, None, dict]: Yields each word of the reply, and returns the final event
+        """
+        started = time.perf_counter()
+        tokens = self.tokenize(prompt)
+        slot = int(parameters.get('id_slot', -1))
+        slot = slot if 0 <= slot < self.slots else 0
+        cached = len(os.path.commonprefix([self._evaluated[slot], tokens]))
+        self._evaluated[slot] = tokens
+        n_predict = int(parameters.get('n_predict', -1))
+        n_predict = n_predict if n_predict >= 0 else self.default_n_predict
+
+        words = prompt.split()[-16:] or ["lorem"]
+        for index in range(n_predict):
+            yield " " + words[(len(prompt) + index) % len(words)]
+        return completion_result(len(tokens), cached, n_predict, time.perf_counter() - started, slot)
+
+
+class StubBackend(CompletionBackend):
+    """Generates deterministic replies in-process with a `StubEngine`, without a model or a server, for tests
+
+    Attributes:
+        engine (StubEngine): The engine generating the replies
+        token_delay (float): The time, in seconds, before each piece of text of a reply
+    """
+
+    name = "stub"
+
+    def __init__(self, engine : StubEngine = None, token_delay : float = 0.0):
+        """Set up the backend
+
+        Args:
+            engine (StubEngine): The engine generating the replies; by default, an engine with the default settings
+            token_delay (float): The time, in seconds, before each piece of text of a reply
+        """
+        self.engine = engine if engine is not None else StubEngine()
+        self.token_delay = token_delay
+
+    async def tokenize(self, text : str) -> list:
+        return self.engine.tokenize(text)
+
+    async def embed(self, text : str) -> list:
+        return self.engine.embed(text)
+
+    async def props(self) -> dict:
+        return self.engine.props()
+
+    async def _stream(self, body : dict, preferred : str, result : dict) -> AsyncIterator[str]:
+        pieces = self.engine.complete(body['prompt'], body)
+        try:
+            while True:
+                # Yields to the event loop between pieces, as a real backend would
+                await asyncio.sleep(self.token_delay)
+                yield next(pieces)
+        except StopIteration as stop:
+            result.update(stop.value, endpoint=StubBackend.name)
+        finally:
+            pieces.close()
@@ -1,42 +1,157 @@
-from toga import Box, Label, TextInput, Widget, Button
-from toga.validators import BooleanValidator
+from toga import Box, Label, Selection, TextInput, Widget, Button
+from toga.validators import BooleanValidator, Number
 from toga.style.pack import COLUMN, ROW
-from urllib.parse import urlparse
+from enchat.validators import FloatRange, IntegerRange
+from enchat.endpoint_pool import format_endpoints, parse_endpoints
 
 class SystemConfigurationBox(Box):
     """A box containing control for configuring the system
 
     Attributes:
-        self._server_address_txi (TextInput): Text Input control for editing the server address
+        self._backend_sel (Selection): Selection of the backend that generates the replies
+        self._model_path_txi (TextInput): Text Input control for the model file run by the local backend
+        self._servers_txi (TextInput): Text Input control for editing the server endpoints, as a comma-separated list of addresses,
+            each optionally followed by a weight
+        self._pool_size_txi (TextInput): Text Input control for the maximum number of connections to each server
+        self._connect_timeout_txi (TextInput): Text Input control for the connection timeout, in seconds
+        self._read_timeout_txi (TextInput): Text Input control for the read timeout, in seconds
+        self._memory_cap_txi (TextInput): Text Input control for the memory of open chats above which idle chats are closed, in
+            megabytes
+        self._frame_rate_txi (TextInput): Text Input control for the maximum number of times per second the display of messages is
+            updated
+        self._memory_budget_txi (TextInput): Text Input control for the memory of the application above which old history is
+            offloaded, in megabytes
+        self._summary_threshold_txi (TextInput): Text Input control for the most tokens of history sent with a prompt, before older
+            messages are summarised (0 for no summaries)
+        LABEL_WIDTH (int): Consistent width for all labels in a column of parameters
+        BACKENDS (dict[str, str]): The description of each backend, by its name
     """
 
-    class ServerAddressValidator(BooleanValidator):
-        """Validator for the server address
+    LABEL_WIDTH = 120
 
-        This validator checks that the given scheme is http or https.
+    BACKENDS = {'http': "HTTP servers", 'local': "Local model", 'stub': "Stub (testing)"}
 
-        TODO Tests for this validator
-        """
+    class EndpointsValidator(BooleanValidator):
+        """Validator for the list of server endpoints
 
-        def is_valid(self, input_string : str) -> bool:            
-            result = urlparse(input_string, scheme='http')
+        This validator checks that the input is a comma-separated list of http(s) addresses, each optionally followed by a positive
+        weight, e.g. "http://gpu1:8080 2, http://gpu2:8080".
+        """
 
-            if result.scheme not in ['http', 'https']:
-                print(f"*** scheme: {result.scheme}")
+        def is_valid(self, input_string : str) -> bool:
+            try:
+                parse_endpoints(input_string)
+            except ValueError:
                 return False
-            
+
             return True
 
-    
-    def __init__(self, server_address : str, on_ok : (Widget), on_cancel : (Widget)):
-        server_address_lb = Label("Server address")
-        self._server_address_txi = TextInput(value=server_address,
-                                             validators=[SystemConfigurationBox.ServerAddressValidator(
-                                                 error_message="must be a valid http(s) URL")])
-        self._server_address_txi.style.width = 200
+    def __init__(self, endpoints : list, on_ok : (Widget), on_cancel : (Widget), pool_size : int = 4,
+                 connect_timeout : float = 5.0, read_timeout : float = 60.0, memory_cap : float = 64.0, frame_rate : float = 30.0,
+                 backend : str = "http", model_path : str = "", memory_budget : float = 1024.0,
+                 summary_threshold : int = 2048):
+        # Backend, and the model file for the local backend
+        backend_lb = Label("Backend")
+        backend_lb.style.width = SystemConfigurationBox.LABEL_WIDTH
+        self._backend_sel = Selection(items=list(SystemConfigurationBox.BACKENDS.values()),
+                                      value=SystemConfigurationBox.BACKENDS[backend])
+
+        backend_bx = Box(children=[backend_lb, self._backend_sel])
+        backend_bx.style.direction = ROW
+
+        model_path_lb = Label("Model file")
+        model_path_lb.style.width = SystemConfigurationBox.LABEL_WIDTH
+        self._model_path_txi = TextInput(value=model_path, placeholder="GGUF file, for the local model")
+        self._model_path_txi.style.width = 400
+
+        model_path_bx = Box(children=[model_path_lb, self._model_path_txi])
+        model_path_bx.style.direction = ROW
+
+        servers_lb = Label("Servers")
+        servers_lb.style.width = SystemConfigurationBox.LABEL_WIDTH
+        self._servers_txi = TextInput(value=format_endpoints(endpoints),
+                                      validators=[SystemConfigurationBox.EndpointsValidator(
+                                          error_message="must be a comma-separated list of http(s) URLs, each with an optional weight")])
+        self._servers_txi.style.width = 400
+
+        servers_bx = Box(children=[servers_lb, self._servers_txi])
+        servers_bx.style.direction = ROW
+
+        # Connection pool size
+        pool_size_lb = Label("Connections")
+        pool_size_lb.style.width = SystemConfigurationBox.LABEL_WIDTH
+        self._pool_size_txi = TextInput(
+            value=pool_size,
+            validators=[Number(error_message="must be a number", allow_empty=False),
+                        IntegerRange(error_message="must be an integer greater than 0", allow_empty=False, min=1)])
+
+        pool_size_bx = Box(children=[pool_size_lb, self._pool_size_txi])
+        pool_size_bx.style.direction = ROW
+
+        # Timeouts
+        connect_timeout_lb = Label("Connect timeout (s)")
+        connect_timeout_lb.style.width = SystemConfigurationBox.LABEL_WIDTH
+        self._connect_timeout_txi = TextInput(
+            value=connect_timeout,
+            validators=[Number(error_message="must be a number", allow_empty=False),
+                        FloatRange(error_message="must be greater than 0", allow_empty=False, min=0.001)])
+
+        connect_timeout_bx = Box(children=[connect_timeout_lb, self._connect_timeout_txi])
+        connect_timeout_bx.style.direction = ROW
 
-        server_address_bx = Box(children=[server_address_lb, self._server_address_txi])
-        server_address_bx.style.direction = ROW
+        read_timeout_lb = Label("Read timeout (s)")
+        read_timeout_lb.style.width = SystemConfigurationBox.LABEL_WIDTH
+        self._read_timeout_txi = TextInput(
+            value=read_timeout,
+            validators=[Number(error_message="must be a number", allow_empty=False),
+                        FloatRange(error_message="must be greater than 0", allow_empty=False, min=0.001)])
+
+        read_timeout_bx = Box(children=[read_timeout_lb, self._read_timeout_txi])
+        read_timeout_bx.style.direction = ROW
+
+        # Memory cap for open chats
+        memory_cap_lb = Label("Chat memory (MB)")
+        memory_cap_lb.style.width = SystemConfigurationBox.LABEL_WIDTH
+        self._memory_cap_txi = TextInput(
+            value=memory_cap,
+            validators=[Number(error_message="must be a number", allow_empty=False),
+                        FloatRange(error_message="must be at least 1", allow_empty=False, min=1)])
+
+        memory_cap_bx = Box(children=[memory_cap_lb, self._memory_cap_txi])
+        memory_cap_bx.style.direction = ROW
+
+        # Frame rate of the display of streamed messages
+        frame_rate_lb = Label("Frame rate (Hz)")
+        frame_rate_lb.style.width = SystemConfigurationBox.LABEL_WIDTH
+        self._frame_rate_txi = TextInput(
+            value=frame_rate,
+            validators=[Number(error_message="must be a number", allow_empty=False),
+                        FloatRange(error_message="must be from 1 to 240", allow_empty=False, min=1, max=240)])
+
+        frame_rate_bx = Box(children=[frame_rate_lb, self._frame_rate_txi])
+        frame_rate_bx.style.direction = ROW
+
+        # Memory budget of the application
+        memory_budget_lb = Label("Memory budget (MB)")
+        memory_budget_lb.style.width = SystemConfigurationBox.LABEL_WIDTH
+        self._memory_budget_txi = TextInput(
+            value=memory_budget,
+            validators=[Number(error_message="must be a number", allow_empty=False),
+                        FloatRange(error_message="must be at least 16", allow_empty=False, min=16)])
+
+        memory_budget_bx = Box(children=[memory_budget_lb, self._memory_budget_txi])
+        memory_budget_bx.style.direction = ROW
+
+        # Threshold for summarising old messages
+        summary_threshold_lb = Label("Summarise after (tokens)")
+        summary_threshold_lb.style.width = SystemConfigurationBox.LABEL_WIDTH
+        self._summary_threshold_txi = TextInput(
+            value=summary_threshold,
+            validators=[Number(error_message="must be a number", allow_empty=False),
+                        IntegerRange(error_message="must be an integer, 0 or greater", allow_empty=False, min=0)])
+
+        summary_threshold_bx = Box(children=[summary_threshold_lb, self._summary_threshold_txi])
+        summary_threshold_bx.style.direction = ROW
 
         # OK and cancel buttons
         ok_btn = Button(text="OK", on_press=on_ok)
@@ -44,18 +159,188 @@ class SystemConfigurationBox(Box):
         button_bx = Box(children=[ok_btn, cancel_btn])
         button_bx.style.direction=(ROW)
 
-        super(SystemConfigurationBox, self).__init__(children=[server_address_bx, button_bx])
+        super(SystemConfigurationBox, self).__init__(children=[backend_bx, model_path_bx, servers_bx, pool_size_bx,
+                                                                     connect_timeout_bx, read_timeout_bx, memory_cap_bx,
+                                                                     frame_rate_bx, memory_budget_bx, summary_threshold_bx,
+                                                                     button_bx])
         self.style.direction=COLUMN
 
+    @property
+    def backend(self) -> str:
+        """The name of the backend that generates the replies (see `BACKENDS`), default="http"
+
+        Returns:
+            str: The name of the backend
+        """
+        return next(name for name, description in SystemConfigurationBox.BACKENDS.items()
+                    if description == self._backend_sel.value)
+
+    @backend.setter
+    def backend(self, value : str):
+        self._backend_sel.value = SystemConfigurationBox.BACKENDS[value]
+
+    @property
+    def model_path(self) -> str:
+        """The model file run by the local backend
+
+        Returns:
+            str: The path of the model file
+        """
+        return self._model_path_txi.value.strip()
+
+    @model_path.setter
+    def model_path(self, value : str):
+        self._model_path_txi.value = value
+
+    @property
+    def endpoints(self) -> list:
+        """The server endpoints, each with its weight (the relative share of the load it should handle)
+
+        Returns:
+            list[tuple[str, float]]: The (address, weight) pairs of the servers
+
+        Raises:
+            ValueError: The list of servers is not valid
+        """
+        return parse_endpoints(self._servers_txi.value)
+
+    @endpoints.setter
+    def endpoints(self, value : list):
+        self._servers_txi.value = format_endpoints(value)
+
     @property
     def server_address(self) -> str:
-        """The address of the server, including optional port number
+        """The address of the first server, including optional port number
+
+        Setting the address replaces all of the endpoints with the single server.
 
         Returns:
             str: The server address
         """
-        return self._server_address_txi.value
-    
+        return self.endpoints[0][0]
+
     @server_address.setter
     def server_address(self, value : str):
-        self._server_address_txi.value = value
+        self.endpoints = [(value, 1.0)]
+
+    @property
+    def pool_size(self) -> int:
+        """The maximum number of connections open to each server at once, default=4
+
+        Returns:
+            int [1,]: The connection pool size
+
+        Raises:
+            ValueError: The value fails its validators
+        """
+        return SystemConfigurationBox._parse("Connections", self._pool_size_txi, int)
+
+    @pool_size.setter
+    def pool_size(self, value : int):
+        self._pool_size_txi.value = value
+
+    @property
+    def connect_timeout(self) -> float:
+        """The maximum number of seconds to wait for a new connection to the server, default=5
+
+        Returns:
+            float: The connection timeout, in seconds
+
+        Raises:
+            ValueError: The value fails its validators
+        """
+        return SystemConfigurationBox._parse("Connect timeout", self._connect_timeout_txi, float)
+
+    @connect_timeout.setter
+    def connect_timeout(self, value : float):
+        self._connect_timeout_txi.value = value
+
+    @property
+    def read_timeout(self) -> float:
+        """The maximum number of seconds to wait for any single read from the server, default=60
+
+        Returns:
+            float: The read timeout, in seconds
+
+        Raises:
+            ValueError: The value fails its validators
+        """
+        return SystemConfigurationBox._parse("Read timeout", self._read_timeout_txi, float)
+
+    @read_timeout.setter
+    def read_timeout(self, value : float):
+        self._read_timeout_txi.value = value
+
+    @property
+    def memory_cap(self) -> float:
+        """The memory used by open chats above which idle chats are closed, in megabytes, default=64
+
+        Returns:
+            float: The memory cap, in megabytes
+
+        Raises:
+            ValueError: The value fails its validators
+        """
+        return SystemConfigurationBox._parse("Chat memory", self._memory_cap_txi, float)
+
+    @memory_cap.setter
+    def memory_cap(self, value : float):
+        self._memory_cap_txi.value = value
+
+    @property
+    def frame_rate(self) -> float:
+        """The maximum number of times per second the display of messages is updated (e.g. as replies are streamed), default=30
+
+        Returns:
+            float: The frame rate, in Hz
+
+        Raises:
+            ValueError: The value fails its validators
+        """
+        return SystemConfigurationBox._parse("Frame rate", self._frame_rate_txi, float)
+
+    @frame_rate.setter
+    def frame_rate(self, value : float):
+        self._frame_rate_txi.value = value
+
+    @property
+    def memory_budget(self) -> float:
+        """The memory of the application above which old history is offloaded, in megabytes, default=1024
+
+        Returns:
+            float: The memory budget, in megabytes
+
+        Raises:
+            ValueError: The value fails its validators
+        """
+        return SystemConfigurationBox._parse("Memory budget", self._memory_budget_txi, float)
+
+    @memory_budget.setter
+    def memory_budget(self, value : float):
+        self._memory_budget_txi.value = value
+
+    @property
+    def summary_threshold(self) -> int:
+        """The most tokens of history sent with a prompt, before older messages are summarised, or 0 for no summaries, default=2048
+
+        Returns:
+            int [0,]: The threshold, in tokens
+
+        Raises:
+            ValueError: The value fails its validators
+        """
+        return SystemConfigurationBox._parse("Summary threshold", self._summary_threshold_txi, int)
+
+    @summary_threshold.setter
+    def summary_threshold(self, value : int):
+        self._summary_threshold_txi.value = value
+
+    @staticmethod
+    def _parse(name : str, text_input : TextInput, convert):
+        # Checked against the input's validators, as the chat parameters are (see `parse_parameter`)
+        for validator in text_input.validators:
+            error_message = validator(text_input.value)
+            if error_message is not None:
+                raise ValueError(f"{name} {error_message}")
+
+        return convert(float(text_input.value))
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import time
+
+
+class UpdateScheduler:
+    """Merges updates to the UI and applies them at most once per frame, on the event loop
+
+    Streaming a reply changes its message for every piece of text the server sends, and each change to a widget causes a native
+    relayout. Rather than applying each change as it arrives, views `schedule` a callback under a key (e.g. the message it
+    updates); a callback scheduled again before the next flush replaces the earlier one, so each message is redrawn once per frame
+    with its latest text, however many pieces of text arrived in between. The cost of the UI is therefore bounded by the frame
+    rate, rather than by the rate at which the servers generate tokens, however many replies are being streamed at once.
+
+    The first update after an idle period is flushed on the next turn of the event loop, so the first piece of a reply is shown
+    without delay; further updates wait until a frame interval has passed since the last flush. Callbacks scheduled as `final`
+    run after every other callback of the flush, e.g. to scroll to the end once the messages have been updated. Outside the event
+    loop (e.g. while the UI is being built), updates are applied straight away.
+
+    Attributes:
+        rate (float): The maximum number of flushes per second
+        flushes (int): The number of flushes so far
+        updates (int): The number of updates applied so far (after merging)
+        DEFAULT_RATE (float): The default rate
+    """
+
+    DEFAULT_RATE = 30.0
+
+    def __init__(self, rate : float = DEFAULT_RATE):
+        """Set up the scheduler, with nothing scheduled
+
+        Args:
+            rate (float): The maximum number of flushes per second
+        """
+        assert(rate > 0)
+
+        self.rate = rate
+        self.flushes = 0
+        self.updates = 0
+        self._pending = {}
+        self._final = {}
+        self._handle = None
+        self._last_flush = -1.0 / rate
+
+    def schedule(self, key, callback, final : bool = False):
+        """Schedule a callback for the next flush, replacing any callback scheduled under the same key
+
+        Args:
+            key (Hashable): Identifies what the callback updates
+            callback: Called with no arguments at the next flush
+            final (bool): Whether to call the callback after every other callback of the flush
+        """
+        (self._final if final else self._pending)[key] = callback
+        if self._handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.flush()
+                return
+            delay = max(0.0, self._last_flush + 1.0 / self.rate - time.monotonic())
+            self._handle = loop.call_later(delay, self.flush)
+
+    def flush(self):
+        """Apply every scheduled update now"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._last_flush = time.monotonic()
+
+        # Updates scheduled by the callbacks themselves wait for the next flush
+        pending, self._pending = self._pending, {}
+        final, self._final = self._final, {}
+        for callback in list(pending.values()) + list(final.values()):
+            try:
+                callback()
+            except Exception:
+                logging.exception("UI update failed")
+        self.flushes += 1
+        self.updates += len(pending) + len(final)
+
+    def cancel(self):
+        """Discard every scheduled update"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._pending.clear()
+        self._final.clear()
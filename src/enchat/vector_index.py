@@ -0,0 +1,168 @@
+import logging
+import struct
+from pathlib import Path
+import numpy as np
+
+
+class VectorIndex:
+    """A persistent array of unit vectors (e.g. the embeddings of the messages of a chat), searched by cosine similarity
+
+    The vectors are held in a single file, memory-mapped as a NumPy array, so opening the index reads nothing but its header,
+    and only the pages of vectors that are searched are brought into memory (by the operating system, which can drop them again
+    under memory pressure). The file is a 16 byte header (the magic number, the version, the number of dimensions and the number
+    of vectors, as little-endian 32-bit integers) followed by the vectors, as rows of 32-bit floats. Space for vectors is
+    allocated in growing blocks, so adding a vector rarely resizes the file. The number of vectors in the header is only written
+    when the index is flushed (or closed), so vectors added since then are not seen when the file is opened again.
+
+    Vectors are normalised when they are stored, so the cosine similarity of a query to every vector is a single matrix-vector
+    product.
+
+    Attributes:
+        path (Path): The file holding the index
+        dimensions (int): The number of dimensions of the vectors, or 0 if there are none yet
+        MAGIC (bytes): The magic number at the start of the file
+        VERSION (int): The version of the file format
+        INITIAL_CAPACITY (int): The number of vectors space is first allocated for
+    """
+
+    MAGIC = b"ENCV"
+
+    VERSION = 1
+
+    INITIAL_CAPACITY = 256
+
+    _HEADER = struct.Struct("<4sIII")
+
+    def __init__(self, path):
+        """Open the index, creating it if it does not exist; an unreadable index is replaced with an empty one
+
+        Args:
+            path (str | Path): The file holding the index
+        """
+        self.path = Path(path)
+        self.dimensions = 0
+        self._count = 0
+        self._vectors = None
+
+        if self.path.is_file():
+            with open(self.path, "rb") as file:
+                header = file.read(VectorIndex._HEADER.size)
+            try:
+                magic, version, dimensions, count = VectorIndex._HEADER.unpack(header)
+            except struct.error:
+                magic, version, dimensions, count = None, None, 0, 0
+            if magic != VectorIndex.MAGIC or version != VectorIndex.VERSION:
+                logging.warning(f"{self.path} is not a vector index; it will be replaced")
+            elif dimensions > 0:
+                self.dimensions = dimensions
+                self._count = count
+                self._map()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def set(self, index : int, vector):
+        """Store a vector, replacing the vector at the index, or adding a vector if the index is the number of vectors
+
+        If the vector has a different number of dimensions from the vectors in the index (e.g. because the embedding model has
+        changed), the index is cleared first, and must then be filled again from index 0.
+
+        Args:
+            index (int): The index of the vector
+            vector (Sequence[float]): The vector
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        if len(vector) != self.dimensions:
+            if self.dimensions:
+                logging.info(f"vectors changed from {self.dimensions} to {len(vector)} dimensions; clearing {self.path}")
+            self.clear(len(vector))
+            if index != 0:
+                return
+        assert(0 <= index <= self._count)
+
+        if index == len(self._vectors):
+            self._grow(2 * len(self._vectors))
+        norm = np.linalg.norm(vector)
+        self._vectors[index] = vector / norm if norm > 0 else vector
+        if index == self._count:
+            self._count += 1
+
+    def search(self, query, top_k : int, start : int = 0, end : int = None) -> list:
+        """Find the vectors most similar to a query, among a range of the vectors
+
+        Args:
+            query (Sequence[float]): The query vector
+            top_k (int): The maximum number of vectors to return
+            start (int): The index of the first vector to search
+            end (int): The index after the last vector to search; by default, the end of the index
+
+        Returns:
+            list[tuple[int, float]]: The (index, cosine similarity) of the most similar vectors, most similar first
+        """
+        end = self._count if end is None else min(end, self._count)
+        query = np.asarray(query, dtype=np.float32)
+        if start >= end or top_k <= 0 or len(query) != self.dimensions:
+            return []
+
+        norm = np.linalg.norm(query)
+        scores = self._vectors[start:end] @ (query / norm if norm > 0 else query)
+        if top_k < len(scores):
+            best = np.argpartition(scores, -top_k)[-top_k:]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(scores[best])[::-1]]
+        return [(start + int(position), float(scores[position])) for position in best]
+
+    def vector(self, index : int):
+        """A vector of the index
+
+        Args:
+            index (int): The index of the vector
+
+        Returns:
+            numpy.ndarray: The (normalised) vector
+        """
+        assert(0 <= index < self._count)
+        return np.array(self._vectors[index])
+
+    def clear(self, dimensions : int):
+        """Remove every vector, and set the number of dimensions of the vectors to be stored
+
+        Args:
+            dimensions (int): The number of dimensions
+        """
+        self.close()
+        self.dimensions = dimensions
+        self._count = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "wb") as file:
+            file.truncate(VectorIndex._HEADER.size + VectorIndex.INITIAL_CAPACITY * dimensions * 4)
+        self._write_header()
+        self._map()
+
+    def flush(self):
+        """Write any changed vectors, and the number of vectors, to the file"""
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._write_header()
+
+    def close(self):
+        """Write any changed vectors to the file, and unmap it"""
+        self.flush()
+        self._vectors = None
+
+    def _map(self):
+        capacity = max(1, (self.path.stat().st_size - VectorIndex._HEADER.size) // (self.dimensions * 4))
+        self._count = min(self._count, capacity)
+        self._vectors = np.memmap(self.path, dtype=np.float32, mode="r+", offset=VectorIndex._HEADER.size,
+                                  shape=(capacity, self.dimensions))
+
+    def _grow(self, capacity : int):
+        self.close()
+        with open(self.path, "r+b") as file:
+            file.truncate(VectorIndex._HEADER.size + capacity * self.dimensions * 4)
+        self._map()
+
+    def _write_header(self):
+        with open(self.path, "r+b") as file:
+            file.write(VectorIndex._HEADER.pack(VectorIndex.MAGIC, VectorIndex.VERSION, self.dimensions, self._count))
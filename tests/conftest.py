@@ -0,0 +1,57 @@
+import json
+import platform
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+
+def pytest_addoption(parser):
+    parser.addoption("--benchmark", action="store_true", help="run the benchmarks (skipped by default)")
+    parser.addoption("--benchmark-output", default=None,
+                     help="file the benchmark results are written to, as JSON (by default, bench_output.json in the pytest cache)")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: a benchmark, only run with --benchmark")
+    config.benchmark_results = {}
+    config.benchmark_output = None
+
+
+def pytest_collection_modifyitems(config, items):
+    if not config.getoption("--benchmark"):
+        skip = pytest.mark.skip(reason="benchmarks only run with --benchmark")
+        for item in items:
+            if "benchmark" in item.keywords:
+                item.add_marker(skip)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    results = session.config.benchmark_results
+    if results:
+        output = {'python': sys.version.split()[0], 'platform': platform.platform(), 'results': results}
+        session.config.benchmark_output = benchmark_output_path(session.config)
+        with open(session.config.benchmark_output, "w") as file:
+            json.dump(output, file, indent=2, sort_keys=True)
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    if config.benchmark_output is not None:
+        terminalreporter.write_line(f"benchmark results written to {config.benchmark_output}")
+
+
+def benchmark_output_path(config) -> Path:
+    """The file the benchmark results are written to: the `--benchmark-output` option, or bench_output.json in the pytest cache
+    (or the temporary directory, if the cache is disabled)"""
+    path = config.getoption("--benchmark-output")
+    if path is not None:
+        return Path(path)
+    directory = config.cache.mkdir("benchmarks") if getattr(config, 'cache', None) is not None else Path(tempfile.gettempdir())
+    return directory / "bench_output.json"
+
+
+@pytest.fixture
+def benchmark_results(request) -> dict:
+    """The results of the benchmarks in this session, keyed by benchmark name; written to the benchmark output at the end"""
+    return request.config.benchmark_results
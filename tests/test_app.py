@@ -1,3 +1,25 @@
 def test_first():
     """An initial test for the app."""
     assert 1 + 1 == 2
+
+
+def test_configuration_and_search_boxes_are_not_imported_at_startup():
+    import subprocess
+    import sys
+
+    code = ("import sys, enchat.app; "
+            "print(sorted(m for m in sys.modules if m.endswith(('configuration_box', 'search_box', 'candidates_box', 'diagnostics_box', '_backend')) "
+            "and m != 'enchat.completion_backend' or m == 'numpy'))")
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "[]"
+
+
+def test_startup_timer_reports_each_phase():
+    from enchat.startup_timer import StartupTimer
+
+    timer = StartupTimer()
+    timer.mark("build")
+    timer.mark("show")
+    report = timer.report()
+    assert list(report) == ["build", "show", "total"]
+    assert report['total'] >= report['build']
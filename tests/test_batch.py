@@ -0,0 +1,58 @@
+import asyncio
+import io
+import json
+
+import pytest
+
+from enchat.batch import parse_arguments, run_batch
+from tests.test_completion_client import serve_events
+
+
+def run(lines : list, *options) -> tuple:
+
+    async def run():
+        server = await serve_events([{'content': "Hi", 'stop': False}, {'content': "!", 'stop': True, 'tokens_predicted': 2}])
+        async with server:
+            port = server.sockets[0].getsockname()[1]
+            arguments = parse_arguments(["--batch", "-", "--servers", f"http://127.0.0.1:{port}", *options])
+            output = io.StringIO()
+            runner = await run_batch(arguments, io.StringIO("\n".join(lines)), output)
+            return runner, [json.loads(line) for line in output.getvalue().splitlines()]
+
+    return asyncio.run(run())
+
+
+def test_batch_writes_a_result_for_every_job():
+    jobs = [json.dumps({'id': f"job{n}", 'prompt': "Hello"}) for n in range(10)]
+    runner, results = run(jobs, "--concurrency", "3")
+
+    assert (runner.succeeded, runner.failed) == (10, 0)
+    assert sorted(result['id'] for result in results) == sorted(f"job{n}" for n in range(10))
+    assert all(result['reply'] == "Hi!" and result['tokens_predicted'] == 2 for result in results)
+
+
+def test_batch_reports_invalid_jobs_without_stopping():
+    jobs = ["not json", json.dumps({'prompt': "Hi", 'parameters': {'temperature': 2}}), json.dumps({'prompt': "Hi"})]
+    runner, results = run(jobs)
+
+    assert (runner.succeeded, runner.failed) == (1, 2)
+    errors = {result['line']: result.get('error') for result in results}
+    assert errors[2] == "temperature must be in the range [0,1]"
+    assert errors[3] is None
+
+
+def test_batch_reports_malformed_jobs_without_stopping():
+    jobs = [json.dumps({'prompt': "Hi", 'parameters': None}), json.dumps({'messages': ["Hi"]}), json.dumps({'prompt': 7}),
+            json.dumps({'prompt': "Hi", 'system': ["Be brief."]}), json.dumps({'prompt': "Hi"})]
+    runner, results = run(jobs)
+
+    assert (runner.succeeded, runner.failed) == (1, 4)
+    errors = {result['line']: result.get('error') for result in results}
+    assert errors[1] == "parameters must be a JSON object" and errors[2] == "messages must be a list of JSON objects"
+    assert errors[5] is None
+
+
+def test_batch_arguments_are_validated_like_the_ui():
+    with pytest.raises(SystemExit):
+        parse_arguments(["--batch", "-", "--top-k", "-1"])
+    assert parse_arguments(["--batch", "-", "--seed", "7"]).parameters['seed'] == 7
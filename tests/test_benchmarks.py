@@ -0,0 +1,190 @@
+import os
+import statistics
+import time
+
+import pytest
+
+# The benchmarks build real widgets, on the dummy backend so they run without a display
+os.environ.setdefault("TOGA_BACKEND", "toga_dummy")
+
+from toga import Box, ScrollContainer
+from toga.style.pack import COLUMN, Pack
+from toga_dummy.utils import EventLog
+
+from enchat.chat_history import ChatHistory
+from enchat.chat_history_view import ChatHistoryView
+from enchat.markdown_document import MarkdownDocument
+from enchat.message_box import MessageBox
+from enchat.search_index import SearchIndex
+from enchat.system_configuration_box import SystemConfigurationBox
+from enchat.validators import FloatRange, IntegerRange
+
+pytestmark = pytest.mark.benchmark
+
+# The message counts at which the cost of appending a message is reported
+APPEND_CHECKPOINTS = (1, 10, 100, 1000, 10000)
+
+
+def summarise(durations : list) -> dict:
+    """Summarise a list of durations (in nanoseconds) as microseconds per operation"""
+    durations = sorted(durations)
+    return {
+        'count': len(durations),
+        'mean_us': round(statistics.fmean(durations) / 1000, 3),
+        'p50_us': round(durations[len(durations) // 2] / 1000, 3),
+        'p99_us': round(durations[min(len(durations) - 1, len(durations) * 99 // 100)] / 1000, 3),
+    }
+
+
+def time_each(operation, arguments) -> list:
+    """Time a call of the operation for each argument, in nanoseconds"""
+    durations = []
+    for argument in arguments:
+        started = time.perf_counter_ns()
+        operation(argument)
+        durations.append(time.perf_counter_ns() - started)
+    return durations
+
+
+def append_costs(build, append) -> dict:
+    """The cost of appending the Nth message, for each checkpoint N, as the median over the ten appends up to N
+
+    The dummy backend logs every change to a widget, and searches the log to read a value back, so the log is cleared before
+    building the widgets for each checkpoint; otherwise the results would measure the length of the log, not the cost of an append.
+
+    Args:
+        build: Called with a message count, to build the widgets holding that many messages
+        append: Called with the widgets and the index of a message, to append it
+    """
+    costs = {}
+    for n in APPEND_CHECKPOINTS:
+        EventLog.reset()
+        first = max(0, n - 10)
+        widgets = build(first)
+        costs[str(n)] = summarise(time_each(lambda index: append(widgets, index), range(first, n)))['p50_us']
+    return costs
+
+
+@pytest.fixture(autouse=True)
+def clear_event_log():
+    EventLog.reset()
+
+
+def test_message_box_build(benchmark_results):
+    durations = time_each(lambda n: MessageBox("assistant" if n % 2 else "user", f"Message {n}"), range(2000))
+    benchmark_results['message_box_build'] = summarise(durations)
+
+
+def test_append_nth_message_to_box(benchmark_results):
+    # Every message in its own MessageBox, in a single box in a scroll container (as the chat was originally displayed)
+    def build(count):
+        chat_box = Box(style=Pack(direction=COLUMN), children=[MessageBox("user", f"Message {n}") for n in range(count)])
+        ScrollContainer(content=chat_box)
+        return chat_box
+
+    costs = append_costs(build, lambda chat_box, n: chat_box.add(MessageBox("user", f"Message {n}")))
+    benchmark_results['append_nth_message_to_box'] = costs
+
+
+def test_append_nth_message_to_history_view(benchmark_results):
+    def build(count):
+        history = ChatHistory()
+        for n in range(count):
+            history.append("user", f"Message {n}")
+        return history, ChatHistoryView(history)
+
+    costs = append_costs(build, lambda widgets, n: widgets[0].append("user", f"Message {n}"))
+    benchmark_results['append_nth_message_to_history_view'] = costs
+
+
+@pytest.mark.parametrize("chunk_size", [1, 100, 10000])
+def test_streaming_message_updates(benchmark_results, chunk_size):
+    # A 10k character reply, streamed in chunks of the given size, each update replacing the whole text
+    text = "x" * 10000
+    box = MessageBox("assistant", "")
+    durations = time_each(lambda end: setattr(box, 'message', text[:end]), range(chunk_size, len(text) + 1, chunk_size))
+    result = summarise(durations)
+    result['total_ms'] = round(sum(durations) / 1e6, 3)
+    benchmark_results[f'message_update_{chunk_size}_chars'] = result
+
+
+def markdown_reply(tokens : int) -> list:
+    """A Markdown reply of about the given number of tokens (of about four characters each), mixing prose, lists and code"""
+    sections = []
+    while sum(len(section) for section in sections) < tokens * 4:
+        n = len(sections)
+        sections.append(f"## Step {n}\n\nThis step explains **part {n}** of the answer in a short paragraph of prose.\n\n"
+                        f"- point one of step {n}\n- point two of step {n}\n\n"
+                        f"```python\ndef step_{n}(value):\n    return value * {n}\n```\n\n")
+    text = "".join(sections)
+    return [text[:end] for end in range(4, len(text) + 4, 4)]
+
+
+def test_markdown_streaming(benchmark_results):
+    # A 4k token reply streamed one token at a time, rendered incrementally into a message box, compared with parsing the whole
+    # text again for every token (without any widgets)
+    updates = markdown_reply(4000)
+    box = MessageBox("assistant", "")
+    incremental = time_each(lambda text: setattr(box, 'message', text), updates)
+    full = time_each(lambda text: MarkdownDocument(text), updates)
+
+    benchmark_results['markdown_stream_4k_tokens'] = {
+        'incremental_total_ms': round(sum(incremental) / 1e6, 3),
+        'incremental_p99_us': summarise(incremental)['p99_us'],
+        'full_parse_total_ms': round(sum(full) / 1e6, 3),
+        'full_parse_p99_us': summarise(full)['p99_us'],
+    }
+
+
+def test_search(benchmark_results):
+    # 200k messages drawn from a 5k word vocabulary, searched for a rare word, a common pair, a phrase and a role
+    vocabulary = [f"word{n}" for n in range(5000)]
+    history = ChatHistory()
+    index = SearchIndex()
+    index.add_chat("chat", history, follow=True)
+
+    started = time.perf_counter()
+    for n in range(200000):
+        words = [vocabulary[(n * 7919 + k * k * 104729) % len(vocabulary)] for k in range(12)]
+        history.append("user" if n % 2 else "assistant", " ".join(words))
+    indexing_seconds = time.perf_counter() - started
+
+    queries = ["word4999", "word0 word1", '"word0 word1"', "word17"]
+    results = {'index_messages_per_second': round(200000 / indexing_seconds)}
+    for query in queries:
+        results[f'search {query}'] = summarise(time_each(lambda n: index.search(query, role="user"), range(20)))['p50_us']
+    benchmark_results['search_200k_messages'] = results
+
+
+def test_history_memory(benchmark_results):
+    # 100k agent log messages held in memory, with and without compression of old messages
+    import tracemalloc
+
+    text = "step {0}: ran the tool, which returned the usual output of a few hundred characters; " * 4
+    results = {}
+    for compress_after in (None, ChatHistory.COMPRESS_AFTER):
+        tracemalloc.start()
+        history = ChatHistory(compress_after=compress_after)
+        for n in range(100000):
+            history.append("assistant" if n % 2 else "user", text.format(n))
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results['compressed' if compress_after else 'uncompressed'] = {
+            'bytes_per_message': round(size / 100000), 'estimated_bytes_per_message': round(history.memory_size() / 100000)}
+    benchmark_results['history_100k_messages'] = results
+
+
+@pytest.mark.parametrize("name, validator, inputs", [
+    ("float_range", FloatRange("out of range", min=0.0, max=1.0), ["0.5", "0", "1", "1.5", "-0.1", "0.95"]),
+    ("integer_range", IntegerRange("out of range", min=-1), ["40", "-1", "-2", "1.5", "0", "100000"]),
+    ("endpoints", SystemConfigurationBox.EndpointsValidator("invalid"),
+        ["http://gpu1:8080 2, http://gpu2:8080", "http://localhost:1234", "http://gpu1 0", "ftp://server"]),
+])
+def test_validator_throughput(benchmark_results, name, validator, inputs):
+    calls = 20000
+    started = time.perf_counter()
+    for n in range(calls):
+        validator(inputs[n % len(inputs)])
+    seconds = time.perf_counter() - started
+
+    benchmark_results[f'validator_{name}'] = {'calls_per_second': round(calls / seconds)}
@@ -0,0 +1,37 @@
+from enchat.chat_history import ChatHistory
+
+
+class RecordingListener:
+
+    def __init__(self):
+        self.events = []
+
+    def message_added(self, index : int):
+        self.events.append(("added", index))
+
+    def message_changed(self, index : int):
+        self.events.append(("changed", index))
+
+
+def test_listeners_are_notified_of_appends_and_updates():
+    history = ChatHistory()
+    listener = RecordingListener()
+    history.add_listener(listener)
+
+    index = history.append("user", "Hi")
+    history.update(index, "Hello")
+
+    assert listener.events == [("added", 0), ("changed", 0)]
+    assert history.as_pairs() == [("user", "Hello")]
+
+
+def test_old_messages_are_compressed_and_still_read_in_full():
+    history = ChatHistory(compress_after=10)
+    text = "A long agent log line, repeated. " * 20
+    for number in range(30):
+        history.append("assistant", f"{number}: {text}")
+
+    assert [history[index].is_compressed for index in range(30)] == [True] * 20 + [False] * 10
+    assert history[0].text == f"0: {text}"
+    assert history[0].role is history[29].role
+    assert history.memory_size() < 30 * len(text)
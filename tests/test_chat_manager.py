@@ -0,0 +1,89 @@
+import asyncio
+
+from enchat.chat_manager import ChatManager
+from enchat.chat_parameters import DEFAULT_PARAMETERS
+from enchat.search_index import SearchIndex
+from enchat.stub_backend import StubBackend
+
+
+def make_manager(directory, **kwargs) -> ChatManager:
+    # Chats are only opened, configured and closed here, so no client is needed
+    return ChatManager(directory, None, "Be helpful.", DEFAULT_PARAMETERS, greeting="Hello", **kwargs)
+
+
+def test_chats_and_their_configuration_are_saved(tmp_path):
+    manager = make_manager(tmp_path)
+    manager.activate("default")
+    chat = manager.create()
+    chat.history.append("user", "Hi there")
+    manager.configure(chat, "Be brief.", dict(DEFAULT_PARAMETERS, temperature=0.2))
+    manager.close()
+
+    manager = make_manager(tmp_path)
+    assert list(manager.chats) == ["chat-2", "default"]
+    chat = manager.activate("chat-2")
+    assert chat.history.as_pairs() == [("assistant", "Hello"), ("user", "Hi there")]
+    assert chat.session.system_content == "Be brief."
+    assert chat.session.parameters['temperature'] == 0.2
+    assert manager.activate("default").session.system_content == "Be helpful."
+    manager.close()
+
+
+def test_idle_chats_are_closed_over_the_memory_cap(tmp_path):
+    search_index = SearchIndex(open_history=lambda name: manager.history(name))
+    manager = make_manager(tmp_path, search_index=search_index, memory_cap=10 ** 9)
+    for name in ("a", "b", "c"):
+        chat = manager.activate(name)
+        for number in range(300):
+            chat.history.append("user", f"{name} message {number} " + "x" * 100)
+
+    manager.chats["a"].queued_messages.append("waiting")
+    manager.memory_cap = manager.chats["c"].session.memory_size() + 1
+    manager.enforce_memory_cap()
+
+    # The active chat, and the busy one, stay open
+    assert [name for name, chat in manager.chats.items() if chat.is_open] == ["a", "c"]
+    assert manager.memory_size() > manager.memory_cap
+
+    # The closed chat can still be searched, and opened again
+    hits = search_index.search("b message 299")
+    assert [(hit.chat, hit.index) for hit in hits] == [("b", 300)]
+    assert manager.chats["b"].is_open
+    manager.close()
+
+
+def test_inactive_chats_are_compacted(tmp_path):
+    manager = make_manager(tmp_path)
+    chat = manager.activate("long")
+    for number in range(1000):
+        chat.history.append("user", f"message {number}")
+    [message.text for message in chat.history]
+    full = chat.history.memory_size()
+
+    manager.activate("other")
+    assert chat.history.memory_size() < full / 4
+    assert chat.history[5].text == "message 4"
+    manager.close()
+
+
+def test_replies_stopped_on_closing_are_saved(tmp_path):
+    manager = ChatManager(tmp_path, StubBackend(token_delay=0.01), "Be helpful.", dict(DEFAULT_PARAMETERS, n_predict=1000),
+                          long_term_memory=False)
+
+    async def run():
+        chat = manager.activate("default")
+        chat.queued_messages.append("Then tell me more")
+        chat.reply_task = asyncio.ensure_future(chat.session.send("Tell me a long story"))
+        await asyncio.sleep(0.2)
+        await manager.stop_replies()
+        manager.close()
+        return chat
+
+    chat = asyncio.run(run())
+    assert chat.reply_task.cancelled() and chat.queued_messages == []
+
+    manager = make_manager(tmp_path)
+    history = manager.activate("default").history
+    assert history[-2].text == "Tell me a long story" and 0 < len(history[-1].text.split()) < 1000
+    manager.close()
+
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+# The configuration box test builds real widgets, on the dummy backend so it runs without a display
+os.environ.setdefault("TOGA_BACKEND", "toga_dummy")
+
+from enchat.chat_parameters import DEFAULT_CANDIDATES, DEFAULT_PARAMETERS, parse_candidates
+
+
+def test_candidates_are_an_n_best_list_or_a_sweep():
+    assert parse_candidates("", DEFAULT_PARAMETERS) == [{}] * DEFAULT_CANDIDATES
+    assert parse_candidates("temperature=0.2, 0.5,0.8", DEFAULT_PARAMETERS) == [
+        {'temperature': 0.2}, {'temperature': 0.5}, {'temperature': 0.8}]
+    assert parse_candidates("temperature=0.2,0.8; top-k=20,40", DEFAULT_PARAMETERS) == [
+        {'temperature': 0.2, 'top_k': 20}, {'temperature': 0.2, 'top_k': 40},
+        {'temperature': 0.8, 'top_k': 20}, {'temperature': 0.8, 'top_k': 40}]
+
+
+def test_identical_candidates_with_a_fixed_seed_get_different_seeds():
+    parameters = dict(DEFAULT_PARAMETERS, seed=5)
+    assert parse_candidates("3", parameters) == [{'seed': 5}, {'seed': 6}, {'seed': 7}]
+
+
+@pytest.mark.parametrize("spec", ["1", "9", "temperature", "colour=1,2", "temperature=0.5,hot"])
+def test_invalid_candidates_are_rejected(spec):
+    with pytest.raises(ValueError):
+        parse_candidates(spec, DEFAULT_PARAMETERS)
+
+
+def test_the_chat_configuration_box_rejects_invalid_parameters():
+    from enchat.chat_configuration_box import ChatConfigurationBox
+
+    box = ChatConfigurationBox("Be brief.", on_ok=None, on_cancel=None)
+    box.parameters = dict(DEFAULT_PARAMETERS, seed=7)
+    assert box.parameters == dict(DEFAULT_PARAMETERS, seed=7)
+
+    for name, value in (('temperature', "abc"), ('seed', ""), ('top_k', "2.5")):
+        box.parameters = dict(DEFAULT_PARAMETERS, **{name: value})
+        with pytest.raises(ValueError, match=name):
+            box.parameters
@@ -0,0 +1,162 @@
+import asyncio
+
+import pytest
+
+from enchat.chat_history import ChatHistory
+from enchat.chat_parameters import DEFAULT_PARAMETERS
+from enchat.chat_session import ChatSession
+from enchat.completion_backend import CompletionError
+from enchat.completion_client import CompletionClient
+from enchat.endpoint_pool import EndpointPool
+from enchat.long_term_memory import LongTermMemory
+from enchat.mock_server import MockServer
+
+
+def run_session(server : MockServer, run):
+
+    async def main():
+        async with server:
+            client = CompletionClient(EndpointPool([(server.address, 1.0)]))
+            session = ChatSession(ChatHistory(), client, "Be brief.", DEFAULT_PARAMETERS)
+            try:
+                return await run(session)
+            finally:
+                await client.pool.close()
+
+    return asyncio.run(main())
+
+
+def test_stopping_a_reply_keeps_the_partial_text_and_stops_the_server():
+    server = MockServer(token_rate=100, time_to_first_token=0, default_n_predict=1000)
+
+    async def run(session):
+        task = asyncio.ensure_future(session.send("Tell me everything"))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0.05)
+        return session
+
+    session = run_session(server, run)
+    reply = session.history[-1]
+    assert reply.role == "assistant" and reply.text
+    assert reply.metrics.stopped and session.stats.stopped == 1
+    assert server.stats['cancelled'] == 1
+    assert server.stats['tokens_generated'] < 100
+
+
+def test_unlimited_replies_are_limited_to_the_reserved_context():
+    server = MockServer(token_rate=100000, time_to_first_token=0, n_ctx=64, default_n_predict=1000)
+
+    async def run(session):
+        await session.send("Go on")
+        return session
+
+    session = run_session(server, run)
+    assert session.last_metrics.generated_tokens == 16
+
+
+def test_candidates_are_generated_concurrently_and_one_can_be_promoted():
+    server = MockServer(token_rate=200, time_to_first_token=0, slots=4)
+    updates = []
+
+    async def run(session):
+        session.parameters['n_predict'] = 20
+        session.history.append("assistant", "Hello")
+        start = asyncio.get_running_loop().time()
+        candidates = await session.generate_candidates("Hi", [{'temperature': 0.2}, {'temperature': 0.8}, {}],
+                                                       on_update=updates.append)
+        elapsed = asyncio.get_running_loop().time() - start
+        return session, candidates, elapsed
+
+    session, candidates, elapsed = run_session(server, run)
+    assert all(candidate.finished and candidate.text and candidate.error is None for candidate in candidates)
+    assert {candidate.number for candidate in updates} == {0, 1, 2}
+    assert elapsed < 0.25
+    assert len(session.history) == 2 and session.stats.requests == 3
+    assert candidates[1].description == "temperature=0.8"
+
+    index = session.promote(candidates[1])
+    assert session.history[index].text == candidates[1].text and session.history[index].metrics is candidates[1].metrics
+    assert session.prompt_cache.slot_id == candidates[1].result['id_slot']
+
+
+def test_relevant_messages_that_no_longer_fit_are_recalled(tmp_path):
+    server = MockServer(token_rate=100000, time_to_first_token=0, n_ctx=512)
+    recalled = []
+
+    async def run(session):
+        memory = session.memory = LongTermMemory(session.client, session.history, tmp_path / "embeddings.f32", min_similarity=0.9)
+        recall = memory.recall
+
+        async def record_recall(dropped):
+            recalled.append(await recall(dropped))
+            return recalled[-1]
+
+        memory.recall = record_recall
+        session.parameters['n_predict'] = 16
+        session.history.append("user", "Where did I leave the keys?")
+        session.history.append("assistant", "On the hook by the door.")
+        for number in range(100):
+            session.history.append("user", f"Here is filler message number {number}")
+
+        # The first prompt only embeds the latest message; the others are embedded in the background
+        await session.send("What time is it?")
+        while memory.is_embedding:
+            await asyncio.sleep(0.01)
+        await session.send("Where did I leave the keys?")
+        while memory.is_embedding:
+            await asyncio.sleep(0.01)
+        return session
+
+    session = run_session(server, run)
+
+    # The mock server's embeddings only match identical text, so only the earlier question is similar enough to recall
+    assert session.context_budget.first_kept > 2
+    assert recalled == [[], [0]]
+    assert len(session.memory._index) == len(session.history) - 1
+
+
+def test_changed_messages_that_fail_to_embed_are_embedded_again(tmp_path):
+
+    class FlakyClient:
+        failing = False
+
+        async def embed(self, text : str) -> list:
+            if self.failing:
+                raise CompletionError("no embeddings")
+            return [1.0, float(len(text))]
+
+    async def run():
+        history = ChatHistory()
+        for number in range(4):
+            history.append("user", f"message {number}")
+        memory = LongTermMemory(FlakyClient(), history, tmp_path / "embeddings.f32")
+        await memory.recall(range(0, 2))
+        await memory._task
+
+        history.update(1, "a changed message")
+        memory.client.failing = True
+        with pytest.raises(CompletionError):
+            await memory._update()
+        return memory
+
+    memory = asyncio.run(run())
+    assert memory._changed == {1} and len(memory._index) == 4
+
+
+def test_prefilling_a_draft_leaves_only_the_rest_of_the_message_to_evaluate():
+    server = MockServer(token_rate=100000, time_to_first_token=0)
+
+    async def run(session):
+        session.parameters['n_predict'] = 4
+        for number in range(20):
+            session.history.append("user", f"Here is a long message, number {number}, to fill the prompt")
+        assert await session.prefill("Please summarise everything I")
+        assert server.stats['tokens_generated'] == 0
+        await session.send("Please summarise everything I said")
+        return session
+
+    session = run_session(server, run)
+    assert 0 < session.last_metrics.prompt_tokens <= 4
@@ -0,0 +1,185 @@
+import asyncio
+import json
+
+import pytest
+
+from enchat.completion_client import CompletionClient, CompletionError
+from enchat.endpoint_pool import EndpointPool, parse_endpoints
+from enchat.prompt_format import format_prompt
+
+
+def serve_events(events : list, status : int = 200, connections : list = None):
+    """Start a local keep-alive server that answers every request with the given events, in chunked SSE format"""
+
+    async def handle(reader, writer):
+        if connections is not None:
+            connections.append(writer)
+
+        while True:
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b""):
+                name, _, value = line.decode().partition(':')
+                headers[name.strip().lower()] = value.strip()
+            if not line:
+                break
+            await reader.readexactly(int(headers.get('content-length', 0)))
+
+            writer.write(f"HTTP/1.1 {status} OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n".encode())
+            for event in events:
+                data = f"data: {json.dumps(event)}\n\n".encode()
+                writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+                await writer.drain()
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+
+        writer.close()
+
+    return asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+def stream(events : list, status : int = 200, requests : int = 1, connections : list = None) -> list:
+
+    async def run():
+        server = await serve_events(events, status, connections)
+        async with server:
+            port = server.sockets[0].getsockname()[1]
+            client = CompletionClient(EndpointPool([(f"http://127.0.0.1:{port}", 1.0)], read_timeout=5))
+            results = [[text async for text in client.stream_completion("prompt", {'n_predict': 8})] for _ in range(requests)]
+            await client.pool.close()
+            return results[-1]
+
+    return asyncio.run(run())
+
+
+def test_stream_completion_yields_tokens_in_order():
+    events = [{'content': "Hel", 'stop': False}, {'content': "lo", 'stop': False}, {'content': "", 'stop': True}]
+    assert stream(events) == ["Hel", "lo"]
+
+
+def test_stream_completion_raises_on_error_event():
+    with pytest.raises(CompletionError):
+        stream([{'error': {'message': "context overflow"}}])
+
+
+def test_stream_completion_raises_on_error_status():
+    with pytest.raises(CompletionError):
+        stream([], status=500)
+
+
+def test_consecutive_completions_reuse_one_connection():
+    connections = []
+    assert stream([{'content': "Hi", 'stop': True}], requests=3, connections=connections) == ["Hi"]
+    assert len(connections) == 1
+
+
+def test_a_request_stopped_before_its_response_closes_the_reused_connection():
+    closed = []
+
+    async def handle(reader, writer):
+        # Answers the first request of a connection, and never the second
+        requests = 0
+        while (line := await reader.readline()) != b"":
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b""):
+                name, _, value = line.decode().partition(':')
+                headers[name.strip().lower()] = value.strip()
+            await reader.readexactly(int(headers.get('content-length', 0)))
+            requests += 1
+            if requests == 1:
+                data = f"data: {json.dumps({'content': 'Hi', 'stop': True})}\n\n".encode()
+                writer.write(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n%x\r\n%s\r\n0\r\n\r\n" % (len(data), data))
+                await writer.drain()
+        closed.append(requests)
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        async with server:
+            port = server.sockets[0].getsockname()[1]
+            client = CompletionClient(EndpointPool([(f"http://127.0.0.1:{port}", 1.0)], read_timeout=5))
+            assert [text async for text in client.stream_completion("prompt", {'n_predict': 8})] == ["Hi"]
+
+            async def reply():
+                return [text async for text in client.stream_completion("prompt", {'n_predict': 8})]
+
+            # The traceback keeps the frames of the request alive, so the connection is not closed by being garbage collected
+            with pytest.raises(asyncio.TimeoutError) as stopped:
+                await asyncio.wait_for(reply(), 0.2)
+            for _ in range(100):
+                if closed:
+                    break
+                await asyncio.sleep(0.01)
+            await client.pool.close()
+            return stopped
+
+    asyncio.run(run())
+    assert closed == [2]
+
+
+def test_failed_endpoint_fails_over_before_the_first_token():
+
+    async def run():
+        server = await serve_events([{'content': "Hi", 'stop': True}])
+        async with server:
+            port = server.sockets[0].getsockname()[1]
+            # Nothing listens on port 1, so the preferred endpoint refuses the connection
+            client = CompletionClient(EndpointPool([("http://127.0.0.1:1", 1.0), (f"http://127.0.0.1:{port}", 1.0)]))
+            stream = client.stream_completion("prompt", {}, preferred="http://127.0.0.1:1")
+            texts = [text async for text in stream]
+            await client.pool.close()
+            return texts, stream.result['endpoint'], port
+
+    texts, endpoint, port = asyncio.run(run())
+    assert texts == ["Hi"]
+    assert endpoint == f"http://127.0.0.1:{port}"
+
+
+def test_requests_are_routed_by_latency_and_weight():
+    pool = EndpointPool(parse_endpoints("http://fast:1, http://slow:1, http://big:1 4"))
+    fast, slow, big = pool.endpoints
+    fast.record_latency(0.01)
+    slow.record_latency(0.5)
+    big.record_latency(0.02)
+
+    assert pool.select() is big
+    assert pool.select(preferred="http://fast:1") is fast
+    assert pool.select(preferred="http://slow:1") is big
+    assert pool.select(exclude=("http://big:1",)) is fast
+
+
+def test_probe_results_go_to_the_endpoints_probed_when_the_pool_changes():
+    pool = EndpointPool(parse_endpoints("http://up:1, http://down:1"))
+    up, down = pool.endpoints
+    up.failures = down.failures = 3
+
+    async def check_health(transport, healthy : bool) -> bool:
+        await asyncio.sleep(0.01)
+        transport.latency = 0.05
+        return healthy
+
+    up.transport.check_health = lambda: check_health(up.transport, True)
+    down.transport.check_health = lambda: check_health(down.transport, False)
+
+    async def run():
+        probe = asyncio.ensure_future(pool.probe())
+        await asyncio.sleep(0)
+        pool.configure(parse_endpoints("http://down:1, http://up:1"), pool.pool_size, pool.connect_timeout, pool.read_timeout)
+        await probe
+
+    asyncio.run(run())
+    assert pool.endpoints == [down, up]
+    assert (up.failures, down.failures) == (0, 3) and up.latency is not None and down.latency is None
+
+
+def test_parse_endpoints_rejects_invalid_lists():
+    with pytest.raises(ValueError):
+        parse_endpoints("ftp://server")
+    with pytest.raises(ValueError):
+        parse_endpoints("http://server 0")
+    with pytest.raises(ValueError):
+        parse_endpoints(" , ")
+
+
+def test_format_prompt_ends_with_assistant_cue():
+    prompt = format_prompt("Be brief.", [("user", "Hi"), ("assistant", "Hello"), ("user", "Bye")])
+    assert prompt == "Be brief.\n\nUser: Hi\nAssistant: Hello\nUser: Bye\nAssistant:"
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from enchat.chat_history import ChatHistory
+from enchat.context_budget import ContextBudget, ContextOverflowError
+
+
+class WordTokenizingClient:
+    """Stands in for the CompletionClient, with one token per word"""
+
+    def __init__(self, context_size : int):
+        self.context_size = context_size
+        self.tokenized = []
+
+    async def props(self) -> dict:
+        return {'default_generation_settings': {'n_ctx': self.context_size}}
+
+    async def tokenize(self, text : str) -> list:
+        self.tokenized.append(text)
+        return text.split()
+
+
+def test_everything_is_sent_when_it_fits():
+    history = ChatHistory()
+    for number in range(10):
+        history.append("user", f"message {number}")
+
+    budget = ContextBudget(WordTokenizingClient(1000), history)
+    assert asyncio.run(budget.fit("Be brief.", 100)) == list(range(10))
+
+
+def test_old_messages_are_dropped_in_a_block_and_counts_are_reused():
+    history = ChatHistory()
+    for number in range(100):
+        history.append("user", f"message {number}")
+
+    # 3 tokens for the system content and cue, 100 reserved for the reply, and 60 for the history (at 3 tokens per message)
+    client = WordTokenizingClient(ContextBudget.SAFETY_MARGIN + 3 + 100 + 60)
+    budget = ContextBudget(client, history, pin_first=1, low_water=0.5)
+    indexes = asyncio.run(budget.fit("Be brief.", 100))
+
+    # The pinned first message, plus the latest messages that fit in half of the remaining 57 tokens
+    assert indexes == [0] + list(range(91, 100))
+
+    client.tokenized.clear()
+    history.append("user", "one more")
+    assert asyncio.run(budget.fit("Be brief.", 100))[1] == indexes[1]
+    assert client.tokenized == ["User: one more\n"]
+
+
+def test_overflow_is_reported():
+    history = ChatHistory()
+    history.append("user", "word " * 100)
+
+    budget = ContextBudget(WordTokenizingClient(64), history)
+    with pytest.raises(ContextOverflowError):
+        asyncio.run(budget.fit("Be brief.", 16))
+
+
+def test_relevant_dropped_messages_are_recalled_into_the_unused_budget():
+    history = ChatHistory()
+    for number in range(100):
+        history.append("user", f"message {number}")
+    recalled = []
+
+    async def recall(dropped):
+        recalled.append(dropped)
+        return [50, 5, 97]
+
+    client = WordTokenizingClient(ContextBudget.SAFETY_MARGIN + 3 + 100 + 60)
+    budget = ContextBudget(client, history, pin_first=1, low_water=0.5, recall_fraction=0.1)
+    indexes = asyncio.run(budget.fit("Be brief.", 100, recall=recall))
+
+    # Only the dropped messages are offered, and only one fits in a tenth of the 57 tokens of the budget
+    assert recalled == [range(1, 91)]
+    assert indexes == [0, 50] + list(range(91, 100))
+
+
+def test_a_long_chat_only_counts_its_latest_messages_and_starts_where_it_left_off(tmp_path):
+    history = ChatHistory()
+    for number in range(20000):
+        history.append("user", f"message {number}")
+
+    client = WordTokenizingClient(ContextBudget.SAFETY_MARGIN + 3 + 100 + 60)
+    budget = ContextBudget(client, history, low_water=0.5, path=tmp_path / "budget.json")
+    indexes = asyncio.run(budget.fit("Be brief.", 100))
+
+    # Messages are counted back from the newest, as far as the 60 tokens of the budget reach
+    assert indexes == list(range(19990, 20000)) and len(client.tokenized) < 30
+
+    history.append("user", "one more")
+    reopened = ContextBudget(WordTokenizingClient(client.context_size), history, path=tmp_path / "budget.json")
+    assert asyncio.run(reopened.fit("Be brief.", 100)) == list(range(19990, 20001))
+
+
+def test_dropped_messages_are_sent_again_when_the_budget_grows():
+    history = ChatHistory()
+    for number in range(100):
+        history.append("user", f"message {number}")
+
+    client = WordTokenizingClient(ContextBudget.SAFETY_MARGIN + 3 + 100 + 60)
+    budget = ContextBudget(client, history, low_water=0.5)
+    assert asyncio.run(budget.fit("Be brief.", 100))[0] == 90
+
+    client.context_size += 60
+    budget.reset_context_size()
+    assert asyncio.run(budget.fit("Be brief.", 100))[0] == 80
@@ -0,0 +1,30 @@
+from enchat.chat_history import ChatHistory
+from enchat.conversation_store import ConversationStore
+
+
+def test_messages_survive_reopening_the_store(tmp_path):
+    store = ConversationStore(tmp_path)
+    store.append("user", "Hi")
+    index = store.append("assistant", "")
+    store.update(index, "assistant", "Hello\nthere")
+    store.close()
+
+    store = ConversationStore(tmp_path)
+    assert len(store) == 2
+    assert store.read(0, 10) == [("user", "Hi"), ("assistant", "Hello\nthere")]
+    store.close()
+
+
+def test_history_pages_messages_in_from_the_store(tmp_path):
+    store = ConversationStore(tmp_path)
+    for number in range(1000):
+        store.append("user", f"message {number}")
+    store.flush()
+
+    history = ChatHistory(store, page_size=50, max_pages=3)
+    assert len(history) == 1000
+    assert history[-1].text == "message 999"
+    assert history[10].text == "message 10"
+    assert [message.text for message in history][500] == "message 500"
+    assert len(history._pages) <= 3
+    store.close()
@@ -0,0 +1,68 @@
+import json
+
+from enchat.chat_manager import ChatManager
+from enchat.chat_parameters import DEFAULT_PARAMETERS
+from enchat.diagnostics import Diagnostics
+from enchat.message_box import MessageBox
+from enchat.search_index import SearchIndex
+
+
+def make_manager(directory) -> ChatManager:
+    return ChatManager(directory, None, "Be helpful.", DEFAULT_PARAMETERS, greeting="Hello", long_term_memory=False)
+
+
+def test_snapshots_count_widgets_and_history_and_can_be_exported(tmp_path):
+    search_index = SearchIndex()
+    manager = make_manager(tmp_path / "chats")
+    chat = manager.activate("default")
+    search_index.add_chat(chat.name, chat.history, follow=True)
+    chat.history.append("user", "First paragraph\n\nSecond paragraph")
+
+    boxes, labels = MessageBox.census()
+    message_boxes = [MessageBox("user", "First paragraph\n\nSecond paragraph"), MessageBox("assistant", "One")]
+    diagnostics = Diagnostics(manager, search_index=search_index)
+    diagnostics.snapshots.append(diagnostics.snapshot())
+    snapshot = diagnostics.snapshot()
+
+    assert snapshot['message_boxes'] == boxes + 2 and snapshot['labels'] == labels + 2 * 2 + 3
+    assert snapshot['open_chats'] == 1 and snapshot['history_bytes'] > 0 and snapshot['search_index_bytes'] > 0
+    assert "Message boxes: " in diagnostics.describe()
+
+    diagnostics.start_tracing()
+    try:
+        allocated = [f"message {number}" * 10 for number in range(1000)]
+        assert diagnostics.top_allocators()
+        assert "Top allocators:" in diagnostics.describe()
+        exported = json.loads(diagnostics.export(tmp_path / "diagnostics").read_text())
+    finally:
+        diagnostics.stop_tracing()
+    assert len(exported['snapshots']) == 2 and exported['top_allocators'] and len(allocated) == 1000
+    manager.close()
+
+
+def test_the_watchdog_warns_then_offloads_old_history(tmp_path):
+    manager = make_manager(tmp_path)
+    for name in ("idle", "active"):
+        chat = manager.activate(name)
+        for number in range(250):
+            chat.history.append("user", f"{name} message {number}")
+    active = manager.chats["active"]
+    active.history[0]  # Reads the first page back into memory
+
+    diagnostics = Diagnostics(manager, budget=1000)
+    assert diagnostics.check({'resident_bytes': 500, 'chat_bytes': {}, 'search_index_bytes': None}) == "ok"
+    assert diagnostics.check({'resident_bytes': 950, 'chat_bytes': {}, 'search_index_bytes': None}) == "warning"
+    assert manager.chats["idle"].is_open and diagnostics.offloads == 0
+
+    size = active.session.memory_size()
+    assert diagnostics.check(diagnostics.snapshot() | {'resident_bytes': 2000}) == "over budget"
+    assert not manager.chats["idle"].is_open and diagnostics.offloads == 1
+    assert active.is_open and active.session.memory_size() < size
+    assert active.history[1].text == "active message 0"
+
+    # History is only offloaded again once the memory has fallen below the warning level
+    for used in (2000, 950, 2000):
+        assert diagnostics.check(diagnostics.snapshot() | {'resident_bytes': used}) != "ok" and diagnostics.offloads == 1
+    assert diagnostics.check({'resident_bytes': 500, 'chat_bytes': {}, 'search_index_bytes': None}) == "ok"
+    assert diagnostics.check(diagnostics.snapshot() | {'resident_bytes': 2000}) == "over budget" and diagnostics.offloads == 2
+    manager.close()
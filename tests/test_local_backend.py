@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from enchat.chat_history import ChatHistory
+from enchat.chat_parameters import DEFAULT_PARAMETERS
+from enchat.chat_session import ChatSession
+from enchat.completion_backend import CompletionError, ServerUnavailableError
+from enchat.local_backend import LocalBackend
+from enchat.stub_backend import StubBackend, StubEngine
+
+
+def test_sessions_reply_through_the_stub_backend_deterministically():
+
+    async def run():
+        replies = []
+        for _ in range(2):
+            session = ChatSession(ChatHistory(), StubBackend(), "Be brief.", dict(DEFAULT_PARAMETERS, n_predict=6))
+            await session.send("Tell me about the weather")
+            await session.send("And tomorrow?")
+            replies.append(session)
+        return replies
+
+    first, second = asyncio.run(run())
+    assert [message.text for message in first.history] == [message.text for message in second.history]
+    assert first.history[-1].text and first.last_metrics.generated_tokens == 6
+    assert first.last_result['endpoint'] == "stub" and first.last_result['tokens_cached'] > 0
+
+
+def test_local_backend_runs_the_engine_in_a_worker_process_and_cancels_replies():
+    backend = LocalBackend("no model", n_ctx=512, engine=StubEngine)
+
+    async def run():
+        props = await backend.props()
+        tokens = await backend.tokenize("three little words")
+
+        stream = backend.stream_completion("the quick brown fox", {'n_predict': 5})
+        reply = [text async for text in stream]
+
+        # Stopping a long reply part-way through stops the worker, so the next request is answered straight away
+        async for text in backend.stream_completion("on and on", {'n_predict': 10 ** 8}):
+            break
+        await asyncio.wait_for(backend.tokenize("still there"), 5)
+        return props, tokens, reply, stream.result
+
+    try:
+        props, tokens, reply, result = asyncio.run(run())
+    finally:
+        asyncio.run(backend.close())
+
+    assert props['default_generation_settings']['n_ctx'] == 512
+    assert len(tokens) == 3
+    assert len(reply) == 5 and result['tokens_predicted'] == 5 and result['endpoint'] == "local"
+
+
+def test_local_backend_reports_a_model_that_cannot_be_loaded():
+    backend = LocalBackend("/no/such/model.gguf")
+
+    async def run():
+        with pytest.raises(CompletionError, match="could not load the model"):
+            await backend.props()
+
+    try:
+        asyncio.run(run())
+    finally:
+        asyncio.run(backend.close())
+
+
+def test_local_backend_reports_a_worker_that_has_died_as_unavailable():
+    backend = LocalBackend("no model", n_ctx=512, engine=StubEngine)
+
+    async def run():
+        await backend.props()
+
+        # The worker dies, and a request is made before the reader thread has noticed
+        backend._process.kill()
+        backend._process.join()
+        with pytest.raises(ServerUnavailableError):
+            await backend.props()
+
+        # Once it has noticed, the next request starts the worker again
+        while backend._process is not None:
+            await asyncio.sleep(0.01)
+        return await asyncio.wait_for(backend.props(), 30)
+
+    try:
+        props = asyncio.run(run())
+    finally:
+        asyncio.run(backend.close())
+    assert props['default_generation_settings']['n_ctx'] == 512
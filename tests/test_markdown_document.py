@@ -0,0 +1,66 @@
+from enchat.markdown_document import Block, MarkdownDocument
+
+REPLY = """# Setting up
+
+Here is **how** to do it, see [the docs](https://example.com/docs).
+It continues here.
+
+- first item
+- second item
+  continued
+1. numbered
+
+```python
+def double(x):
+
+    return x * 2
+```
+
+| Name | Value |
+|------|------:|
+| a | 1 |
+| longer | 22 |
+
+#hashtag is not a heading
+"""
+
+
+def test_blocks_are_rendered_for_display():
+    blocks = MarkdownDocument(REPLY).blocks
+
+    assert [block.kind for block in blocks] == [Block.HEADING, Block.PARAGRAPH, Block.LIST, Block.CODE, Block.TABLE,
+                                                Block.PARAGRAPH]
+    assert blocks[0].text == "Setting up" and blocks[0].level == 1
+    assert blocks[1].text == "Here is how to do it, see the docs (https://example.com/docs). It continues here."
+    assert blocks[2].text == "• first item\n• second item\n  continued\n1. numbered"
+    assert blocks[3].text == "def double(x):\n\n    return x * 2" and blocks[3].language == "python"
+    assert blocks[4].text == "Name   │ Value\na      │ 1\nlonger │ 22"
+    assert blocks[5].text == "#hashtag is not a heading"
+
+
+def test_streaming_parses_the_same_blocks_as_parsing_the_whole_text():
+    for step in (1, 5):
+        document = MarkdownDocument()
+        for end in range(0, len(REPLY) + 1, step):
+            document.update(REPLY[:end])
+            assert document.blocks == MarkdownDocument(REPLY[:end]).blocks, REPLY[:end]
+
+
+def test_only_the_open_tail_is_parsed_again():
+    document = MarkdownDocument("First paragraph.\n\nSecond")
+    first_block = document.blocks[0]
+
+    assert document.update("First paragraph.\n\nSecond paragraph.\n\nThird") == 1
+    assert document.blocks[0] is first_block
+
+    # A different text (e.g. a recycled message box) is parsed from the start
+    assert document.update("Something else") == 0
+    assert [block.text for block in document.blocks] == ["Something else"]
+
+
+def test_unclosed_code_blocks_stay_open_until_their_fence():
+    document = MarkdownDocument("```\ncode\n\nmore code")
+    assert [(block.kind, block.text) for block in document.blocks] == [(Block.CODE, "code\n\nmore code")]
+
+    document.update("```\ncode\n\nmore code\n```\nAfter")
+    assert [block.kind for block in document.blocks] == [Block.CODE, Block.PARAGRAPH]
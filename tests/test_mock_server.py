@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from enchat.chat_parameters import DEFAULT_PARAMETERS
+from enchat.completion_client import CompletionClient, ServerUnavailableError
+from enchat.endpoint_pool import EndpointPool
+from enchat.load_harness import LoadHarness
+from enchat.mock_server import MockServer
+
+
+def run_with_server(server : MockServer, run):
+
+    async def main():
+        async with server:
+            client = CompletionClient(EndpointPool([(server.address, 1.0)]))
+            try:
+                return await run(client)
+            finally:
+                await client.pool.close()
+
+    return asyncio.run(main())
+
+
+def test_mock_server_streams_the_requested_tokens_and_caches_prompts():
+    server = MockServer(token_rate=1000, time_to_first_token=0, slots=1)
+
+    async def run(client):
+        results = []
+        for prompt in ["User: Hi there\nAssistant:", "User: Hi there\nAssistant: Hello\nUser: Bye\nAssistant:"]:
+            stream = client.stream_completion(prompt, {'n_predict': 5, 'cache_prompt': True})
+            texts = [text async for text in stream]
+            results.append((texts, stream.result))
+        return results
+
+    (texts, first), (_, second) = run_with_server(server, run)
+    assert len(texts) == 5
+    assert first['tokens_predicted'] == 5 and first['tokens_cached'] == 0
+    assert second['tokens_cached'] > 0
+    assert server.stats['tokens_generated'] == 10
+
+
+def test_mock_server_errors_are_reported_as_unavailable():
+    server = MockServer(error_rate=1.0)
+
+    async def run(client):
+        return [text async for text in client.stream_completion("prompt", {'n_predict': 5})]
+
+    with pytest.raises(ServerUnavailableError):
+        run_with_server(server, run)
+
+
+def test_load_harness_reports_every_request():
+    server = MockServer(token_rate=2000, time_to_first_token=0.01, slots=2)
+
+    async def run(client):
+        harness = LoadHarness(client, sessions=4, turns=2, parameters=dict(DEFAULT_PARAMETERS, n_predict=4))
+        return await harness.run()
+
+    report = run_with_server(server, run)
+    assert report['requests'] == 8 and report['errors'] == 0 and report['cancelled'] == 0
+    assert report['tokens_generated'] == 32
+    assert report['latency_p50'] <= report['latency_p99']
+
+
+def test_load_harness_cancels_replies_after_their_first_text():
+    server = MockServer(token_rate=100, time_to_first_token=0.01)
+
+    async def run(client):
+        harness = LoadHarness(client, sessions=2, turns=2, parameters=dict(DEFAULT_PARAMETERS, n_predict=50), cancel_rate=1.0)
+        report = await harness.run()
+        await asyncio.sleep(0.05)
+        return report
+
+    report = run_with_server(server, run)
+    assert report['cancelled'] == 4
+    assert server.stats['cancelled'] == 4
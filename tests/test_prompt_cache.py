@@ -0,0 +1,29 @@
+from enchat.prompt_cache import PromptCache
+from enchat.prompt_format import format_prompt
+
+
+def test_appended_turns_extend_the_cached_prompt():
+    cache = PromptCache()
+    history = [("user", "Hi")]
+    cache.record(format_prompt("Be brief.", history), {'id_slot': 2})
+
+    history += [("assistant", " Hello"), ("user", "Bye")]
+    assert cache.check_prompt(format_prompt("Be brief.", history))
+    assert cache.request_parameters == {'cache_prompt': True, 'id_slot': 2}
+
+
+def test_system_content_change_invalidates_the_cached_prompt():
+    cache = PromptCache()
+    cache.record(format_prompt("Be brief.", [("user", "Hi")]), {'id_slot': 0})
+
+    assert cache.configuration_changed("Be brief.", "Be verbose.", {'top_k': 40}, {'top_k': 40})
+    assert cache.invalidation_reason is not None
+    assert not cache.check_prompt(format_prompt("Be verbose.", [("user", "Hi")]))
+
+
+def test_sampling_parameter_change_keeps_the_cached_prompt():
+    cache = PromptCache()
+    cache.record(format_prompt("Be brief.", [("user", "Hi")]), {'id_slot': 0})
+
+    assert not cache.configuration_changed("Be brief.", "Be brief.", {'temperature': 0.8}, {'temperature': 0.2})
+    assert cache.check_prompt(format_prompt("Be brief.", [("user", "Hi"), ("assistant", "Hello"), ("user", "Bye")]))
@@ -0,0 +1,65 @@
+import asyncio
+
+from enchat.chat_history import ChatHistory
+from enchat.chat_parameters import DEFAULT_PARAMETERS
+from enchat.chat_session import ChatSession
+from enchat.completion_client import CompletionClient
+from enchat.endpoint_pool import EndpointPool
+from enchat.mock_server import MockServer
+from enchat.request_metrics import MetricsExporter, RequestMetrics, SessionStats
+
+
+def finished_metrics(first_token : float, wall : float, generated : int, prompt : int = 10) -> RequestMetrics:
+    metrics = RequestMetrics()
+    metrics.finish({'tokens_predicted': generated, 'timings': {'prompt_n': prompt}, 'queue_seconds': 0.0}, generated)
+    metrics.first_token_seconds = first_token
+    metrics.wall_seconds = wall
+    return metrics
+
+
+def test_replies_record_their_metrics():
+
+    async def run():
+        async with MockServer(token_rate=1000, time_to_first_token=0.02) as server:
+            client = CompletionClient(EndpointPool([(server.address, 1.0)]))
+            history = ChatHistory()
+            session = ChatSession(history, client, "Be brief.", dict(DEFAULT_PARAMETERS, n_predict=8))
+            index = await session.send("Hello there")
+            await client.pool.close()
+            return history[index].metrics, session.stats
+
+    metrics, stats = asyncio.run(run())
+    assert metrics.generated_tokens == 8 and metrics.prompt_tokens > 0
+    assert 0.02 <= metrics.first_token_seconds <= metrics.wall_seconds
+    assert metrics.queue_seconds is not None and metrics.tokens_per_second > 0
+    assert "8 tokens" in metrics.footer()
+    assert stats.summary()['generated_tokens'] == 8
+
+
+def test_session_stats_aggregate_replies():
+    stats = SessionStats()
+    for n in range(1, 11):
+        stats.add(finished_metrics(first_token=n / 10, wall=n / 10 + 1, generated=11))
+    failed = RequestMetrics()
+    failed.finish({}, 0, error=TimeoutError())
+    stats.add(failed)
+
+    summary = stats.summary()
+    assert (summary['requests'], summary['errors'], summary['generated_tokens']) == (11, 1, 110)
+    assert summary['tokens_per_second'] == 10.0
+    assert summary['first_token_seconds_p50'] == 0.6
+
+
+def test_exporter_writes_scrapeable_metrics(tmp_path):
+    stats = SessionStats()
+    metrics = finished_metrics(first_token=0.5, wall=2.0, generated=31)
+    stats.add(metrics)
+
+    exporter = MetricsExporter(tmp_path)
+    exporter.record(metrics, stats)
+    exporter.record(metrics, stats)
+
+    assert len((tmp_path / MetricsExporter.REQUESTS_FILE).read_text().splitlines()) == 2
+    prometheus = (tmp_path / MetricsExporter.PROMETHEUS_FILE).read_text()
+    assert 'enchat_generated_tokens_total{session="default"} 31' in prometheus
+    assert 'enchat_first_token_seconds{session="default",quantile="0.50"} 0.500000' in prometheus
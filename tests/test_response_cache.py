@@ -0,0 +1,65 @@
+import asyncio
+
+from enchat.chat_history import ChatHistory
+from enchat.chat_session import ChatSession
+from enchat.response_cache import ReplayStream, ResponseCache
+from enchat.stub_backend import StubBackend, StubEngine
+
+
+PARAMETERS = {'temperature': 0, 'n_predict': 64, 'top_k': 40, 'repeat_penalty': 1.1, 'min_p': 0.05, 'top_p': 0.95, 'seed': -1}
+
+
+def test_only_greedy_or_seeded_requests_are_deterministic():
+    assert ResponseCache.is_deterministic(PARAMETERS)
+    assert ResponseCache.is_deterministic(dict(PARAMETERS, temperature=0.8, seed=7))
+    assert not ResponseCache.is_deterministic(dict(PARAMETERS, temperature=0.8))
+    assert not ResponseCache.is_deterministic(dict(PARAMETERS, temperature=0.8, seed=None))
+
+
+def test_key_ignores_cache_parameters_but_not_sampling_parameters():
+    key = ResponseCache.key("prompt", PARAMETERS)
+    assert ResponseCache.key("prompt", dict(PARAMETERS, cache_prompt=True, id_slot=3)) == key
+    assert ResponseCache.key("prompt", dict(PARAMETERS, top_k=20)) != key
+    assert ResponseCache.key("other prompt", PARAMETERS) != key
+    assert ResponseCache.key("prompt", PARAMETERS, "stub:stub") != key
+
+
+def test_replies_survive_in_the_disk_tier(tmp_path):
+    key = ResponseCache.key("prompt", PARAMETERS)
+    ResponseCache(tmp_path).put(key, "cached reply")
+
+    assert ResponseCache(tmp_path).get(key) == "cached reply"
+
+
+def test_disk_tier_evicts_least_recently_used_entries(tmp_path):
+    cache = ResponseCache(tmp_path, memory_entries=1, disk_bytes=25)
+    for number in range(5):
+        cache.put(str(number), "ten bytes!")
+
+    assert cache.size[1] <= 25
+    assert ResponseCache(tmp_path).get("4") == "ten bytes!"
+    assert ResponseCache(tmp_path).get("0") is None
+
+
+def test_replies_are_only_replayed_for_the_model_that_wrote_them(tmp_path):
+    cache = ResponseCache(tmp_path)
+
+    async def reply(backend) -> ChatSession:
+        session = ChatSession(ChatHistory(), backend, "Be brief.", dict(PARAMETERS, n_predict=6), response_cache=cache)
+        await session.send("Hello")
+        return session
+
+    first = asyncio.run(reply(StubBackend()))
+    assert asyncio.run(reply(StubBackend())).last_metrics.cached
+    other = asyncio.run(reply(StubBackend(StubEngine(model_path="other"))))
+    assert not other.last_metrics.cached and other.last_result['tokens_predicted'] == 6
+    cache.close()
+    assert len(list(tmp_path.glob("*.txt"))) == 2 and first.history[-1].text
+
+
+def test_replay_stream_yields_the_whole_reply():
+
+    async def replay():
+        return "".join([text async for text in ReplayStream("x" * 200)])
+
+    assert asyncio.run(replay()) == "x" * 200
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from enchat.chat_history import ChatHistory
+from enchat.chat_parameters import DEFAULT_PARAMETERS
+from enchat.chat_session import ChatSession
+from enchat.rolling_summary import RollingSummary
+from enchat.stub_backend import StubBackend, StubEngine
+
+
+class RecordingBackend(StubBackend):
+    """A stub backend that records the prompts it is sent, and the slots they are sent to"""
+
+    def __init__(self, token_delay : float = 0.0, slots : int = 2):
+        super(RecordingBackend, self).__init__(StubEngine(slots=slots), token_delay=token_delay)
+        self.prompts = []
+        self.slots = []
+
+    async def _stream(self, body : dict, preferred : str, result : dict):
+        self.prompts.append(body['prompt'])
+        self.slots.append(body.get('id_slot', -1))
+        async for text in super(RecordingBackend, self)._stream(body, preferred, result):
+            yield text
+
+
+def make_session(path, backend : RecordingBackend, threshold : int = 60) -> ChatSession:
+    history = ChatHistory()
+    summary = RollingSummary(backend, history, path, threshold=threshold, n_predict=8)
+    return ChatSession(history, backend, "Be brief.", dict(DEFAULT_PARAMETERS, n_predict=4), summary=summary)
+
+
+async def wait_for_summary(summary : RollingSummary):
+    while summary.is_updating:
+        await asyncio.sleep(0.01)
+
+
+def test_old_turns_are_summarised_in_the_background_and_sent_after_the_system_content(tmp_path):
+    backend = RecordingBackend()
+    session = make_session(tmp_path / "summary.json", backend)
+
+    async def run():
+        for number in range(12):
+            await session.send(f"message {number} is about the colour of the sky over the sea")
+            await wait_for_summary(session.summary)
+        await session.send("what did we talk about?")
+        reply_prompt = backend.prompts[-1]
+        await wait_for_summary(session.summary)
+        return reply_prompt
+
+    reply_prompt = asyncio.run(run())
+    summary = session.summary
+    assert session.context_budget.first_kept > 0 and summary.covered == session.context_budget.first_kept
+    assert summary.text and len(summary.text.split()) <= 8
+
+    # Summaries are made of the newly dropped messages only, and each reply's prompt starts with the latest summary
+    summary_prompts = [prompt for prompt in backend.prompts if prompt.startswith(RollingSummary.INSTRUCTIONS)]
+    assert 1 < len(summary_prompts) < 12 and "message 0 " not in summary_prompts[-1]
+    assert reply_prompt.startswith(f"Be brief.\n\n{RollingSummary.HEADING}\n") and "message 0 " not in reply_prompt
+    assert backend.prompts[-1].startswith(RollingSummary.INSTRUCTIONS) and len(session.history) == 26
+
+    # Summaries are made in the slot after the chat's, so the chat's cached prompt is kept
+    summary_slots = {slot for prompt, slot in zip(backend.prompts, backend.slots) if prompt.startswith(RollingSummary.INSTRUCTIONS)}
+    assert session.prompt_cache.slot_id == 0 and summary_slots == {1}
+
+    reloaded = RollingSummary(backend, session.history, tmp_path / "summary.json")
+    assert (reloaded.text, reloaded.covered) == (summary.text, summary.covered)
+
+    # Changing a summarised message discards the summary
+    session.history.update(1, "a different message")
+    assert (summary.text, summary.covered) == ("", 0)
+
+
+def test_a_reply_cancels_the_summary_in_progress(tmp_path):
+    backend = RecordingBackend(token_delay=0.01)
+    session = make_session(tmp_path / "summary.json", backend, threshold=30)
+
+    async def run():
+        for number in range(5):
+            await session.send(f"message {number} is about the colour of the sky over the sea")
+        assert session.summary.is_updating
+        await session.send("and the next reply does not wait for it")
+        assert session.summary.text == "" and session.summary.covered == 0
+        await wait_for_summary(session.summary)
+
+    asyncio.run(run())
+    assert session.summary.text and session.summary.covered == session.context_budget.first_kept
+
+
+def test_a_stopped_reply_starts_the_summary_again(tmp_path):
+    backend = RecordingBackend(token_delay=0.01)
+    session = make_session(tmp_path / "summary.json", backend, threshold=30)
+
+    async def run():
+        for number in range(5):
+            await session.send(f"message {number} is about the colour of the sky over the sea")
+        reply = asyncio.ensure_future(session.send("this reply is stopped"))
+        await asyncio.sleep(0.02)
+        assert not session.summary.is_updating
+        reply.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await reply
+        assert session.summary.is_updating
+        await wait_for_summary(session.summary)
+
+    asyncio.run(run())
+    assert session.summary.text and session.summary.covered == session.context_budget.first_kept
+
+
+def test_nothing_is_summarised_on_a_server_with_a_single_slot(tmp_path):
+    backend = RecordingBackend(slots=1)
+    session = make_session(tmp_path / "summary.json", backend)
+
+    async def run():
+        for number in range(12):
+            await session.send(f"message {number} is about the colour of the sky over the sea")
+            assert not session.summary.is_updating
+
+    asyncio.run(run())
+    assert not any(prompt.startswith(RollingSummary.INSTRUCTIONS) for prompt in backend.prompts)
+    assert session.context_budget.first_kept == 0 and session.summary.text == ""
+    assert RollingSummary.summary_slot(None, 0) == -1 and RollingSummary.summary_slot(4, -1) == -1
+    assert RollingSummary.summary_slot(4, 3) == 0
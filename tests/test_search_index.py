@@ -0,0 +1,56 @@
+from enchat.chat_history import ChatHistory
+from enchat.conversation_store import ConversationStore
+from enchat.search_index import SearchIndex, tokenize
+
+
+def followed_chat(*messages) -> tuple:
+    index = SearchIndex()
+    history = ChatHistory()
+    index.add_chat("current", history, follow=True)
+    for role, text in messages:
+        history.append(role, text)
+    return index, history
+
+
+def test_words_are_matched_whole_and_ignoring_case():
+    assert tokenize("The Prompt-cache, reused!") == ["the", "prompt", "cache", "reused"]
+
+    index, _ = followed_chat(("user", "How does the prompt cache work?"), ("assistant", "Prompts are cached per slot."))
+    assert [hit.index for hit in index.search("PROMPT")] == [0]
+    assert [hit.index for hit in index.search("prompt cache")] == [0]
+    assert index.search("prompt slot") == []
+
+
+def test_phrases_and_roles_narrow_the_search():
+    index, _ = followed_chat(("user", "cache the prompt"), ("assistant", "the prompt cache is warm"), ("user", "prompt cache?"))
+
+    assert [hit.index for hit in index.search('"prompt cache"')] == [2, 1]
+    assert [hit.index for hit in index.search('"prompt cache"', role="user")] == [2]
+    assert index.search("prompt", role="system") == []
+
+
+def test_streamed_replies_are_searchable_as_they_arrive():
+    index, history = followed_chat(("user", "Tell me a story"))
+    reply = history.append("assistant", "")
+    history.update(reply, "Once upon", save=False)
+    assert [hit.index for hit in index.search("upon")] == [reply]
+
+    history.update(reply, "Once upon a time")
+    assert index.search("upon time")[0].text == "Once upon a time"
+    assert index.search("upon time", limit=5) and len(index) == 2
+
+
+def test_saved_chats_are_indexed_from_their_stores(tmp_path):
+    store = ConversationStore(tmp_path / "saved")
+    for number in range(250):
+        store.append("user", f"saved message {number}")
+
+    index = SearchIndex()
+    index.add_chat("saved", ChatHistory(store))
+    assert index.index_store("saved", store, batch_size=100) == 250
+    assert index.index_store("saved", store) == 0
+
+    hits = index.search("message 42")
+    assert [(hit.chat, hit.index, hit.text) for hit in hits] == [("saved", 42, "saved message 42")]
+    assert len(index.search("saved message", limit=10)) == 10
+    store.close()
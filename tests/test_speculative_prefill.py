@@ -0,0 +1,57 @@
+import asyncio
+
+from enchat.speculative_prefill import SpeculativePrefill
+
+
+class RecordingSession:
+    """Stands in for the ChatSession, recording the drafts prefilled"""
+
+    def __init__(self, seconds : float = 0.0):
+        self.seconds = seconds
+        self.drafts = []
+        self.cancelled = 0
+
+    async def prefill(self, draft : str) -> bool:
+        self.drafts.append(draft)
+        try:
+            await asyncio.sleep(self.seconds)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return True
+
+
+def test_drafts_are_prefilled_once_typing_pauses():
+    session = RecordingSession()
+
+    async def run():
+        prefill = SpeculativePrefill(delay=0.05, min_interval=0, min_growth=4)
+        for draft in ["H", "He", "Hello", "Hello th", "Hello there"]:
+            prefill.draft_changed(session, draft)
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+
+        # Grew by too little to be sent again
+        prefill.draft_changed(session, "Hello there!")
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert session.drafts == ["Hello there"]
+
+
+def test_prefills_are_rate_limited_and_cancelled_when_the_message_is_sent():
+    session = RecordingSession(seconds=0.5)
+
+    async def run():
+        prefill = SpeculativePrefill(delay=0.01, min_interval=0, min_growth=1)
+        for number in range(10):
+            prefill.draft_changed(session, "x" * (number + 1))
+            await asyncio.sleep(0.03)
+
+        # One prefill in flight; the latest draft waits for it
+        assert session.drafts == ["x"]
+        prefill.cancel()
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert session.drafts == ["x"] and session.cancelled == 1
@@ -0,0 +1,53 @@
+import asyncio
+import os
+
+# The view test builds real widgets, on the dummy backend so it runs without a display
+os.environ.setdefault("TOGA_BACKEND", "toga_dummy")
+
+from enchat.update_scheduler import UpdateScheduler
+
+
+def test_updates_are_merged_and_flushed_at_most_once_per_frame():
+    applied = []
+
+    async def run():
+        scheduler = UpdateScheduler(rate=20)
+        for number in range(100):
+            scheduler.schedule("scroll", lambda: applied.append("scroll"), final=True)
+            scheduler.schedule(number % 2, lambda number=number: applied.append(number))
+            await asyncio.sleep(0.002)
+        await asyncio.sleep(0.06)
+        return scheduler
+
+    scheduler = asyncio.run(run())
+
+    # About 0.2 s of updates at 20 Hz, with the first flushed straight away
+    assert 3 <= scheduler.flushes <= 7
+    assert applied[:3] == [0, "scroll", 1] or applied[:2] == [0, "scroll"]
+    assert sorted(applied[-3:-1]) == [98, 99] and applied[-1] == "scroll"
+    assert scheduler.updates == len(applied) <= 3 * scheduler.flushes
+
+
+def test_streamed_messages_are_displayed_once_per_frame():
+    from enchat.chat_history import ChatHistory
+    from enchat.chat_history_view import ChatHistoryView
+
+    history = ChatHistory()
+    scheduler = UpdateScheduler(rate=30)
+    view = ChatHistoryView(history, scheduler=scheduler)
+    index = history.append("assistant", "")
+    binds = []
+    show = view._box.children[0].show
+    view._box.children[0].show = lambda message: binds.append(message.text) or show(message)
+
+    async def run():
+        reply = ""
+        for number in range(200):
+            reply += f" token{number}"
+            history.update(index, reply, save=False)
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    assert len(binds) <= scheduler.flushes < 20
+    assert view._box.children[0].message == history[index].text
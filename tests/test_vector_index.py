@@ -0,0 +1,38 @@
+import numpy as np
+
+from enchat.vector_index import VectorIndex
+
+
+def test_vectors_are_found_by_cosine_similarity_and_persist(tmp_path):
+    generator = np.random.default_rng(1)
+    vectors = generator.normal(size=(VectorIndex.INITIAL_CAPACITY + 10, 16))
+
+    index = VectorIndex(tmp_path / "vectors.f32")
+    for number, vector in enumerate(vectors):
+        index.set(number, vector)
+    index.close()
+
+    index = VectorIndex(tmp_path / "vectors.f32")
+    assert len(index) == len(vectors) and index.dimensions == 16
+    hits = index.search(vectors[7] * 3, top_k=3)
+    assert hits[0][0] == 7 and abs(hits[0][1] - 1) < 1e-5 and hits[0][1] >= hits[1][1] >= hits[2][1]
+    assert [number for number, _ in index.search(vectors[7], top_k=3, start=100, end=110)] != [7]
+    assert all(100 <= number < 110 for number, _ in index.search(vectors[7], top_k=3, start=100, end=110))
+
+
+def test_vectors_of_a_different_size_replace_the_index(tmp_path):
+    index = VectorIndex(tmp_path / "vectors.f32")
+    index.set(0, [1.0, 0.0])
+    index.set(1, [0.0, 1.0])
+    index.set(0, [1.0, 0.0, 0.0])
+    assert len(index) == 1 and index.dimensions == 3
+
+
+def test_the_number_of_vectors_is_written_when_the_index_is_flushed(tmp_path):
+    index = VectorIndex(tmp_path / "vectors.f32")
+    for number in range(3):
+        index.set(number, [1.0, float(number)])
+    assert len(VectorIndex(tmp_path / "vectors.f32")) == 0
+
+    index.flush()
+    assert len(VectorIndex(tmp_path / "vectors.f32")) == 3